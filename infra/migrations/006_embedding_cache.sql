@@ -0,0 +1,13 @@
+-- 查询向量缓存：key = sha256(model || '\0' || text)
+-- embedding 不限定维度，换模型（维度不同）也能共存；model 不同的行由 core 启动时清理
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model        text        NOT NULL,
+    text_hash    bytea       NOT NULL,
+    embedding    vector      NOT NULL,
+    created_at   timestamptz NOT NULL DEFAULT NOW(),
+    last_hit_at  timestamptz NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (model, text_hash)
+);
+
+-- 便于按最近命中时间清理冷数据：DELETE FROM embedding_cache WHERE last_hit_at < NOW() - INTERVAL '30 days';
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_hit ON embedding_cache(last_hit_at);
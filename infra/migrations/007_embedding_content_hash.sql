@@ -0,0 +1,7 @@
+-- 增量重嵌：content_hash = sha256(拼给 embedding 的文本)，由 jira_sync 写入；
+-- embedding_hash / embedding_model 记录当前向量对应的文本和模型，由 embed_jira 写入。
+-- 两个 hash 不同或模型不同的行才需要重新 embedding。
+ALTER TABLE jira_issues
+  ADD COLUMN IF NOT EXISTS content_hash    bytea,
+  ADD COLUMN IF NOT EXISTS embedding_hash  bytea,
+  ADD COLUMN IF NOT EXISTS embedding_model text;
@@ -0,0 +1,22 @@
+-- ivfflat -> HNSW（需要 pgvector >= 0.5）
+-- ivfflat 在空表上建的，聚类中心没有意义；HNSW 不需要训练数据，随写入增量维护。
+-- 参数可用 psql 变量覆盖：psql -v m=24 -v ef_construction=128 -f 008_hnsw_index.sql
+-- 之后语料规模变化较大时用 jobs/reindex_vectors.py 在线重建。
+\if :{?m}
+\else
+  \set m 16
+\endif
+\if :{?ef_construction}
+\else
+  \set ef_construction 64
+\endif
+
+SET maintenance_work_mem = '512MB';
+
+-- 先建新索引再删旧的，中间不会出现没有索引的窗口
+CREATE INDEX IF NOT EXISTS idx_jira_issues_embedding_hnsw
+  ON jira_issues
+  USING hnsw (embedding vector_cosine_ops)
+  WITH (m = :m, ef_construction = :ef_construction);
+
+DROP INDEX IF EXISTS idx_jira_issues_embedding_cosine;
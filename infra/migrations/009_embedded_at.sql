@@ -0,0 +1,6 @@
+-- embedded_at：embed_jira 写入向量的时间；core 的进程内向量索引按它增量拉取
+ALTER TABLE jira_issues
+  ADD COLUMN IF NOT EXISTS embedded_at timestamptz;
+
+CREATE INDEX IF NOT EXISTS idx_jira_issues_project_embedded_at
+  ON jira_issues(project_key, embedded_at);
@@ -0,0 +1,8 @@
+-- jira_issues.raw 改用 lz4 压缩（PG14+，服务器需带 lz4 编译；官方镜像都有）
+-- 只影响之后写入的值；已有行在下次同步 / jira_sync.py --slim-raw 改写时才换成 lz4
+DO $$
+BEGIN
+  ALTER TABLE jira_issues ALTER COLUMN raw SET COMPRESSION lz4;
+EXCEPTION WHEN feature_not_supported THEN
+  RAISE NOTICE 'lz4 not supported by this server, jira_issues.raw stays pglz';
+END $$;
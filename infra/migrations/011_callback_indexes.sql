@@ -0,0 +1,4 @@
+-- 回调按 (trace_id, commit_hash) 标记点击并取最新一条的置信度；没有索引时随 notifications 增长全表扫描
+-- CONCURRENTLY 不锁写入（psql -f 逐条自动提交，不能包在事务里）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_trace_commit
+  ON notifications(trace_id, commit_hash, delivered_at DESC);
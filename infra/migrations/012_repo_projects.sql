@@ -0,0 +1,8 @@
+-- repo -> Jira 项目路由：core 只在 commit 所在仓库对应的项目里检索；没有配置的仓库走 JIRA_PROJECT_KEY
+-- repo 写 "owner/name"，或 "owner/*" 匹配该 owner 下所有仓库，"*" 兜底
+CREATE TABLE IF NOT EXISTS repo_projects (
+  repo         TEXT NOT NULL,
+  project_key  TEXT NOT NULL,
+  created_at   TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (repo, project_key)
+);
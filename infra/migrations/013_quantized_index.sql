@@ -0,0 +1,26 @@
+-- 量化 ANN 索引（需要 pgvector >= 0.7：halfvec / binary_quantize / bit_hamming_ops）
+-- 表里仍存 float32 原值：量化只发生在索引表达式里，写入路径不变，检索时按原值精确重排
+-- 可选：不带变量时什么都不做（也不升级扩展）。二选一：
+--   psql -v binary=1  -f 013_quantized_index.sql   -- 每维 1 bit，1024 维 128 字节
+--   psql -v halfvec=1 -f 013_quantized_index.sql   -- 半精度
+-- 也可以不跑本文件，用 jobs/reindex_vectors.py --quant binary|halfvec 在线建（保留 float32 索引，加 --replace-all 才一并删掉）。
+-- 建完后 core / reco_search.py 设置 PG_VECTOR_QUANT=binary（或 halfvec）才会用到；
+-- 确认效果后可删掉 float32 索引：DROP INDEX CONCURRENTLY idx_jira_issues_embedding_hnsw;
+-- CONCURRENTLY 不锁写入（psql -f 逐条自动提交，不能包在事务里）
+\if :{?halfvec}
+ALTER EXTENSION vector UPDATE;
+SET maintenance_work_mem = '512MB';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jira_issues_embedding_hnsw_halfvec
+  ON jira_issues
+  USING hnsw ((embedding::halfvec(1024)) halfvec_cosine_ops)
+  WITH (m = 16, ef_construction = 64);
+\elif :{?binary}
+ALTER EXTENSION vector UPDATE;
+SET maintenance_work_mem = '512MB';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jira_issues_embedding_hnsw_binary
+  ON jira_issues
+  USING hnsw ((binary_quantize(embedding)::bit(1024)) bit_hamming_ops)
+  WITH (m = 16, ef_construction = 64);
+\else
+\echo '013: skipped (pass -v binary=1 or -v halfvec=1, or use reindex_vectors.py --quant)'
+\endif
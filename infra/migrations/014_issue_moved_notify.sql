@@ -0,0 +1,20 @@
+-- issue 换项目（project_key 变化）时通知 core 的进程内向量索引：
+--   NOTIFY jira_issue_moved {"key", "from"}，旧项目的索引据此删掉这一行；
+--   已有向量的行刷新 embedded_at，新项目的索引按水位增量拉到它（向量本身不用重算）
+-- jira_events / jira_sync 两条写入路径都走这里，不用各自判断
+CREATE OR REPLACE FUNCTION jira_issues_project_moved() RETURNS trigger AS $$
+BEGIN
+  IF NEW.embedding IS NOT NULL THEN
+    NEW.embedded_at := NOW();
+  END IF;
+  PERFORM pg_notify('jira_issue_moved', json_build_object('key', OLD.jira_key, 'from', OLD.project_key)::text);
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_jira_issues_project_moved ON jira_issues;
+CREATE TRIGGER trg_jira_issues_project_moved
+  BEFORE UPDATE OF project_key ON jira_issues
+  FOR EACH ROW
+  WHEN (OLD.project_key IS DISTINCT FROM NEW.project_key)
+  EXECUTE FUNCTION jira_issues_project_moved();
@@ -0,0 +1,12 @@
+-- push 汇总卡片的分组：每个 commit 及它所在组的 top-1，sender 发卡片时写入
+-- commit 太多、按钮 URL 放不下时卡片只带 trace_id（commits=* / groups=*），callback 按 trace_id 查这里
+CREATE TABLE IF NOT EXISTS push_card_commits (
+  trace_id             VARCHAR(64) NOT NULL,
+  commit_hash          VARCHAR(64) NOT NULL,
+  recommended_jira_key VARCHAR(50) NOT NULL,
+  created_at           TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (trace_id, commit_hash)
+);
+
+-- 卡片点过 / 过期后就没用了，按时间清理：DELETE FROM push_card_commits WHERE created_at < NOW() - INTERVAL '30 days';
+CREATE INDEX IF NOT EXISTS idx_push_card_commits_created ON push_card_commits(created_at);
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""webhook 发布路径压测：每个 commit 新建连接（旧实现） vs 进程级 asyncio Publisher 整批确认。
+
+用法（宿主机，RabbitMQ 已 docker compose up；需要 pip install pika aio-pika fastapi）：
+  RABBITMQ_HOST=localhost python3 scripts/bench_publish.py --pushes 50 --commits 150 --concurrency 8
+
+只往独立的 bench 队列发消息，结束后删除该队列，不影响 git_commit_raw。
+"""
+import os, sys, json, time, asyncio, argparse, importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _load_webhook():
+    spec = importlib.util.spec_from_file_location("webhook_main", os.path.join(ROOT, "services", "webhook", "main.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def _fake_push(n_commits: int, seq: int):
+    return {
+        "repository": {"full_name": "bench/repo"},
+        "commits": [{
+            "id": f"{seq:08x}{i:032x}",
+            "message": f"bench commit {i}",
+            "author": {"email": "bench@example.com"},
+            "added": ["a.py"], "modified": ["b.py"], "removed": []
+        } for i in range(n_commits)]
+    }
+
+def _pika_params(wh):
+    import pika
+    creds = pika.PlainCredentials(wh.RABBITMQ_USER, wh.RABBITMQ_PASSWORD)
+    return pika.ConnectionParameters(host=wh.RABBITMQ_HOST, credentials=creds)
+
+def bench_legacy(wh, queue, pushes, commits):
+    import pika
+    t0 = time.perf_counter()
+    for s in range(pushes):
+        for _, body in wh.build_messages(_fake_push(commits, s))[1]:
+            conn = pika.BlockingConnection(_pika_params(wh))
+            ch = conn.channel()
+            ch.queue_declare(queue=queue, durable=True)
+            ch.basic_publish(exchange="", routing_key=queue, body=body, properties=pika.BasicProperties(delivery_mode=2))
+            conn.close()
+    return time.perf_counter() - t0
+
+async def bench_pooled(wh, queue, pushes, commits, concurrency):
+    pub = wh.Publisher(queue=queue)
+    await pub.start()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(s):
+        async with sem:
+            await pub.publish_batch([b for _, b in wh.build_messages(_fake_push(commits, s))[1]])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(s) for s in range(pushes)))
+    dt = time.perf_counter() - t0
+    await pub.close()
+    return dt
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pushes", type=int, default=20)
+    ap.add_argument("--commits", type=int, default=150, help="commits per push")
+    ap.add_argument("--queue", default="bench_git_commit_raw")
+    ap.add_argument("--concurrency", type=int, default=4, help="concurrent pushes on the pooled path")
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    wh = _load_webhook()
+    res = {"pushes": args.pushes, "commits_per_push": args.commits, "concurrency": args.concurrency}
+    if not args.skip_legacy:
+        dt = bench_legacy(wh, args.queue, args.pushes, args.commits)
+        res["legacy"] = {"seconds": round(dt, 3), "pushes_per_sec": round(args.pushes / dt, 2)}
+        print(f"[LEGACY] {dt:.2f}s  {args.pushes/dt:.2f} pushes/s", flush=True)
+    dt = asyncio.run(bench_pooled(wh, args.queue, args.pushes, args.commits, args.concurrency))
+    res["pooled"] = {"seconds": round(dt, 3), "pushes_per_sec": round(args.pushes / dt, 2)}
+    print(f"[POOLED] {dt:.2f}s  {args.pushes/dt:.2f} pushes/s", flush=True)
+
+    import pika
+    conn = pika.BlockingConnection(_pika_params(wh))
+    conn.channel().queue_delete(queue=args.queue)
+    conn.close()
+    print(json.dumps(res))
+
+if __name__ == "__main__":
+    sys.exit(main())
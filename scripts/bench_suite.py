@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""离线端到端压测：embedding / 钉钉 / Jira 全部用本地替身（scripts/fakes.py），只依赖一个 Postgres。
+
+场景（--scenarios 逗号分隔，默认全部）：
+  webhook  ingest 吞吐与请求延迟（进程内 ASGI；默认用内存发布器，--rabbitmq 时发到真实 broker 的 bench 队列）
+  core     process_batch 单条消息延迟 p50/p95/p99，及 embedding / 检索分阶段耗时
+  search   不同语料规模下的向量检索延迟：Postgres（单条 / 整批）与进程内 NumPy 索引
+  sync     jira_sync 从假 Jira 全量同步，issues/s
+  embed    embed_jira 回填 embedding，rows/s
+  ding     钉钉发送（post_card）单条延迟与吞吐，不含令牌桶等待
+
+用法（宿主机，Postgres 已迁移到最新；请用开发库，语料写在 BENCH* 项目下）：
+  POSTGRES_HOST=localhost python3 scripts/bench_suite.py --sizes 10000,100000
+  python3 scripts/bench_suite.py --scenarios search --sizes 1000000
+  python3 scripts/bench_suite.py --compare bench-results/old.json
+
+结果写到 bench-results/<时间>-<git rev>.json；--compare 打印与旧结果的逐项比值。
+"""
+import os, sys, io, json, time, zlib, hmac, hashlib, asyncio, argparse, platform, subprocess, contextlib, importlib.util
+import datetime as dt
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+import fakes
+
+BENCH_MODEL = "bench-fake-embedding"
+BENCH_SECRET = "bench-secret"
+
+# ---------- helpers ----------
+def pct(xs_ms) -> dict:
+    if not len(xs_ms):
+        return {"n": 0}
+    a = np.asarray(xs_ms, dtype=np.float64)
+    return {"n": int(a.size), "mean": round(float(a.mean()), 3), "p50": round(float(np.percentile(a, 50)), 3),
+            "p95": round(float(np.percentile(a, 95)), 3), "p99": round(float(np.percentile(a, 99)), 3),
+            "max": round(float(a.max()), 3)}
+
+@contextlib.contextmanager
+def quiet():
+    # 被测代码每条消息都 print，压测时吞掉
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def log(msg: str):
+    print(msg, file=sys.stderr, flush=True)
+
+def _dsn():
+    return (f"host={os.getenv('POSTGRES_HOST','postgres')} dbname={os.getenv('POSTGRES_DB','contextual')} "
+            f"user={os.getenv('POSTGRES_USER','postgres')} password={os.getenv('POSTGRES_PASSWORD','postgres')}")
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+def _fake_push(n_commits: int, seq: int):
+    return {
+        "repository": {"full_name": "bench/repo"},
+        "commits": [{
+            "id": hashlib.sha1(f"{seq}-{i}".encode()).hexdigest(),
+            "message": " ".join(fakes.WORDS[(seq * 7 + i * 3 + j) % len(fakes.WORDS)] for j in range(6)),
+            "author": {"email": "bench@example.com"},
+            "added": [f"src/mod{i % 13}.py"], "modified": [f"src/util{seq % 11}.py"], "removed": []
+        } for i in range(n_commits)]
+    }
+
+def _load(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+_core = None
+
+def core_main():
+    """导入 core/main.py（环境变量需在此之前设置好）。"""
+    global _core
+    if _core is None:
+        sys.path.insert(0, os.path.join(ROOT, "services", "core"))
+        sys.path.insert(0, os.path.join(ROOT, "services", "core", "jobs"))
+        _core = _load("core_main", os.path.join(ROOT, "services", "core", "main.py"))
+        _core.PG_POOL.open()
+    return _core
+
+# ---------- 语料 ----------
+def ensure_corpus(project: str, n: int, dim: int, with_vectors: bool = True):
+    """BENCH 项目下生成 n 条 issue（随机单位向量，二进制 COPY）；行数一致则复用。"""
+    import psycopg
+    sys.path.insert(0, os.path.join(ROOT, "services", "core"))
+    import pgvec
+    with psycopg.connect(_dsn()) as conn:
+        pgvec.configure(conn)
+        have = conn.execute("SELECT count(*), count(embedding) FROM jira_issues WHERE project_key=%s", (project,)).fetchone()
+        if have[0] == n and (not with_vectors or have[1] == n):
+            return False
+        log(f"[CORPUS] building {project} rows={n} vectors={with_vectors}")
+        conn.execute("DELETE FROM jira_issues WHERE project_key=%s", (project,))
+        rng = np.random.default_rng(zlib.crc32(project.encode()))
+        t0 = time.perf_counter()
+        cols = "jira_key, project_key, title, description, url" + (", embedding, embedded_at" if with_vectors else "")
+        with conn.cursor().copy(f"COPY jira_issues ({cols}) FROM STDIN WITH (FORMAT BINARY)") as cp:
+            cp.set_types(["text", "text", "text", "text", "text"] + (["vector", "timestamptz"] if with_vectors else []))
+            now = dt.datetime.now(dt.timezone.utc)
+            for s in range(0, n, 10000):
+                m = min(10000, n - s)
+                vecs = None
+                if with_vectors:
+                    vecs = rng.standard_normal((m, dim)).astype(np.float32)
+                    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+                for j in range(m):
+                    i = s + j
+                    it = fakes.synthetic_issue(project, i)
+                    f = it["fields"]
+                    desc = " ".join(c["content"][0]["text"] for c in f["description"]["content"])
+                    row = [it["key"], project, f["summary"], desc, f"https://bench.invalid/browse/{it['key']}"]
+                    if with_vectors:
+                        row += [vecs[j], now]
+                    cp.write_row(row)
+        conn.commit()
+        conn.execute("ANALYZE jira_issues")
+        log(f"[CORPUS] {project} built in {time.perf_counter() - t0:.1f}s")
+        return True
+
+def drop_corpora():
+    import psycopg
+    with psycopg.connect(_dsn()) as conn:
+        n = conn.execute("DELETE FROM jira_issues WHERE project_key LIKE 'BENCH%%'").rowcount
+        conn.execute("DELETE FROM jira_sync_state WHERE project_key LIKE 'BENCH%%'")
+        conn.execute("DELETE FROM jira_projects WHERE project_key LIKE 'BENCH%%'")
+        conn.execute("DELETE FROM embedding_cache WHERE model=%s", (BENCH_MODEL,))
+    log(f"[CORPUS] dropped {n} bench rows")
+
+# ---------- 场景 ----------
+class _NullPublisher:
+    async def publish_batch(self, bodies, queue=None):
+        await asyncio.sleep(0)
+        return len(bodies)
+
+def bench_webhook(args) -> dict:
+    import httpx
+    wh = _load("webhook_main", os.path.join(ROOT, "services", "webhook", "main.py"))
+    pushes = [json.dumps(_fake_push(args.commits, s)).encode() for s in range(args.pushes)]
+
+    async def go():
+        if args.rabbitmq:
+            wh.publisher = wh.Publisher(queue="bench_git_commit_raw")
+            await wh.publisher.start()
+        else:
+            wh.publisher = _NullPublisher()
+        lat = []
+        sem = asyncio.Semaphore(args.concurrency)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=wh.app), base_url="http://bench") as c:
+            async def one(body):
+                sig = "sha256=" + hmac.new(BENCH_SECRET.encode(), body, hashlib.sha256).hexdigest()
+                async with sem:
+                    t0 = time.perf_counter()
+                    r = await c.post("/ingest/git", content=body, headers={"X-Hub-Signature-256": sig})
+                    lat.append((time.perf_counter() - t0) * 1000)
+                    r.raise_for_status()
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(b) for b in pushes))
+            wall = time.perf_counter() - t0
+        if args.rabbitmq:
+            await wh.publisher.close()
+        return wall, lat
+
+    wall, lat = asyncio.run(go())
+    return {"publisher": "rabbitmq" if args.rabbitmq else "null", "pushes": args.pushes, "commits_per_push": args.commits,
+            "concurrency": args.concurrency, "pushes_per_s": round(args.pushes / wall, 1),
+            "commits_per_s": round(args.pushes * args.commits / wall, 1), "latency_ms": pct(lat)}
+
+class _Chan:
+    """process_batch 用到的 channel 方法；记录每条消息的 ack/nack 时间。"""
+
+    def __init__(self):
+        self.done = {}
+        self.published = 0
+
+    def basic_ack(self, delivery_tag):
+        self.done[delivery_tag] = time.perf_counter()
+
+    def basic_nack(self, delivery_tag, requeue=False):
+        self.done[delivery_tag] = time.perf_counter()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published += 1
+
+def bench_core(args) -> dict:
+    project = f"BENCH{args.sizes[0]}"
+    ensure_corpus(project, args.sizes[0], args.dim)
+    m = core_main()
+    m.JIRA_PROJECT_KEY = project
+
+    # 分阶段计时：包一层 embedding / 检索
+    stage = {"embed": [], "search": []}
+    embed0, search0 = m.embed_texts, m.search_candidates
+    def timed(name, fn):
+        def w(*a, **kw):
+            t0 = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                stage[name].append((time.perf_counter() - t0) * 1000)
+        return w
+    m.embed_texts, m.search_candidates = timed("embed", embed0), timed("search", search0)
+
+    bodies = []
+    for s in range(args.messages):
+        _, msgs, _ = m_webhook_messages(_fake_push(1, 10_000_000 + s))
+        bodies.append(msgs[0][1])
+    lat, batch_ms, chan = [], [], _Chan()
+    tag = 0
+    t_start = time.perf_counter()
+    try:
+        with quiet():
+            for s in range(0, len(bodies), args.batch):
+                batch = []
+                for b in bodies[s:s + args.batch]:
+                    tag += 1
+                    batch.append((tag, b))
+                t0 = time.perf_counter()
+                m.process_batch(chan, batch)
+                batch_ms.append((time.perf_counter() - t0) * 1000)
+                lat.extend((chan.done[t] - t0) * 1000 for t, _ in batch if t in chan.done)
+    finally:
+        m.embed_texts, m.search_candidates = embed0, search0
+    wall = time.perf_counter() - t_start
+    return {"corpus": args.sizes[0], "messages": len(bodies), "batch_size": args.batch,
+            "msgs_per_s": round(len(bodies) / wall, 1), "cards_enqueued": chan.published,
+            "latency_ms": pct(lat), "batch_ms": pct(batch_ms),
+            "stage_ms": {"embed": pct(stage["embed"]), "search": pct(stage["search"])}}
+
+_wh_build = None
+
+def m_webhook_messages(payload):
+    # 与线上一致的消息体：直接用 webhook 的 build_messages
+    global _wh_build
+    if _wh_build is None:
+        _wh_build = _load("webhook_build", os.path.join(ROOT, "services", "webhook", "main.py")).build_messages
+    return _wh_build(payload)
+
+def bench_search(args) -> dict:
+    m = core_main()
+    from vector_index import VectorIndex
+    rng = np.random.default_rng(42)
+    out = {}
+    for n in args.sizes:
+        project = f"BENCH{n}"
+        ensure_corpus(project, n, args.dim)
+        qs = [v / np.linalg.norm(v) for v in rng.standard_normal((args.queries, args.dim)).astype(np.float32)]
+        res = {}
+
+        m.search_topk_batch(project, qs[:1], 3)  # 预热（prepare / 缓存）
+        lat = []
+        for q in qs:
+            t0 = time.perf_counter(); m.search_topk_batch(project, [q], 3); lat.append((time.perf_counter() - t0) * 1000)
+        res["pg_single_ms"] = pct(lat)
+        lat = []
+        for s in range(0, len(qs), args.batch):
+            t0 = time.perf_counter(); m.search_topk_batch(project, qs[s:s + args.batch], 3); lat.append((time.perf_counter() - t0) * 1000)
+        res["pg_batch_ms"] = pct(lat)
+
+        vi = VectorIndex(project, _dsn(), BENCH_MODEL, snapshot_dir="", refresh_s=3600)
+        with quiet():
+            vi.start()
+            while not vi.ready and vi.stats["errors"] == 0:
+                time.sleep(0.05)
+        if vi.ready:
+            lat = []
+            for q in qs:
+                t0 = time.perf_counter(); vi.search_batch([q], 3); lat.append((time.perf_counter() - t0) * 1000)
+            res["numpy_single_ms"] = pct(lat)
+            lat = []
+            for s in range(0, len(qs), args.batch):
+                t0 = time.perf_counter(); vi.search_batch(qs[s:s + args.batch], 3); lat.append((time.perf_counter() - t0) * 1000)
+            res["numpy_batch_ms"] = pct(lat)
+            res["numpy_load_s"] = vi.stats["load_s"]
+            # 顺带看 ANN 召回：Postgres 结果与精确 Top-K（NumPy）的重合率
+            hit = tot = 0
+            for s in range(0, min(len(qs), 200), args.batch):
+                exact = vi.search_batch(qs[s:s + args.batch], 3)
+                approx = m.search_topk_batch(project, qs[s:s + args.batch], 3)
+                for e, a in zip(exact, approx):
+                    hit += len({k for k, _ in e} & {k for k, _ in a}); tot += len(e)
+            res["pg_recall_at_3"] = round(hit / tot, 4) if tot else None
+        with quiet():
+            vi.close()
+        out[str(n)] = res
+        log(f"[SEARCH] n={n} pg p50={res['pg_single_ms'].get('p50')}ms numpy p50={res.get('numpy_single_ms', {}).get('p50')}ms")
+    return {"batch_size": args.batch, "queries": args.queries, "by_corpus": out}
+
+def bench_sync(args, jira_url: str) -> dict:
+    sys.path.insert(0, os.path.join(ROOT, "services", "core", "jobs"))
+    js = _load("bench_jira_sync", os.path.join(ROOT, "services", "core", "jobs", "jira_sync.py"))
+    js.JIRA_URL = jira_url
+    t0 = time.perf_counter()
+    with quiet():
+        js.sync_project("BENCHSYNC", full=True)
+    wall = time.perf_counter() - t0
+    return {"issues": args.sync_issues, "jira_latency_ms": args.jira_latency_ms, "seconds": round(wall, 2),
+            "issues_per_s": round(args.sync_issues / wall, 1)}
+
+def bench_embed(args, jira_url: str) -> dict:
+    import psycopg
+    with psycopg.connect(_dsn()) as conn:
+        have = conn.execute("SELECT count(*) FROM jira_issues WHERE project_key='BENCHSYNC'").fetchone()[0]
+        if have < args.sync_issues:
+            bench_sync(args, jira_url)
+        # 清掉向量，整项目重新回填
+        conn.execute("UPDATE jira_issues SET embedding=NULL, embedding_hash=NULL, embedded_at=NULL WHERE project_key='BENCHSYNC'")
+    ej = _load("bench_embed_jira", os.path.join(ROOT, "services", "core", "jobs", "embed_jira.py"))
+    t0 = time.perf_counter()
+    with quiet():
+        ej.run("BENCHSYNC", batch_size=args.embed_batch, limit=args.sync_issues, concurrency=args.embed_concurrency)
+    wall = time.perf_counter() - t0
+    return {"rows": args.sync_issues, "batch": args.embed_batch, "concurrency": args.embed_concurrency,
+            "embed_latency_ms": args.embed_latency_ms, "per_item_ms": args.embed_per_item_ms,
+            "seconds": round(wall, 2), "rows_per_s": round(args.sync_issues / wall, 1)}
+
+def bench_ding(args) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+    sys.path.insert(0, os.path.join(ROOT, "services", "core"))
+    import dingtalk
+    card = dingtalk.render_action_card("trace", "abc123", "bench/repo", "BENCH-1", candidates=[("BENCH-1", 0.9), ("BENCH-2", 0.8)], score=0.9)
+    lat = []
+    def one(_):
+        t0 = time.perf_counter(); dingtalk.post_card(card); lat.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    with quiet(), ThreadPoolExecutor(max_workers=args.ding_concurrency) as ex:
+        list(ex.map(one, range(args.ding_messages)))
+    wall = time.perf_counter() - t0
+    return {"messages": args.ding_messages, "concurrency": args.ding_concurrency, "fake_latency_ms": args.ding_latency_ms,
+            "sends_per_s": round(args.ding_messages / wall, 1), "latency_ms": pct(lat)}
+
+# ---------- 元信息 / 对比 ----------
+def meta(args) -> dict:
+    info = {"git_rev": _git_rev(), "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "args": vars(args)}
+    try:
+        import psycopg
+        with psycopg.connect(_dsn()) as conn:
+            info["postgres"] = conn.execute("SHOW server_version").fetchone()[0]
+            info["pgvector"] = (conn.execute("SELECT extversion FROM pg_extension WHERE extname='vector'").fetchone() or [None])[0]
+            info["vector_indexes"] = [r[0] for r in conn.execute(
+                "SELECT indexdef FROM pg_indexes WHERE tablename='jira_issues' AND indexdef ~ '(hnsw|ivfflat)'").fetchall()]
+    except Exception as e:
+        info["postgres_error"] = str(e)
+    return info
+
+def _flatten(d, prefix=""):
+    for k, v in d.items():
+        p = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            yield from _flatten(v, p)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield p, v
+
+_PARAM_KEYS = {"n", "pushes", "commits_per_push", "concurrency", "batch_size", "batch", "queries", "messages", "rows",
+               "issues", "corpus", "jira_latency_ms", "embed_latency_ms", "per_item_ms", "fake_latency_ms"}
+
+def compare(old_path: str, new: dict):
+    with open(old_path) as f:
+        old = json.load(f)
+    a, b = dict(_flatten(old.get("results", {}))), dict(_flatten(new.get("results", {})))
+    print(f"\n== compare {old.get('meta', {}).get('git_rev')} -> {new['meta']['git_rev']} ==")
+    for k in sorted(set(a) & set(b)):
+        # 只比结果，不比参数
+        if a[k] and k.rsplit(".", 1)[-1] not in _PARAM_KEYS:
+            print(f"  {k:60s} {a[k]:>12} -> {b[k]:>12}  x{b[k] / a[k]:.2f}")
+
+# ---------- main ----------
+SCENARIOS = ("webhook", "core", "search", "sync", "embed", "ding")
+
+def _argv():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--sizes", default="10000", help="corpus sizes for search/core, e.g. 10000,100000,1000000")
+    ap.add_argument("--dim", type=int, default=int(os.getenv("EMBED_DIM", "1024")))
+    ap.add_argument("--out", default=None, help="result JSON path (default bench-results/<ts>-<rev>.json)")
+    ap.add_argument("--compare", default=None, help="previous result JSON to diff against")
+    ap.add_argument("--drop-corpora", action="store_true", help="delete BENCH* rows at the end")
+    # webhook
+    ap.add_argument("--pushes", type=int, default=500)
+    ap.add_argument("--commits", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--rabbitmq", action="store_true", help="publish to a real broker (bench queue) instead of a null publisher")
+    # core / search
+    ap.add_argument("--messages", type=int, default=2000)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--queries", type=int, default=500)
+    # sync / embed
+    ap.add_argument("--sync-issues", type=int, default=10000)
+    ap.add_argument("--jira-latency-ms", type=float, default=50)
+    ap.add_argument("--embed-batch", type=int, default=32)
+    ap.add_argument("--embed-concurrency", type=int, default=4)
+    ap.add_argument("--embed-latency-ms", type=float, default=5)
+    ap.add_argument("--embed-per-item-ms", type=float, default=0.2)
+    # ding
+    ap.add_argument("--ding-messages", type=int, default=200)
+    ap.add_argument("--ding-concurrency", type=int, default=1)
+    ap.add_argument("--ding-latency-ms", type=float, default=30)
+    args = ap.parse_args()
+    args.sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    bad = set(args.scenarios) - set(SCENARIOS)
+    if bad:
+        ap.error(f"unknown scenarios: {sorted(bad)}")
+    return args
+
+def main():
+    args = _argv()
+    _, emb_url, emb_stats = fakes.start_embeddings(args.dim, args.embed_latency_ms, args.embed_per_item_ms)
+    _, ding_url, _ = fakes.start_dingtalk(args.ding_latency_ms)
+    _, jira_url, _ = fakes.start_jira("BENCHSYNC", args.sync_issues, args.jira_latency_ms)
+
+    # 被测模块在 import 时读取环境变量：必须先设置好
+    os.environ.update({
+        "EMBED_API_BASE": emb_url + "/v1", "EMBED_MODEL": BENCH_MODEL, "EMBED_DIM": str(args.dim),
+        "EMBED_CACHE_PURGE_OTHER_MODELS": "0",   # 不能清掉线上模型的缓存行
+        "DEDUP_ENABLED": "0", "RECO_MIN_SCORE": "-1",
+        "DINGTALK_WEBHOOK_URL": ding_url + "/robot/send?access_token=bench", "DINGTALK_SECRET": "bench",
+        "GIT_WEBHOOK_SECRET": BENCH_SECRET, "JIRA_URL": jira_url, "JIRA_EMAIL": "bench", "JIRA_API_TOKEN": "bench",
+        "CORE_CONSUMERS": "0",
+    })
+
+    runners = {
+        "webhook": lambda: bench_webhook(args),
+        "core": lambda: bench_core(args),
+        "search": lambda: bench_search(args),
+        "sync": lambda: bench_sync(args, jira_url),
+        "embed": lambda: bench_embed(args, jira_url),
+        "ding": lambda: bench_ding(args),
+    }
+    result = {"meta": meta(args), "results": {}}
+    for name in args.scenarios:
+        log(f"[RUN] {name}")
+        t0 = time.perf_counter()
+        try:
+            result["results"][name] = runners[name]()
+        except Exception as e:
+            result["results"][name] = {"error": f"{type(e).__name__}: {e}"}
+            log(f"[ERR] {name}: {type(e).__name__}: {e}")
+        log(f"[RUN] {name} done in {time.perf_counter() - t0:.1f}s")
+    result["meta"]["fake_embeddings"] = dict(emb_stats)
+
+    if args.drop_corpora:
+        drop_corpora()
+    if _core is not None:
+        _core.PG_POOL.close()
+
+    out = args.out or os.path.join(ROOT, "bench-results",
+                                   f"{dt.datetime.now().strftime('%Y%m%d-%H%M%S')}-{result['meta']['git_rev']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False, default=str)
+    print(json.dumps(result["results"], indent=2, ensure_ascii=False))
+    print(f"\n[SAVED] {out}")
+    if args.compare:
+        compare(args.compare, result)
+
+if __name__ == "__main__":
+    main()
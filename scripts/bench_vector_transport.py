@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""pgvector 传输方式对比：文本字面量 vs 二进制（%b / binary COPY）。
+
+离线部分（不需要数据库）：每次查询 / 每 1k 行写入的线上字节数、客户端编码 CPU 时间。
+在线部分（--dsn 给出时）：真实查询延迟与 1k 行写入耗时；写入在事务里执行后回滚，不改数据。
+
+  python3 scripts/bench_vector_transport.py --dim 1024
+  python3 scripts/bench_vector_transport.py --dsn "host=localhost dbname=contextual user=postgres password=postgres" --project SCRUM
+"""
+import os, sys, json, time, argparse
+
+import numpy as np
+from pgvector import Vector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "core"))
+import pgvec
+
+def _timeit(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n
+
+def offline(dim: int, rows: int, reps: int):
+    rng = np.random.default_rng(0)
+    q = rng.standard_normal(dim).astype(np.float32)
+    batch = rng.standard_normal((rows, dim)).astype(np.float32)
+
+    text_q = pgvec.text_literal(q)
+    bin_q = Vector(q).to_binary()
+    res = {
+        "dim": dim,
+        "query": {
+            # 旧 search_topk 把同一个字面量发两次
+            "text_bytes": 2 * len(text_q.encode()),
+            "binary_bytes": len(bin_q),
+            "text_encode_us": round(_timeit(lambda: pgvec.text_literal(q), reps) * 1e6, 1),
+            "binary_encode_us": round(_timeit(lambda: Vector(q).to_binary(), reps) * 1e6, 1),
+        },
+    }
+    reps_w = max(1, reps // 100)
+    res[f"write_{rows}"] = {
+        "text_bytes": sum(len(pgvec.text_literal(v).encode()) for v in batch),
+        "binary_bytes": sum(len(Vector(v).to_binary()) for v in batch),
+        "text_encode_ms": round(_timeit(lambda: [pgvec.text_literal(v) for v in batch], reps_w) * 1e3, 2),
+        "binary_encode_ms": round(_timeit(lambda: [Vector(v).to_binary() for v in batch], reps_w) * 1e3, 2),
+    }
+    return res
+
+def online(dsn: str, project: str, dim: int, rows: int, reps: int):
+    import psycopg
+    rng = np.random.default_rng(1)
+    q = rng.standard_normal(dim).astype(np.float32)
+    out = {}
+    with psycopg.connect(dsn) as conn:
+        pgvec.configure(conn)
+        cur = conn.cursor()
+        lit = pgvec.text_literal(q)
+
+        def old_q():
+            cur.execute("""
+                SELECT jira_key, (1 - (embedding <=> %s::vector)) AS score FROM jira_issues
+                WHERE project_key=%s AND embedding IS NOT NULL
+                ORDER BY embedding <=> %s::vector ASC LIMIT 3
+            """, (pgvec.text_literal(q), project, lit))
+            cur.fetchall()
+
+        def new_q():
+            cur.execute("""
+                SELECT jira_key, (1 - d) AS score FROM (
+                    SELECT jira_key, embedding <=> %b AS d FROM jira_issues
+                    WHERE project_key=%s AND embedding IS NOT NULL ORDER BY d ASC LIMIT 3) s
+                ORDER BY d ASC
+            """, (q, project))
+            cur.fetchall()
+
+        old_q(); new_q()
+        out["query_ms"] = {"text": round(_timeit(old_q, reps) * 1e3, 3), "binary": round(_timeit(new_q, reps) * 1e3, 3)}
+
+        cur.execute("SELECT id FROM jira_issues WHERE project_key=%s ORDER BY id LIMIT %s", (project, rows))
+        ids = [r[0] for r in cur.fetchall()]
+        vecs = rng.standard_normal((len(ids), dim)).astype(np.float32)
+        if ids:
+            t0 = time.perf_counter()
+            for _id, v in zip(ids, vecs):
+                cur.execute("UPDATE jira_issues SET embedding = %s::vector WHERE id = %s", (pgvec.text_literal(v), _id))
+            t_text = time.perf_counter() - t0
+            conn.rollback()
+
+            t0 = time.perf_counter()
+            cur.execute("CREATE TEMP TABLE _bench_stage (id bigint, embedding vector)")
+            pgvec.copy_vectors(cur, "_bench_stage", ids, vecs)
+            cur.execute("UPDATE jira_issues j SET embedding = s.embedding FROM _bench_stage s WHERE j.id = s.id")
+            t_bin = time.perf_counter() - t0
+            conn.rollback()
+            out[f"write_{len(ids)}_ms"] = {"text_per_row_update": round(t_text * 1e3, 1), "binary_copy_merge": round(t_bin * 1e3, 1)}
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dim", type=int, default=int(os.environ.get("EMBED_DIM", "1024")))
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--reps", type=int, default=2000)
+    ap.add_argument("--dsn", help="连上真实库时附带延迟对比")
+    ap.add_argument("--project", default="SCRUM")
+    args = ap.parse_args()
+
+    res = offline(args.dim, args.rows, args.reps)
+    if args.dsn:
+        res["db"] = online(args.dsn, args.project, args.dim, args.rows, max(1, args.reps // 20))
+    print(json.dumps(res, indent=2))
+
+if __name__ == "__main__":
+    main()
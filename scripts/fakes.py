@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""离线压测用的本地替身服务：OpenAI 兼容 /embeddings、钉钉机器人、Jira search API。
+
+既可被 scripts/bench_suite.py 在进程内启动，也可以单独跑起来给 docker 里的服务用：
+  python3 scripts/fakes.py embeddings --port 1234 --dim 1024 --latency-ms 20
+  python3 scripts/fakes.py dingtalk   --port 8099
+  python3 scripts/fakes.py jira       --port 8098 --issues 10000 --project BENCH
+
+embedding 由 sha256(text) 做种子生成单位向量：同一文本永远得到同一向量，不同文本近似正交。
+"""
+import json, time, random, hashlib, threading, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+WORDS = ("login payment order cart search index cache timeout retry token session user admin report export "
+         "import upload download email notify webhook queue worker deploy config build release api gateway "
+         "database migration schema query latency memory leak crash fix refactor feature button page mobile "
+         "android ios dashboard chart filter sort pagination permission role audit log metric alert").split()
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+def synthetic_issue(project: str, i: int, updated: str = "2025-01-01T00:00:00.000+0000") -> dict:
+    """确定性的 Jira issue（REST v3 形状，description 为 ADF）。"""
+    rnd = random.Random(f"{project}-{i}")
+    title = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 8)))
+    paras = [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(8, 30))) for _ in range(rnd.randint(1, 4))]
+    return {
+        "key": f"{project}-{i + 1}",
+        "fields": {
+            "project": {"key": project},
+            "summary": title.capitalize(),
+            "description": {"type": "doc", "version": 1, "content": [
+                {"type": "paragraph", "content": [{"type": "text", "text": p}]} for p in paras
+            ]},
+            "status": {"name": rnd.choice(["To Do", "In Progress", "Done"])},
+            "priority": {"name": rnd.choice(["Low", "Medium", "High"])},
+            "assignee": None,
+            "reporter": {"accountId": f"u{rnd.randint(1, 50)}", "displayName": "Bench User"},
+            "created": "2024-12-01T00:00:00.000+0000",
+            "updated": updated,
+        },
+    }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 头和 body 分两次写：keep-alive 连接上不关 Nagle 会撞上对端的延迟 ACK（每个请求多 ~40 ms）
+    disable_nagle_algorithm = True
+    cfg: dict = {}
+
+    def log_message(self, *a):
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n)) if n else {}
+
+    def _send(self, code: int, obj):
+        b = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def _count(self, k: str, n: int = 1):
+        with self.cfg["lock"]:
+            self.cfg["stats"][k] = self.cfg["stats"].get(k, 0) + n
+
+class EmbeddingsHandler(_Handler):
+    """POST */embeddings：延迟 = latency_ms + per_item_ms × 条数；超过 max_batch 返回 413。"""
+
+    def do_POST(self):
+        js = self._body()
+        inp = js.get("input", [])
+        inp = [inp] if isinstance(inp, str) else inp
+        c = self.cfg
+        if c["max_batch"] and len(inp) > c["max_batch"]:
+            self._count("rejected")
+            return self._send(413, {"error": f"batch too large: {len(inp)} > {c['max_batch']}"})
+        time.sleep((c["latency_ms"] + c["per_item_ms"] * len(inp)) / 1000.0)
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t, c["dim"]).round(6).tolist()}
+                for i, t in enumerate(inp)]
+        self._count("requests"); self._count("items", len(inp))
+        self._send(200, {"object": "list", "model": js.get("model"), "data": data})
+
+class DingTalkHandler(_Handler):
+    """POST 任意路径：固定延迟后返回 errcode=0。"""
+
+    def do_POST(self):
+        self._body()
+        time.sleep(self.cfg["latency_ms"] / 1000.0)
+        self._count("sent")
+        self._send(200, {"errcode": 0, "errmsg": "ok"})
+
+class JiraHandler(_Handler):
+    """GET /rest/api/3/project/{key}、/rest/api/3/issue/{key}；POST /rest/api/3/search/jql（nextPageToken = 偏移量）。"""
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if "/rest/api/3/project/" in path:
+            key = path.rsplit("/", 1)[-1]
+            return self._send(200, {"key": key, "name": f"Bench {key}"})
+        if "/rest/api/3/issue/" in path:
+            proj, _, num = path.rsplit("/", 1)[-1].rpartition("-")
+            c = self.cfg
+            if proj == c["project"] and num.isdigit() and 0 < int(num) <= c["issues"]:
+                self._count("issues")
+                return self._send(200, synthetic_issue(proj, int(num) - 1))
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.path.startswith("/rest/api/3/search/jql"):
+            return self._send(404, {"error": "not found"})
+        js = self._body()
+        c = self.cfg
+        start = int(js.get("nextPageToken") or 0)
+        size = min(int(js.get("maxResults") or 100), c["page_max"])
+        end = min(start + size, c["issues"])
+        time.sleep(c["latency_ms"] / 1000.0)
+        issues = [synthetic_issue(c["project"], i) for i in range(start, end)]
+        self._count("pages"); self._count("issues", len(issues))
+        last = end >= c["issues"]
+        self._send(200, {"issues": issues, "isLast": last, **({} if last else {"nextPageToken": str(end)})})
+
+def serve(handler, host: str = "127.0.0.1", port: int = 0, **cfg):
+    """在后台线程启动；返回 (server, base_url, stats)。server.shutdown() 停止。"""
+    stats = {}
+    h = type(handler.__name__, (handler,), {"cfg": dict(cfg, stats=stats, lock=threading.Lock())})
+    srv = ThreadingHTTPServer((host, port), h)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name=f"fake-{handler.__name__}", daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}", stats
+
+def start_embeddings(dim: int = 1024, latency_ms: float = 5, per_item_ms: float = 0.2, max_batch: int = 0, port: int = 0):
+    return serve(EmbeddingsHandler, port=port, dim=dim, latency_ms=latency_ms, per_item_ms=per_item_ms, max_batch=max_batch)
+
+def start_dingtalk(latency_ms: float = 30, port: int = 0):
+    return serve(DingTalkHandler, port=port, latency_ms=latency_ms)
+
+def start_jira(project: str, issues: int, latency_ms: float = 50, page_max: int = 100, port: int = 0):
+    return serve(JiraHandler, port=port, project=project, issues=issues, latency_ms=latency_ms, page_max=page_max)
+
+def _argv():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("kind", choices=["embeddings", "dingtalk", "jira"])
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, required=True)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--latency-ms", type=float, default=None)
+    ap.add_argument("--per-item-ms", type=float, default=0.2)
+    ap.add_argument("--max-batch", type=int, default=0, help="embeddings: reject larger batches with 413 (0 = no limit)")
+    ap.add_argument("--project", default="BENCH")
+    ap.add_argument("--issues", type=int, default=10000)
+    return ap.parse_args()
+
+if __name__ == "__main__":
+    a = _argv()
+    if a.kind == "embeddings":
+        srv, url, _ = serve(EmbeddingsHandler, a.host, a.port, dim=a.dim, latency_ms=5 if a.latency_ms is None else a.latency_ms,
+                            per_item_ms=a.per_item_ms, max_batch=a.max_batch)
+        print(f"[FAKE] embeddings on {url}/v1/embeddings dim={a.dim}", flush=True)
+    elif a.kind == "dingtalk":
+        srv, url, _ = serve(DingTalkHandler, a.host, a.port, latency_ms=30 if a.latency_ms is None else a.latency_ms)
+        print(f"[FAKE] dingtalk on {url}/robot/send?access_token=bench", flush=True)
+    else:
+        srv, url, _ = serve(JiraHandler, a.host, a.port, project=a.project, issues=a.issues,
+                            latency_ms=50 if a.latency_ms is None else a.latency_ms, page_max=100)
+        print(f"[FAKE] jira on {url} project={a.project} issues={a.issues}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
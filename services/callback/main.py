@@ -1,21 +1,224 @@
-import os
+import os, json, time, threading, datetime as dt
+from collections import deque
+from contextlib import asynccontextmanager
 from typing import Optional
-from fastapi import FastAPI
-import psycopg
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from psycopg_pool import ConnectionPool
 
 POSTGRES_DSN = f"host={os.getenv('POSTGRES_HOST','postgres')} dbname={os.getenv('POSTGRES_DB','contextual')} user={os.getenv('POSTGRES_USER','postgres')} password={os.getenv('POSTGRES_PASSWORD','postgres')}"
 
-app = FastAPI()
+# 连接池：min/max/取连接超时可调；借出前健康检查
+PG_POOL = ConnectionPool(
+    POSTGRES_DSN,
+    min_size=int(os.getenv("PG_POOL_MIN", "1")),
+    max_size=max(int(os.getenv("PG_POOL_MIN", "1")), int(os.getenv("PG_POOL_MAX", "10"))),
+    timeout=float(os.getenv("PG_POOL_TIMEOUT", "10")),
+    check=ConnectionPool.check_connection,
+    name="callback",
+    open=False,
+)
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# interaction_log 写后缓冲：点击只做 notifications / commit_links，日志行攒批 COPY
+# 进程崩溃最多丢一个刷新周期的日志行；缓冲满时退回同步写入
+LOG_WRITE_BEHIND = os.getenv("CALLBACK_LOG_WRITE_BEHIND", "0") == "1"
+LOG_FLUSH_MS = int(os.getenv("CALLBACK_LOG_FLUSH_MS", "500"))
+LOG_FLUSH_ROWS = int(os.getenv("CALLBACK_LOG_FLUSH_ROWS", "500"))
+LOG_MAX_BUFFER = int(os.getenv("CALLBACK_LOG_MAX_BUFFER", "10000"))
+
+# ===== metrics =====
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+REQUEST_SECONDS = Histogram("contextual_callback_request_seconds", "DingTalk callback handling time", buckets=LATENCY_BUCKETS)
+POOL_WAIT_SECONDS = Histogram("contextual_callback_pool_wait_seconds", "Time waiting for a pooled DB connection", buckets=LATENCY_BUCKETS)
+DB_SECONDS = Histogram("contextual_callback_db_seconds", "Callback DB statement latency", ["statement"], buckets=LATENCY_BUCKETS)
+CALLBACKS = Counter("contextual_callback_total", "DingTalk callbacks by feedback", ["feedback"])
+LOG_BUFFER = Gauge("contextual_callback_log_buffer", "interaction_log rows waiting for the write-behind flush")
+LOG_FLUSHED = Counter("contextual_callback_log_flushed_total", "interaction_log rows written by the write-behind flusher")
+
+def log_event(tag: str, trace_id: str = None, **fields):
+    # 与 core/metrics.log_event 同格式：LOG_FORMAT=json 时一行一个 JSON
+    if LOG_FORMAT == "json":
+        rec = {"ts": dt.datetime.now(dt.timezone.utc).isoformat(timespec="milliseconds"), "svc": "callback", "event": tag.lower()}
+        if trace_id is not None:
+            rec["trace_id"] = trace_id
+        rec.update(fields)
+        print(json.dumps(rec, ensure_ascii=False, default=str), flush=True)
+        return
+    kv = " ".join(f"{k}={v}" for k, v in fields.items())
+    print(f"[{tag}]" + (f" trace_id={trace_id}" if trace_id is not None else "") + (f" {kv}" if kv else ""), flush=True)
+
+def _exec(cur, name: str, sql: str, params):
+    with DB_SECONDS.labels(statement=name).time():
+        cur.execute(sql, params, prepare=True)
+
+LOG_COLS = ("commit_hash", "recommended_jira_key", "user_feedback", "corrected_jira_key", "interaction_timestamp")
+
+class InteractionLogWriter:
+    """interaction_log 写后缓冲：后台线程每 LOG_FLUSH_MS 或攒够 LOG_FLUSH_ROWS 行 COPY 一次。"""
+
+    def __init__(self, pool, flush_ms: int = LOG_FLUSH_MS, flush_rows: int = LOG_FLUSH_ROWS, max_buffer: int = LOG_MAX_BUFFER):
+        self.pool = pool
+        self.flush_s = flush_ms / 1000.0
+        self.flush_rows = flush_rows
+        self.max_buffer = max_buffer
+        self._buf = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"buffered": 0, "flushed": 0, "flushes": 0, "overflow": 0, "errors": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="interaction-log-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(10)
+        self.flush()
+
+    def offer(self, row: tuple) -> bool:
+        """放进缓冲；缓冲已满返回 False，调用方同步写入。"""
+        return self.offer_many([row])
+
+    def offer_many(self, rows) -> bool:
+        """整组放进缓冲（push 卡片一次点击对应多个 commit）；放不下就整组不放，由调用方同步写入。"""
+        with self._lock:
+            if len(self._buf) + len(rows) > self.max_buffer:
+                self.stats["overflow"] += 1
+                return False
+            self._buf.extend(rows)
+            n = len(self._buf)
+        self.stats["buffered"] += len(rows)
+        LOG_BUFFER.set(n)
+        if n >= self.flush_rows:
+            self._wake.set()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.stats["errors"] += 1
+                log_event("LOG FLUSH ERROR", error=f"{type(e).__name__}: {e}", buffered=len(self._buf))
+                self._stop.wait(self.flush_s)
+
+    def flush(self) -> int:
+        with self._lock:
+            rows = list(self._buf)
+            self._buf.clear()
+        if not rows:
+            return 0
+        try:
+            with DB_SECONDS.labels(statement="log_copy").time(), self.pool.connection() as db, db.cursor() as cur:
+                with cur.copy(f"COPY interaction_log ({', '.join(LOG_COLS)}) FROM STDIN") as cp:
+                    for r in rows:
+                        cp.write_row(r)
+        except Exception:
+            # 失败的行放回队首，下次再写（超出上限的部分丢弃并计入 overflow）
+            with self._lock:
+                self._buf.extendleft(reversed(rows))
+                while len(self._buf) > self.max_buffer:
+                    self._buf.pop()
+                    self.stats["overflow"] += 1
+            raise
+        finally:
+            LOG_BUFFER.set(len(self._buf))
+        self.stats["flushed"] += len(rows)
+        self.stats["flushes"] += 1
+        LOG_FLUSHED.inc(len(rows))
+        return len(rows)
+
+LOG_WRITER = InteractionLogWriter(PG_POOL) if LOG_WRITE_BEHIND else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    PG_POOL.open()
+    if LOG_WRITER is not None:
+        LOG_WRITER.start()
+    try:
+        yield
+    finally:
+        # 先把缓冲里的日志行写完再关池子
+        if LOG_WRITER is not None:
+            LOG_WRITER.close()
+        PG_POOL.close()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
+@app.get("/metrics")
+def prom_metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats")
+def stats():
+    # requests_wait_ms / requests_queued 用来判断池子是否偏小
+    s = PG_POOL.get_stats()
+    n = s.get("requests_num", 0)
+    s["avg_wait_ms"] = round(s.get("requests_wait_ms", 0) / n, 2) if n else 0.0
+    out = {"pg_pool": s}
+    if LOG_WRITER is not None:
+        out["interaction_log_writer"] = dict(LOG_WRITER.stats, pending=len(LOG_WRITER._buf))
+    return out
+
 def _project_from(jira_key: str) -> Optional[str]:
     if not jira_key:
         return None
     return jira_key.split("-", 1)[0] if "-" in jira_key else None
 
+# 一次往返：interaction_log（未走写后缓冲时）、标记点击、按需 UPSERT commit_links；
+# commit_links 的置信度直接取被标记的那条通知，不再单独 SELECT
+# push 汇总卡片：commits 为该组的全部 commit，日志与关联逐个 commit 写；通知仍按 trace_id + push head 标记
+# 关联的 key 逐个 commit 给（“其余各组”按钮里每个 commit 关联到它自己组的 top-1）
+CALLBACK_SQL = """
+WITH log AS (
+    INSERT INTO interaction_log(commit_hash,recommended_jira_key,user_feedback,corrected_jira_key,interaction_timestamp)
+    SELECT c, rec, %(feedback)s, cor, NOW()
+    FROM unnest(%(commits)s::text[], %(recommended)s::text[], %(corrected)s::text[]) AS t(c, rec, cor)
+    WHERE %(log_inline)s
+),
+clicked AS (
+    UPDATE notifications SET clicked_at=NOW()
+    WHERE trace_id=%(trace_id)s AND commit_hash=%(commit)s
+    RETURNING confidence, delivered_at
+),
+link AS (
+    INSERT INTO commit_links (commit_hash, jira_key, project_key, confidence, trace_id, linked_at)
+    SELECT c, f, p,
+           (SELECT confidence FROM clicked ORDER BY delivered_at DESC LIMIT 1), %(trace_id)s, NOW()
+    FROM unnest(%(commits)s::text[], %(finals)s::text[], %(projects)s::text[]) AS t(c, f, p)
+    WHERE %(feedback)s
+    ON CONFLICT (commit_hash) DO UPDATE
+    SET jira_key = EXCLUDED.jira_key,
+        project_key = EXCLUDED.project_key,
+        confidence = EXCLUDED.confidence,
+        trace_id = EXCLUDED.trace_id,
+        linked_at = NOW()
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM clicked), (SELECT count(*) FROM link)
+"""
+
+# 卡片按钮里 commits= / groups= 为 * 时（大 push，URL 放不下），按 trace_id 取 sender 记下的分组
+PUSH_LOOKUP = "*"
+PUSH_COMMITS_SQL = "SELECT commit_hash, recommended_jira_key FROM push_card_commits WHERE trace_id=%s"
+
+def _push_commits(trace_id: str) -> list:
+    with PG_POOL.connection() as db, db.cursor() as cur:
+        _exec(cur, "push_commits", PUSH_COMMITS_SQL, (trace_id,))
+        return cur.fetchall()
+
 @app.get("/callback/dingtalk")
 def cb(
     trace_id: str,
@@ -24,53 +227,63 @@ def cb(
     feedback: bool,
     top1: Optional[str] = None,
     selected: Optional[str] = None,
+    commits: Optional[str] = None,   # push 汇总卡片：该组 commit 的逗号列表
+    groups: Optional[str] = None,    # push 汇总卡片 Not sure / 其余各组：KEY:h1,h2;KEY2:h3（每个 commit 各自的 top-1）
+    skip: Optional[str] = None,      # groups=* 时排除的组（已有自己按钮的 key，逗号分隔）
 ):
+    t_start = time.perf_counter()
     recommended = (top1 or jira).strip()
     clicked = (selected or jira).strip()
+    # commit -> 它的 top-1（同一 commit 只记一次）
+    recs = {}
+    if PUSH_LOOKUP in (commits, groups):
+        stored = _push_commits(trace_id)
+        if commits == PUSH_LOOKUP:
+            recs = {c: k for c, k in stored if k == recommended}
+        else:
+            skipped = set((skip or "").split(","))
+            recs = {c: k for c, k in stored if k not in skipped}
+    elif groups:
+        for g in groups.split(";"):
+            key, _, hs = g.partition(":")
+            for c in hs.split(","):
+                if c and key.strip():
+                    recs.setdefault(c, key.strip())
+    else:
+        recs = dict.fromkeys((c for c in (commits or "").split(",") if c), recommended)
+    recs = recs or {commit: recommended}
+    commit_list = list(recs)
 
     corrected = None
     if feedback and clicked and (clicked != recommended):
         corrected = clicked
+    # groups= 带 ✅（其余各组）：每个 commit 关联到它自己组的 top-1；其它按钮关联到用户点的 key
+    finals = [recs[c] if groups else clicked for c in commit_list]
+    # 逐 commit：关联的与该 commit 的推荐不同才算纠正
+    corrections = [f if feedback and f and f != recs[c] else None for c, f in zip(commit_list, finals)]
+
+    # 写后缓冲：时间戳取点击时刻，与同步写入的 NOW() 语义一致
+    now = dt.datetime.now(dt.timezone.utc)
+    log_inline = LOG_WRITER is None or not LOG_WRITER.offer_many(
+        [(c, recs[c], feedback, cor, now) for c, cor in zip(commit_list, corrections)])
 
-    with psycopg.connect(POSTGRES_DSN) as db, db.cursor() as cur:
-        # 1) 交互日志
-        cur.execute(
-            "INSERT INTO interaction_log(commit_hash,recommended_jira_key,user_feedback,corrected_jira_key,interaction_timestamp) VALUES(%s,%s,%s,%s,NOW())",
-            (commit, recommended, feedback, corrected)
-        )
-        # 2) 标记通知被点击
-        cur.execute(
-            "UPDATE notifications SET clicked_at=NOW() WHERE trace_id=%s AND commit_hash=%s",
-            (trace_id, commit)
-        )
-
-        # 3) 若确认（feedback=true），把“最终选择”UPSERT到 commit_links
-        if feedback:
-            final_jira = clicked  # 用户最后点的就是最终选择
-            project_key = _project_from(final_jira)
-
-            # 取置信度（没有就 NULL）
-            cur.execute(
-                "SELECT confidence FROM notifications WHERE trace_id=%s AND commit_hash=%s ORDER BY delivered_at DESC LIMIT 1",
-                (trace_id, commit)
-            )
-            row = cur.fetchone()
-            confidence = float(row[0]) if row and row[0] is not None else None
-
-            cur.execute(
-                """
-                INSERT INTO commit_links (commit_hash, jira_key, project_key, confidence, trace_id, linked_at)
-                VALUES (%s, %s, %s, %s, %s, NOW())
-                ON CONFLICT (commit_hash) DO UPDATE
-                SET jira_key = EXCLUDED.jira_key,
-                    project_key = EXCLUDED.project_key,
-                    confidence = EXCLUDED.confidence,
-                    trace_id = EXCLUDED.trace_id,
-                    linked_at = NOW()
-                """,
-                (commit, final_jira, project_key, confidence, trace_id)
-            )
+    # 若确认（feedback=true），用户最后点的就是最终选择，UPSERT 到 commit_links
+    t0 = time.perf_counter()
+    with PG_POOL.connection() as db, db.cursor() as cur:
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - t0)
+        _exec(cur, "callback", CALLBACK_SQL, {
+            "commit": commit, "commits": commit_list, "recommended": [recs[c] for c in commit_list], "feedback": feedback,
+            "corrected": corrections,
+            "log_inline": log_inline, "trace_id": trace_id,
+            "finals": finals, "projects": [_project_from(f) for f in finals],
+        })
+        n_clicked, n_linked = cur.fetchone()
 
+    elapsed = time.perf_counter() - t_start
+    REQUEST_SECONDS.observe(elapsed)
+    CALLBACKS.labels(feedback=str(bool(feedback)).lower()).inc()
+    log_event("CALLBACK", trace_id, commit=commit, feedback=feedback, top1=recommended, selected=clicked,
+              notifications=n_clicked, commits=len(commit_list), linked=n_linked, ms=round(elapsed * 1000, 1))
     return {
         "ok": True,
         "trace_id": trace_id,
@@ -80,5 +293,6 @@ def cb(
         "top1": recommended,
         "selected": clicked,
         "corrected": corrected,
-        "linked": clicked if feedback else None,
+        "linked": ",".join(dict.fromkeys(finals)) if feedback else None,
+        "commits": commit_list,
     }
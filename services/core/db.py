@@ -0,0 +1,35 @@
+"""Postgres 连接池（core 服务内共享）。
+
+- min/max 大小、取连接超时可由环境变量调整
+- 借出前做一次轻量健康检查，坏连接自动替换
+- 每个新连接注册 pgvector 二进制适配器
+- get_stats() 里的 requests_wait_ms / requests_queued 用于评估池子是否偏小
+"""
+import os
+from psycopg_pool import ConnectionPool
+import pgvec
+
+POSTGRES_DSN = f"host={os.getenv('POSTGRES_HOST','postgres')} dbname={os.getenv('POSTGRES_DB','contextual')} user={os.getenv('POSTGRES_USER','postgres')} password={os.getenv('POSTGRES_PASSWORD','postgres')}"
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))   # 取连接最长等待（秒）
+
+def make_pool(name: str, dsn: str = POSTGRES_DSN) -> ConnectionPool:
+    # open=False：由服务 lifespan 负责 open/close
+    return ConnectionPool(
+        dsn,
+        min_size=PG_POOL_MIN,
+        max_size=max(PG_POOL_MIN, PG_POOL_MAX),
+        timeout=PG_POOL_TIMEOUT,
+        check=ConnectionPool.check_connection,
+        configure=pgvec.configure,
+        name=name,
+        open=False,
+    )
+
+def pool_stats(pool: ConnectionPool) -> dict:
+    s = pool.get_stats()
+    n = s.get("requests_num", 0)
+    s["avg_wait_ms"] = round(s.get("requests_wait_ms", 0) / n, 2) if n else 0.0
+    return s
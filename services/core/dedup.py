@@ -0,0 +1,72 @@
+"""commit 级去重：key = (repo, 完整 commit SHA)，存 Redis。
+
+- seen_many()：处理前 MGET 批量检查，已完成的直接 ack，不进 embedding / 检索
+- mark_many()：卡片成功发布到 ding_outbound 之后才记为已完成；发布前崩溃 / 发布失败时消息重投，
+  不会被误判为重复而丢卡片。代价是至少一次：发布后、标记前崩溃，或两个消费者同时处理同一 commit，
+  可能多发一张卡片
+
+Redis 不可用时放行（fail-open），最坏情况是退化为不去重。
+"""
+import os, threading
+from typing import List, Optional
+
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_TTL = int(os.getenv("DEDUP_RECO_TTL", str(30 * 86400)))   # 已处理标记保留时长（秒）
+
+PREFIX = "ctx:dedup:reco:"
+
+def commit_key(repo: str, sha: str) -> Optional[str]:
+    if not sha:
+        return None
+    return f"{PREFIX}{repo}:{sha}"
+
+class Deduper:
+    def __init__(self, url: str = REDIS_URL, enabled: bool = DEDUP_ENABLED, ttl: int = DEDUP_TTL):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._r = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5) if enabled else None
+        self._lock = threading.Lock()
+        self.stats = {"suppressed": 0, "marked": 0, "errors": 0}
+
+    def _count(self, k: str, n: int = 1):
+        with self._lock:
+            self.stats[k] += n
+
+    def suppressed(self, n: int = 1):
+        self._count("suppressed", n)
+
+    def _error(self, e):
+        self._count("errors")
+        print(f"[DEDUP] redis error (fail-open): {type(e).__name__}: {e}", flush=True)
+
+    def seen_many(self, keys: List[Optional[str]]) -> List[bool]:
+        if not self.enabled or not any(keys):
+            return [False] * len(keys)
+        real = [k for k in keys if k]
+        try:
+            vals = dict(zip(real, self._r.mget(real)))
+        except redis.RedisError as e:
+            self._error(e)
+            return [False] * len(keys)
+        return [bool(k and vals.get(k)) for k in keys]
+
+    def mark_many(self, keys: List[Optional[str]]):
+        """记为已完成（一次往返）；只在卡片已发布 / 已决定不发之后调用。"""
+        real = [k for k in keys if k]
+        if not self.enabled or not real:
+            return
+        try:
+            pipe = self._r.pipeline(transaction=False)
+            for k in real:
+                pipe.set(k, "1", ex=self.ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            self._error(e)
+            return
+        self._count("marked", len(real))
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, enabled=self.enabled)
@@ -0,0 +1,209 @@
+"""钉钉卡片：渲染（core 推荐阶段）与发送（sender 阶段）分开。
+
+卡片在 core 渲染好放进 ding_outbound；加签 URL 在真正发送时才生成（时间戳需新鲜），
+机器人凭据也不进队列，消息里只带 bot 名。
+"""
+import os, time, base64, hmac, hashlib, threading, urllib.parse
+import requests
+
+from metrics import log_event
+
+DING_URL = os.getenv("DINGTALK_WEBHOOK_URL","")
+DING_SECRET = os.getenv("DINGTALK_SECRET","")
+PUBLIC_BASE = os.getenv("PUBLIC_BASE_URL","http://localhost:8003")
+
+CONFIDENCE_WARN = float(os.getenv("RECO_LOW_SCORE", "0.60"))  # 低于此在标题上提示
+
+# 单个钉钉机器人约 20 条/分钟
+DING_RATE_PER_MIN = float(os.getenv("DING_RATE_PER_MIN", "20"))
+DING_BURST = int(os.getenv("DING_BURST", "5"))
+
+DEFAULT_BOT = "default"
+BOTS = {DEFAULT_BOT: (DING_URL, DING_SECRET)}
+
+class DingTalkError(RuntimeError):
+    pass
+
+def ding_sign_url(base_url:str, secret:str):
+    ts = str(int(time.time() * 1000))
+    string_to_sign = f"{ts}\n{secret}".encode("utf-8")
+    h = hmac.new(secret.encode("utf-8"), string_to_sign, digestmod=hashlib.sha256).digest()
+    sign = urllib.parse.quote_plus(base64.b64encode(h))
+    return f"{base_url}&timestamp={ts}&sign={sign}"
+
+def render_action_card(trace_id:str, commit_hash:str, repo:str, top1_key:str, candidates=None, score:float=None):
+    keyword = os.getenv("DINGTALK_KEYWORD","").strip()
+
+    # 文案
+    title = "是否关联到该 Jira 任务？"
+    if score is not None and score < CONFIDENCE_WARN:
+        title = "（低置信度）是否关联到该 Jira 任务？"
+
+    body_lines = [
+        "**Contextual 推荐关联**",
+        f"仓库：{repo}",
+        f"Commit：`{commit_hash}`",
+        "",
+        f"猜测的 Jira：**{top1_key}**" + (f"（置信度 {score:.2f}）" if score is not None else "")
+    ]
+
+    # === 带上 top1 / selected 参数 ===
+    def cb_url(jira_key:str, fb:bool, selected:str=None):
+        sel = selected or jira_key
+        base = f"{PUBLIC_BASE}/callback/dingtalk"
+        q = {
+            "trace_id": trace_id,
+            "commit": commit_hash,
+            "jira": jira_key,          # 兼容旧版
+            "feedback": "true" if fb else "false",
+            "top1": top1_key,
+            "selected": sel
+        }
+        return base + "?" + urllib.parse.urlencode(q)
+
+    btns = []
+    btns.append({"title":"✅ Yes, link it", "actionURL": cb_url(top1_key, True, selected=top1_key)})
+
+    if candidates:
+        body_lines.append("")
+        body_lines.append("**其它候选：**")
+        for k, s in candidates:
+            if k == top1_key:
+                continue
+            body_lines.append(f"- {k}（{s:.2f}）")
+            btns.append({"title": f"👉 {k}", "actionURL": cb_url(k, True, selected=k)})
+
+    btns.append({"title":"❌ Not sure", "actionURL": cb_url(top1_key, False, selected=top1_key)})
+
+    body_text = "\n".join(body_lines)
+    if keyword:
+        body_text = f"{keyword}\n\n" + body_text
+
+    return {
+        "msgtype": "actionCard",
+        "actionCard": {
+            "title": title,
+            "text": body_text,
+            "btns": btns[:4],   # 钉钉建议 ≤4 个按钮
+            "btnOrientation":"0"
+        }
+    }
+
+PUSH_CARD_MAX_COMMITS = 5   # 每组最多列出的 commit 数，其余只给个数
+PUSH_CARD_MAX_GROUPS = 8    # 最多列出的分组数，其余合并成一行
+PUSH_CARD_MAX_URL = 1500    # 按钮 URL 超过这个长度就不内联 commit，回调按 trace_id 查 push_card_commits
+PUSH_CARD_LOOKUP = "*"      # commits= / groups= 取这个值表示“查库”（与 callback 约定）
+
+def render_push_card(trace_id:str, head_hash:str, repo:str, groups):
+    """一次 push 一张卡片。groups：[(jira_key, best_score, [(commit_hash, subject), ...]), ...]，大组在前。
+
+    ✅ 按钮带上 commits=（该组 commit 的逗号列表）和该组自己的 top1，回调一次关联整组；
+    超过 3 组时前两组各一个 ✅，第三个 ✅ 带 groups=（其余各组），每个 commit 关联到它自己组的 top-1；
+    ❌ Not sure 带 groups=（KEY:h1,h2;KEY2:h3），每个 commit 按它自己组的 top-1 记录。
+    URL 超过 PUSH_CARD_MAX_URL 时 commits= / groups= 换成 *（其余各组再带 skip=前两组的 key），
+    回调按 trace_id 查 sender 写入的 push_card_commits。
+    """
+    keyword = os.getenv("DINGTALK_KEYWORD","").strip()
+    n = sum(len(c) for _, _, c in groups)
+    title = f"本次 push 的 {n} 个 commit 是否关联到这些 Jira 任务？"
+
+    body_lines = [
+        "**Contextual 推荐关联**",
+        f"仓库：{repo}",
+        f"Push：`{head_hash}`（{n} 个 commit）",
+    ]
+    for key, score, commits in groups[:PUSH_CARD_MAX_GROUPS]:
+        body_lines.append("")
+        body_lines.append(f"**{key}**" + (f"（置信度 {score:.2f}）" if score is not None else "") + f"：{len(commits)} 个 commit")
+        for h, subject in commits[:PUSH_CARD_MAX_COMMITS]:
+            body_lines.append(f"- `{h}` {subject[:60]}")
+        if len(commits) > PUSH_CARD_MAX_COMMITS:
+            body_lines.append(f"- ……另有 {len(commits) - PUSH_CARD_MAX_COMMITS} 个")
+    rest = groups[PUSH_CARD_MAX_GROUPS:]
+    if rest:
+        body_lines.append("")
+        body_lines.append(f"……另有 {len(rest)} 个 Jira（共 {sum(len(c) for _, _, c in rest)} 个 commit）")
+
+    def cb_url(jira_key:str, fb:bool, **extra):
+        # 组内的 commit 推荐的都是该组的 key：top1 = selected，不会被记成纠正
+        q = {
+            "trace_id": trace_id,
+            "commit": head_hash,
+            "jira": jira_key,
+            "feedback": "true" if fb else "false",
+            "top1": jira_key,
+            "selected": jira_key,
+            **extra,
+        }
+        return f"{PUBLIC_BASE}/callback/dingtalk?" + urllib.parse.urlencode(q)
+
+    def capped(url:str, fallback):
+        return url if len(url) <= PUSH_CARD_MAX_URL else fallback()
+
+    def groups_param(gs):
+        return ";".join(f"{key}:" + ",".join(h for h, _ in commits) for key, _, commits in gs)
+
+    # 钉钉建议 ≤4 个按钮：最后一个给 Not sure（覆盖全部 commit）；超过 3 组时第三个 ✅ 覆盖其余各组
+    own = groups if len(groups) <= 3 else groups[:2]
+    btns = [{"title": f"✅ {key}（{len(commits)}）",
+             "actionURL": capped(cb_url(key, True, commits=",".join(h for h, _ in commits)),
+                                 lambda key=key: cb_url(key, True, commits=PUSH_CARD_LOOKUP))}
+            for key, _, commits in own]
+    others = groups[len(own):]
+    if others:
+        skip = ",".join(key for key, _, _ in own)
+        btns.append({"title": f"✅ 其余 {len(others)} 组（{sum(len(c) for _, _, c in others)}，各按推荐）",
+                     "actionURL": capped(cb_url(others[0][0], True, groups=groups_param(others)),
+                                         lambda: cb_url(others[0][0], True, groups=PUSH_CARD_LOOKUP, skip=skip))})
+    btns.append({"title":"❌ Not sure",
+                 "actionURL": capped(cb_url(groups[0][0], False, groups=groups_param(groups)),
+                                     lambda: cb_url(groups[0][0], False, groups=PUSH_CARD_LOOKUP))})
+
+    body_text = "\n".join(body_lines)
+    if keyword:
+        body_text = f"{keyword}\n\n" + body_text
+
+    return {
+        "msgtype": "actionCard",
+        "actionCard": {
+            "title": title,
+            "text": body_text,
+            "btns": btns,
+            "btnOrientation":"0"
+        }
+    }
+
+def post_card(payload: dict, bot: str = DEFAULT_BOT, trace_id: str = None):
+    base_url, secret = BOTS.get(bot) or BOTS[DEFAULT_BOT]
+    url = ding_sign_url(base_url, secret) if secret and "sign=" not in base_url else base_url
+    r = requests.post(url, json=payload, timeout=(5, 10))
+    try:
+        data = r.json()
+    except Exception:
+        data = {"raw": r.text[:200]}
+    log_event("DINGTALK RESP", trace_id, bot=bot, status=r.status_code,
+              errcode=data.get("errcode") if isinstance(data, dict) else None, resp=data)
+    r.raise_for_status()
+    if isinstance(data, dict) and data.get("errcode",0)!=0:
+        raise DingTalkError(f"DingTalk send failed: {data}")
+    return data
+
+class TokenBucket:
+    """令牌桶：rate_per_min 匀速补充，最多攒 burst 个。reserve() 预占一个令牌并返回需要等待的秒数。"""
+
+    def __init__(self, rate_per_min: float = DING_RATE_PER_MIN, burst: int = DING_BURST):
+        self.rate = rate_per_min / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
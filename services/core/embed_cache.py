@@ -0,0 +1,158 @@
+"""查询向量缓存：key = sha256(model + text)。
+
+两级：进程内 LRU（有界） -> Postgres 表 embedding_cache（见 006 迁移）。
+模型名参与 key，换模型后天然全部 miss；启动时可顺手清掉其它模型的旧向量。
+PG 层异常只告警（缺表则关闭 PG 层），不影响主流程。
+"""
+import os, hashlib, threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import psycopg
+import pgvec
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))        # 0 = 关闭内存层
+EMBED_CACHE_PG = os.getenv("EMBED_CACHE_PG", "1") == "1"              # 是否启用 PG 持久层
+EMBED_CACHE_PURGE = os.getenv("EMBED_CACHE_PURGE_OTHER_MODELS", "1") == "1"
+# last_hit_at 只供按冷热清理（30 天量级），命中时比这更旧才回写，热 key 不再每次查询都写一行
+EMBED_CACHE_TOUCH_HOURS = float(os.getenv("EMBED_CACHE_TOUCH_HOURS", "6"))
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(model.encode("utf-8") + b"\x00" + text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    def __init__(self, model: str, dsn: Optional[str] = None, pool=None, max_items: int = EMBED_CACHE_SIZE, use_pg: bool = EMBED_CACHE_PG):
+        """dsn / pool 二选一：服务内传连接池，一次性脚本传 dsn。"""
+        self.model = model
+        self._pool = pool
+        self.dsn = dsn
+        self._pg_on = use_pg and (pool is not None or dsn is not None)
+        self.max_items = max_items
+        self._lru: "OrderedDict[bytes, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits_mem": 0, "hits_pg": 0, "misses": 0, "pg_errors": 0}
+        self._purged = False
+
+    # ---- 内存层 ----
+    def _mem_get(self, k: bytes):
+        with self._lock:
+            v = self._lru.get(k)
+            if v is not None:
+                self._lru.move_to_end(k)
+            return v
+
+    def _mem_put(self, k: bytes, v):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._lru[k] = v
+            self._lru.move_to_end(k)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    # ---- PG 层 ----
+    def _pg_error(self, e):
+        self.stats["pg_errors"] += 1
+        if isinstance(e, psycopg.errors.UndefinedTable):
+            # 没跑 006 迁移：关掉 PG 层，不再每次报错
+            print("[EMBED CACHE] table embedding_cache missing, pg tier disabled", flush=True)
+            self._pg_on = False
+        else:
+            print(f"[EMBED CACHE] pg error: {type(e).__name__}: {e}", flush=True)
+
+    def _connect(self):
+        if self._pool is not None:
+            return self._pool.connection()
+        conn = psycopg.connect(self.dsn)
+        pgvec.configure(conn)
+        return conn
+
+    def _pg_purge_other_models(self, cur):
+        if self._purged or not EMBED_CACHE_PURGE:
+            return
+        cur.execute("DELETE FROM embedding_cache WHERE model <> %s", (self.model,))
+        if cur.rowcount:
+            print(f"[EMBED CACHE] purged {cur.rowcount} rows of other models", flush=True)
+        self._purged = True
+
+    def _pg_get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        if not self._pg_on or not keys:
+            return {}
+        try:
+            with self._connect() as db, db.cursor() as cur:
+                self._pg_purge_other_models(cur)
+                cur.execute(
+                    "SELECT text_hash, embedding, last_hit_at < NOW() - make_interval(secs => %s) "
+                    "FROM embedding_cache WHERE model=%s AND text_hash = ANY(%s)",
+                    (EMBED_CACHE_TOUCH_HOURS * 3600, self.model, keys),
+                )
+                rows = cur.fetchall()
+                stale = [h for h, _, old in rows if old]
+                if stale:
+                    cur.execute(
+                        "UPDATE embedding_cache SET last_hit_at=NOW() WHERE model=%s AND text_hash = ANY(%s)",
+                        (self.model, stale),
+                    )
+                return {bytes(h): pgvec.from_db(v) for h, v, _ in rows}
+        except Exception as e:
+            self._pg_error(e)
+            return {}
+
+    def _pg_put_many(self, items: List[tuple]):
+        if not self._pg_on or not items:
+            return
+        try:
+            with self._connect() as db, db.cursor() as cur:
+                cur.executemany(
+                    "INSERT INTO embedding_cache(model, text_hash, embedding) VALUES (%s, %s, %b) ON CONFLICT (model, text_hash) DO NOTHING",
+                    [(self.model, k, pgvec.to_f32(v)) for k, v in items],
+                )
+        except Exception as e:
+            self._pg_error(e)
+
+    # ---- 对外 ----
+    def embed(self, texts: Sequence[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """按缓存取向量，只把 miss 的文本（去重后）交给 embed_fn，结果顺序与 texts 一致。"""
+        keys = [cache_key(self.model, t) for t in texts]
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        pg_wanted = []
+        for i, k in enumerate(keys):
+            v = self._mem_get(k)
+            if v is not None:
+                out[i] = v
+                self.stats["hits_mem"] += 1
+            else:
+                pg_wanted.append(k)
+
+        from_pg = self._pg_get_many(list(dict.fromkeys(pg_wanted)))
+        miss_idx: Dict[bytes, List[int]] = {}
+        for i, k in enumerate(keys):
+            if out[i] is not None:
+                continue
+            v = from_pg.get(k)
+            if v is not None:
+                out[i] = v
+                self.stats["hits_pg"] += 1
+                self._mem_put(k, v)
+            else:
+                miss_idx.setdefault(k, []).append(i)
+
+        if miss_idx:
+            self.stats["misses"] += sum(len(ix) for ix in miss_idx.values())
+            miss_keys = list(miss_idx)
+            vecs = embed_fn([texts[miss_idx[k][0]] for k in miss_keys])
+            for k, v in zip(miss_keys, vecs):
+                self._mem_put(k, v)
+                for i in miss_idx[k]:
+                    out[i] = v
+            self._pg_put_many(list(zip(miss_keys, vecs)))
+        return out
+
+    def snapshot(self) -> dict:
+        s = dict(self.stats)
+        total = s["hits_mem"] + s["hits_pg"] + s["misses"]
+        s["hit_ratio"] = round((s["hits_mem"] + s["hits_pg"]) / total, 4) if total else None
+        s["mem_items"] = len(self._lru)
+        s["model"] = self.model
+        s["pg_enabled"] = self._pg_on
+        return s
@@ -0,0 +1,278 @@
+"""Embedding 服务的共享客户端：core（commit 推荐 / Jira 事件）、reco_search.py、embed_jira.py 共用。
+
+- 每个线程一个 requests.Session，keep-alive 复用连接
+- 进程内并发上限 EMBED_MAX_CONCURRENCY；priority="batch"（回填）另受 EMBED_BATCH_MAX_CONCURRENCY 限制，
+  剩下的名额只给在线请求，回填跑满时 commit 推荐不用排队
+- 413（回填还有超时 / 5xx）：多条的请求对半拆开分别重试（AdaptiveBatch 记住更小的批大小，之后不再长回失败的大小）；
+  单条或连接错误 / 429 按指数退避（full jitter）重试；单条还 413 说明文本本身超限，直接失败
+- 在线请求（含重试 / 拆分）整体只等 EMBED_TIMEOUT_S：consumer 跑在 pika 连接线程上，卡太久 broker 会断开心跳
+- 熔断：连续 EMBED_BREAKER_FAILURES 次超时 / 连接错误 / 5xx 后 EMBED_BREAKER_COOLDOWN_S 秒内直接失败，
+  之后放一个试探请求，成功才恢复；在线路径据此立刻走降级，不再每批等一次超时
+- 返回 float32 ndarray，条数与维度（EMBED_DIM）不符直接报错，不重试
+"""
+import os, time, random, threading
+from contextlib import contextmanager
+from typing import List, Sequence
+
+import requests
+
+import metrics
+from pgvec import EMBED_DIM, to_f32
+
+EMBED_BASE  = os.getenv("EMBED_API_BASE","http://host.docker.internal:1234/v1").rstrip("/")
+EMBED_KEY   = os.getenv("EMBED_API_KEY","lm-studio")
+EMBED_MODEL = os.getenv("EMBED_MODEL","Qwen3-Embedding-0.6B-GGUF")
+
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "8"))
+EMBED_BATCH_MAX_CONCURRENCY = int(os.getenv("EMBED_BATCH_MAX_CONCURRENCY", "4"))
+EMBED_TIMEOUT_S = float(os.getenv("EMBED_TIMEOUT_S", "30"))
+EMBED_BATCH_TIMEOUT_S = float(os.getenv("EMBED_BATCH_TIMEOUT_S", "60"))
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "1"))               # 在线请求：多等不如尽快降级
+EMBED_BATCH_RETRIES = int(os.getenv("EMBED_BATCH_RETRIES", "3"))
+EMBED_BACKOFF_S = float(os.getenv("EMBED_BACKOFF_S", "0.5"))
+EMBED_BACKOFF_MAX_S = float(os.getenv("EMBED_BACKOFF_MAX_S", "30"))
+EMBED_BREAKER_FAILURES = int(os.getenv("EMBED_BREAKER_FAILURES", "5"))
+EMBED_BREAKER_COOLDOWN_S = float(os.getenv("EMBED_BREAKER_COOLDOWN_S", "30"))
+EMBED_BATCH_REGROW_S = float(os.getenv("EMBED_BATCH_REGROW_S", "300"))  # 批大小失败后多久才允许再长到失败的大小
+
+LIVE, BATCH = "live", "batch"
+CONNECT_TIMEOUT_S = 5
+
+class EmbedError(RuntimeError):
+    """响应不对（条数 / 维度 / 格式），重试也没用。"""
+
+class EmbedUnavailable(RuntimeError):
+    """熔断中，没有发请求。"""
+
+class AdaptiveBatch:
+    """批大小自适应：请求又快又成功就加大，超时 / 413 / 5xx 就减半。
+
+    记住最近失败的批大小（failed_at），之后只长到它以下，不会在 32 -> 16 -> 32 之间反复失败；
+    regrow_s 秒后或更大的批成功过，才重新允许往上试。
+    """
+
+    def __init__(self, start: int, lo: int = 1, hi: int = 256, target_s: float = 5.0,
+                 regrow_s: float = EMBED_BATCH_REGROW_S):
+        self.lo, self.hi = max(1, lo), max(start, hi)
+        self.step = max(1, start // 4)
+        self.size = start
+        self.target_s = target_s
+        self.regrow_s = regrow_s
+        self.failed_at = None
+        self._failed_ts = 0.0
+        self._lock = threading.Lock()
+
+    def ok(self, n: int, elapsed: float):
+        with self._lock:
+            if self.failed_at is not None and (n >= self.failed_at or time.monotonic() - self._failed_ts >= self.regrow_s):
+                self.failed_at = None
+            if n >= self.size and elapsed < self.target_s:
+                cap = self.hi if self.failed_at is None else self.failed_at - 1
+                self.size = max(self.size, min(cap, self.size + self.step))
+
+    def shrink(self, n: int = None):
+        """n：失败的那次请求的条数（默认当前批大小）。"""
+        with self._lock:
+            n = n or self.size
+            self.failed_at = n if self.failed_at is None else min(self.failed_at, n)
+            self._failed_ts = time.monotonic()
+            self.size = max(self.lo, min(self.size, n) // 2)
+
+def _status(e: Exception):
+    r = getattr(e, "response", None)
+    return r.status_code if r is not None else None
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (requests.Timeout, requests.ConnectionError)):
+        return True
+    s = _status(e)
+    return isinstance(e, requests.HTTPError) and s is not None and (s in (413, 429) or s >= 500)
+
+def _splittable(e: Exception, priority: str) -> bool:
+    # 批太大的迹象：拆小能过；连接错误 / 429 拆了也一样。
+    # 在线请求只对 413 拆：服务卡住时超时 / 5xx 拆开重试只会多等几个超时
+    s = _status(e)
+    if s == 413:
+        return True
+    return priority == BATCH and (isinstance(e, requests.Timeout) or (s is not None and s >= 500))
+
+def _server_fault(e: Exception) -> bool:
+    # 计入熔断的错误：服务挂了 / 过载，与请求内容无关
+    s = _status(e)
+    return isinstance(e, (requests.Timeout, requests.ConnectionError)) or (s is not None and s >= 500)
+
+class CircuitBreaker:
+    def __init__(self, failures: int = EMBED_BREAKER_FAILURES, cooldown_s: float = EMBED_BREAKER_COOLDOWN_S):
+        self.failures = max(1, failures)
+        self.cooldown_s = cooldown_s
+        self._fails = 0
+        self._open_until = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._fails < self.failures:
+                return True
+            # 冷却结束后只放一个试探请求
+            if time.monotonic() < self._open_until or self._probe:
+                return False
+            self._probe = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._fails, self._probe = 0, False
+
+    def failure(self):
+        with self._lock:
+            self._fails += 1
+            self._probe = False
+            if self._fails >= self.failures:
+                if self._open_until < time.monotonic():
+                    self.opened += 1
+                self._open_until = time.monotonic() + self.cooldown_s
+
+    @property
+    def state(self) -> str:
+        if self._fails < self.failures:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half_open"
+
+class EmbedClient:
+    def __init__(self, base: str = EMBED_BASE, key: str = EMBED_KEY, model: str = EMBED_MODEL, dim: int = EMBED_DIM,
+                 max_concurrency: int = EMBED_MAX_CONCURRENCY, batch_max_concurrency: int = EMBED_BATCH_MAX_CONCURRENCY):
+        self.base, self.key, self.model, self.dim = base.rstrip("/"), key, model, dim
+        self._all = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.batch_max_concurrency = max(1, min(batch_max_concurrency, max_concurrency))
+        self._batch = threading.BoundedSemaphore(self.batch_max_concurrency)
+        self.breaker = CircuitBreaker()
+        self._local = threading.local()
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "errors": 0, "retries": 0, "splits": 0, "rejected": 0}
+
+    def _count(self, k: str, n: int = 1):
+        with self._lock:
+            self.stats[k] += n
+
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "s", None)
+        if s is None:
+            s = self._local.s = requests.Session()
+            s.headers["Authorization"] = f"Bearer {self.key}"
+        return s
+
+    @contextmanager
+    def _slot(self, priority: str):
+        # batch 先占自己的名额再占全局名额：最多占 batch_max_concurrency 个，其余留给在线请求
+        if priority == BATCH:
+            self._batch.acquire()
+        self._all.acquire()
+        with self._lock:
+            self._inflight += 1
+        metrics.EMBED_INFLIGHT.inc()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+            metrics.EMBED_INFLIGHT.dec()
+            self._all.release()
+            if priority == BATCH:
+                self._batch.release()
+
+    def _request(self, texts: List[str], timeout: float) -> List:
+        with metrics.timed(metrics.EMBED_REQUEST):
+            r = self._session().post(self.base + "/embeddings", json={"model": self.model, "input": texts},
+                                     timeout=(CONNECT_TIMEOUT_S, timeout))
+        r.raise_for_status()
+        try:
+            data = sorted(r.json()["data"], key=lambda d: d.get("index", 0))
+            vecs = [to_f32(d["embedding"]) for d in data]
+        except (ValueError, KeyError, TypeError) as e:
+            raise EmbedError(f"bad embeddings response: {type(e).__name__}: {e}")
+        if len(vecs) != len(texts):
+            raise EmbedError(f"embedding count mismatch: got {len(vecs)}, expect {len(texts)}")
+        for v in vecs:
+            if v.shape != (self.dim,):
+                raise EmbedError(f"embedding dim mismatch: got {v.shape[-1] if v.ndim else 0}, expect {self.dim} (EMBED_DIM)")
+        return vecs
+
+    def _backoff(self, attempt: int, max_s: float = EMBED_BACKOFF_MAX_S):
+        time.sleep(random.uniform(0, min(max(0.0, max_s), EMBED_BACKOFF_MAX_S, EMBED_BACKOFF_S * 2 ** attempt)))
+
+    def embed(self, texts: Sequence[str], priority: str = LIVE, retries: int = None, ctl: AdaptiveBatch = None,
+              deadline: float = None) -> List:
+        """返回与 texts 等长的 float32 向量。可重试的失败：多条对半拆开，单条退避重试；最终失败抛出最后的异常。
+
+        deadline（time.monotonic()）：到点不再重试；在线请求不传时取 EMBED_TIMEOUT_S 之后。
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        if retries is None:
+            retries = EMBED_BATCH_RETRIES if priority == BATCH else EMBED_RETRIES
+        timeout = EMBED_BATCH_TIMEOUT_S if priority == BATCH else EMBED_TIMEOUT_S
+        if deadline is None and priority != BATCH:
+            deadline = time.monotonic() + timeout
+        for attempt in range(retries + 1):
+            if not self.breaker.allow():
+                self._count("rejected")
+                metrics.EMBED_ERRORS.labels(kind="circuit_open").inc()
+                raise EmbedUnavailable(f"embedding circuit open ({self.breaker.failures} consecutive failures)")
+            left = timeout if deadline is None else deadline - time.monotonic()
+            if left <= 0:
+                raise requests.Timeout(f"embedding deadline exceeded ({len(texts)} texts, {timeout}s)")
+            t0 = time.perf_counter()
+            try:
+                with self._slot(priority):
+                    vecs = self._request(texts, min(timeout, left))
+            except Exception as e:
+                self._count("errors")
+                metrics.EMBED_ERRORS.labels(kind=str(_status(e) or type(e).__name__)).inc()
+                if _server_fault(e):
+                    self.breaker.failure()
+                else:
+                    # 服务能正常应答（4xx / 响应不对），不算它挂了
+                    self.breaker.success()
+                # 单条还 413：文本本身超出服务上限，拆不了也不会因为重试变小
+                too_large = _status(e) == 413 and len(texts) == 1
+                expired = deadline is not None and time.monotonic() >= deadline
+                if too_large or expired or not _retryable(e) or attempt == retries:
+                    raise
+                split = _splittable(e, priority)
+                if ctl is not None and split:
+                    ctl.shrink(len(texts))
+                if len(texts) > 1 and split:
+                    mid = len(texts) // 2
+                    self._count("splits")
+                    metrics.EMBED_SPLITS.inc()
+                    # 两半各自有完整的重试次数（每拆一层都更小，递归必然结束）；在线请求共用同一个 deadline
+                    return (self.embed(texts[:mid], priority, retries, ctl, deadline)
+                            + self.embed(texts[mid:], priority, retries, ctl, deadline))
+                self._count("retries")
+                self._backoff(attempt, EMBED_BACKOFF_MAX_S if deadline is None else deadline - time.monotonic())
+                continue
+            self.breaker.success()
+            self._count("requests")
+            self._count("texts", len(texts))
+            if ctl is not None:
+                ctl.ok(len(texts), time.perf_counter() - t0)
+            return vecs
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, inflight=self._inflight, breaker=self.breaker.state, breaker_opened=self.breaker.opened,
+                    model=self.model, dim=self.dim)
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_client() -> EmbedClient:
+    """进程内共享的客户端（并发上限 / 熔断状态对所有调用方生效）。"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = EmbedClient()
+        return _default
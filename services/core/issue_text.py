@@ -0,0 +1,19 @@
+"""Jira issue -> embedding 文本，以及文本的内容 hash。
+
+jira_sync 写 content_hash、embed_jira 写 embedding_hash 用的是同一份拼接规则，
+规则一改 hash 全变，所有行会被重新 embedding。
+"""
+import hashlib
+from typing import Optional
+
+MAX_DESC_CHARS = 4000
+
+def to_text(title: Optional[str], desc: Optional[str]) -> str:
+    t = (title or "").strip()
+    d = (desc or "").strip()
+    # 控制长度，避免极端长文本
+    if len(d) > MAX_DESC_CHARS: d = d[:MAX_DESC_CHARS]
+    return (t + "\n\n" + d).strip()
+
+def content_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
@@ -0,0 +1,149 @@
+"""Jira webhook 事件消费：单条 upsert jira_issues，文本有变化就立即 embedding。
+
+webhook 服务把 jira:issue_created / issue_updated / issue_deleted 放进 jira_issue_events，
+这里逐条处理，新建的 issue 几秒内就能被推荐到，jira_sync.py 的定时全量扫描可以放宽。
+
+- 载荷里的 description 是 v2 wiki markup，而 jira_sync 存的是 v3 ADF 拍平的文本，直接用会让 content_hash
+  在两种格式间来回变、反复 embedding；配置了 Jira 凭据时（JIRA_EVENTS_REFETCH=1）先按 key 从 REST v3 取一次
+- upsert 只接受不比库里旧的版本（updated_at），乱序到达的旧事件直接忽略
+- 文本（content_hash）与上次 embedding 时一致、模型也没变就不再请求 embedding
+- embedding 失败不重投：行已写入且处于待处理状态，下一次 embed_jira.py 会补上
+- 写完向量 NOTIFY jira_embeddings，删除 NOTIFY jira_issue_deleted，进程内向量索引随之刷新
+"""
+import os, json
+
+import requests
+
+import mq
+import metrics
+from issue_text import to_text
+from jira_issue import ISSUE_FIELDS, upsert_issue
+from metrics import log_event, timed
+from pgvec import to_f32
+
+JIRA_URL = os.environ.get("JIRA_URL","").rstrip("/")
+JIRA_EMAIL = os.environ.get("JIRA_EMAIL","")
+JIRA_API_TOKEN = os.environ.get("JIRA_API_TOKEN","")
+
+JIRA_EVENTS_PREFETCH = int(os.getenv("JIRA_EVENTS_PREFETCH", "8"))
+JIRA_EVENTS_REFETCH = os.getenv("JIRA_EVENTS_REFETCH", "1") == "1"
+JIRA_FETCH_TIMEOUT_S = float(os.getenv("JIRA_FETCH_TIMEOUT_S", "10"))
+
+EVENT_DELETED = "jira:issue_deleted"
+EVENTS = ("jira:issue_created", "jira:issue_updated", EVENT_DELETED)
+
+class JiraEventWorker(mq.ConsumerThread):
+    def __init__(self, pool, embed_fn, model: str, reconnect_delay: float = 5.0):
+        super().__init__("jira-events", reconnect_delay=reconnect_delay)
+        self.pool = pool
+        self.embed_fn = embed_fn     # texts -> [vector, ...]
+        self.model = model
+        # 没有 Jira 凭据就只能用载荷（description 格式与 jira_sync 不同）
+        self.refetch = JIRA_EVENTS_REFETCH and bool(JIRA_URL and JIRA_API_TOKEN)
+        self._http = None
+        self.stats = {"embedded": 0, "unchanged": 0, "stale": 0, "superseded": 0, "embed_failed": 0,
+                      "deleted": 0, "missing": 0, "bad": 0, "requeued": 0}
+
+    def setup(self, conn, ch):
+        ch.queue_declare(queue=mq.QUEUE_JIRA, durable=True)
+        ch.basic_qos(prefetch_count=JIRA_EVENTS_PREFETCH)
+
+        def _cb(chx, method, props, body):
+            self._handle(conn, chx, method.delivery_tag, body)
+
+        ch.basic_consume(queue=mq.QUEUE_JIRA, on_message_callback=_cb, consumer_tag=f"jira-events-{os.getpid()}")
+        print(f" [*] Jira event consumer consuming {mq.QUEUE_JIRA} (model={self.model}, refetch={self.refetch})", flush=True)
+
+    def _count(self, event: str, outcome: str):
+        self.stats[outcome] += 1
+        metrics.JIRA_EVENTS.labels(event=event, outcome=outcome).inc()
+
+    def _handle(self, conn, ch, tag, body):
+        try:
+            msg = json.loads(body)
+            p = msg["payload"]
+            event = p["event"]
+            issue = p.get("issue") or {}
+            key = p.get("jira_key") or issue["key"]
+            if event not in EVENTS:
+                raise ValueError(f"unsupported event {event!r}")
+        except Exception as e:
+            log_event("JIRA BAD EVENT", error=f"{type(e).__name__}: {e}")
+            self.stats["bad"] += 1
+            metrics.JIRA_EVENTS.labels(event="unknown", outcome="bad").inc()
+            ch.basic_nack(delivery_tag=tag, requeue=False)
+            return
+
+        try:
+            if event == EVENT_DELETED:
+                outcome = self._delete(key)
+            else:
+                if self.refetch:
+                    issue = self._fetch(key)
+                outcome = self._upsert(key, issue) if issue is not None else "missing"
+        except Exception as e:
+            # 多半是数据库不可用：等一会儿再放回队列，避免立即重投空转
+            log_event("JIRA EVENT ERROR", key, event=event, error=f"{type(e).__name__}: {e}", action="requeue")
+            self.stats["requeued"] += 1
+            conn.sleep(self.reconnect_delay)
+            ch.basic_nack(delivery_tag=tag, requeue=True)
+            return
+        self._count(event, outcome)
+        log_event("JIRA EVENT", key, event=event, outcome=outcome)
+        ch.basic_ack(delivery_tag=tag)
+
+    def _fetch(self, key: str):
+        """REST v3 取 issue（与 jira_sync 同样的字段和 ADF description）；已被删除返回 None，其余错误抛出（重投）。"""
+        if self._http is None:
+            # 只在消费者线程里用：keep-alive 复用连接
+            self._http = requests.Session()
+            self._http.auth = (JIRA_EMAIL, JIRA_API_TOKEN)
+        with timed(metrics.JIRA_EVENT_SECONDS, stage="fetch"):
+            r = self._http.get(f"{JIRA_URL}/rest/api/3/issue/{key}", params={"fields": ",".join(ISSUE_FIELDS)},
+                               timeout=JIRA_FETCH_TIMEOUT_S)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.json()
+
+    def _delete(self, key: str) -> str:
+        with self.pool.connection() as db:
+            cur = db.execute("DELETE FROM jira_issues WHERE jira_key=%s", (key,), prepare=True)
+            if cur.rowcount:
+                db.execute("SELECT pg_notify('jira_issue_deleted', %s)", (key,))
+        return "deleted" if cur.rowcount else "missing"
+
+    def _upsert(self, key: str, issue: dict) -> str:
+        with self.pool.connection() as db:
+            with timed(metrics.JIRA_EVENT_SECONDS, stage="upsert"), db.cursor() as cur:
+                if not upsert_issue(cur, issue):
+                    return "stale"
+                cur.execute("""
+                    SELECT id, project_key, title, COALESCE(description,''), content_hash,
+                           embedding IS NOT NULL AND embedding_model = %s AND embedding_hash = content_hash
+                    FROM jira_issues WHERE jira_key=%s
+                """, (self.model, key), prepare=True)
+                row_id, project, title, desc, chash, fresh = cur.fetchone()
+            # 先提交 upsert，embedding 请求期间不持有行锁 / 事务
+            db.commit()
+        if fresh:
+            return "unchanged"
+
+        try:
+            with timed(metrics.JIRA_EVENT_SECONDS, stage="embed"):
+                vec = self.embed_fn([to_text(title, desc)])[0]
+        except Exception as e:
+            log_event("JIRA EMBED FAILED", key, error=f"{type(e).__name__}: {e}", action="left for embed_jira")
+            return "embed_failed"
+
+        with self.pool.connection() as db:
+            # content_hash 没变才写：期间又来了新版本就交给那条事件
+            cur = db.execute("""
+                UPDATE jira_issues
+                SET embedding=%b, embedding_hash=content_hash, embedding_model=%s, embedded_at=NOW()
+                WHERE id=%s AND content_hash=%s
+            """, (to_f32(vec), self.model, row_id, chash), prepare=True)
+            if not cur.rowcount:
+                return "superseded"
+            db.execute("SELECT pg_notify('jira_embeddings', %s)", (project,))
+        return "embedded"
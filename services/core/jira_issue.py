@@ -0,0 +1,107 @@
+"""Jira issue JSON -> jira_issues 行（jira_sync 整页 COPY 与 Jira webhook 单条 upsert 共用）。
+
+同时接受 REST v3（description 为 ADF）和 webhook 载荷（description 为 v2 wiki markup 字符串）。
+两种格式拍平后的文本不同，content_hash 也不同：jira_events 默认先按 key 从 REST v3 取一次再 upsert。
+"""
+import os, json, datetime as dt
+from typing import Dict, Any, Optional
+
+from issue_text import to_text, content_hash
+
+JIRA_URL = os.environ.get("JIRA_URL","").rstrip("/")
+
+# jira_issues.raw 里保留哪些 fields（逗号分隔）："*" = 整个 issue 原样存，留空 = 不存
+# 默认只留没有拆成列的小对象；description 的 ADF 原文通常是 raw 里最大的部分，已有纯文本列
+JIRA_RAW_FIELDS = os.environ.get("JIRA_RAW_FIELDS", "status,priority,project").strip()
+RAW_ALL = JIRA_RAW_FIELDS == "*"
+RAW_FIELDS = () if RAW_ALL else tuple(f.strip() for f in JIRA_RAW_FIELDS.split(",") if f.strip())
+
+# 拆列需要的字段；raw 投影（JIRA_RAW_FIELDS）里额外的字段也一并向 Jira 请求
+ISSUE_FIELDS = ["summary","description","status","priority","assignee","reporter","project","created","updated"]
+ISSUE_FIELDS += [f for f in RAW_FIELDS if f not in ISSUE_FIELDS]
+
+def plain_text_description(desc):
+    """ADF -> 纯文本：按文档顺序拼接所有 text 节点（显式栈，嵌套再深也不会递归溢出）。"""
+    if not desc:
+        return None
+    if isinstance(desc, str):
+        return desc
+    if not isinstance(desc, dict):
+        return None
+    parts, stack = [], [desc]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if node.get("type") == "text":
+            parts.append(node.get("text") or "")
+            continue
+        children = node.get("content")
+        if isinstance(children, list):
+            stack.extend(reversed(children))
+    return "".join(parts)
+
+def raw_projection(issue: Dict[str,Any]) -> Optional[str]:
+    if RAW_ALL:
+        return json.dumps(issue)
+    if not RAW_FIELDS:
+        return None
+    f = issue.get("fields", {}) or {}
+    return json.dumps({"id": issue.get("id"), "key": issue.get("key"),
+                       "fields": {k: f[k] for k in RAW_FIELDS if f.get(k) is not None}})
+
+def parse_ts(s):
+    if not s: return None
+    try:
+        return dt.datetime.fromisoformat(s.replace("Z","+00:00"))
+    except Exception:
+        return None
+
+ISSUE_COLS = ("jira_key", "project_key", "title", "description", "status", "priority",
+              "assignee", "reporter", "url", "created_at", "updated_at", "raw", "content_hash")
+
+def issue_row(issue: Dict[str,Any]) -> tuple:
+    key = issue["key"]
+    f = issue.get("fields", {}) or {}
+    proj_key = (f.get("project") or {}).get("key") or key.split("-")[0]
+    title = f.get("summary") or ""
+    desc_plain = plain_text_description(f.get("description"))
+    status = (f.get("status") or {}).get("name")
+    priority = (f.get("priority") or {}).get("name")
+    assignee = f.get("assignee")
+    reporter = f.get("reporter")
+    url = f"{JIRA_URL}/browse/{key}"
+    return (
+        key, proj_key, title, desc_plain, status, priority,
+        json.dumps(assignee) if assignee else None,
+        json.dumps(reporter) if reporter else None,
+        url, parse_ts(f.get("created")), parse_ts(f.get("updated")), raw_projection(issue),
+        content_hash(to_text(title, desc_plain))
+    )
+
+# 只接受不比库里旧的版本：webhook 乱序到达、或全量同步拿到的是 webhook 之前的快照时不回退
+UPSERT_SET = """
+            project_key=EXCLUDED.project_key,
+            title=EXCLUDED.title,
+            description=EXCLUDED.description,
+            status=EXCLUDED.status,
+            priority=EXCLUDED.priority,
+            assignee=EXCLUDED.assignee,
+            reporter=EXCLUDED.reporter,
+            url=EXCLUDED.url,
+            created_at=COALESCE(EXCLUDED.created_at, jira_issues.created_at),
+            updated_at=COALESCE(EXCLUDED.updated_at, jira_issues.updated_at),
+            raw=EXCLUDED.raw,
+            content_hash=EXCLUDED.content_hash
+        WHERE EXCLUDED.updated_at IS NULL OR jira_issues.updated_at IS NULL
+           OR EXCLUDED.updated_at >= jira_issues.updated_at
+"""
+
+def upsert_issue(cur, issue: Dict[str,Any]) -> bool:
+    """单条 upsert；返回 False 表示库里已有更新的版本，本次被忽略。"""
+    cur.execute(f"""
+        INSERT INTO jira_issues({", ".join(ISSUE_COLS)})
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        ON CONFLICT (jira_key) DO UPDATE SET {UPSERT_SET}
+    """, issue_row(issue), prepare=True)
+    return cur.rowcount > 0
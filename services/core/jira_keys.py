@@ -0,0 +1,109 @@
+"""commit message 里显式写出的 Jira key（"SCRUM-123: fix ..."）：直接作为 top-1，跳过 embedding 与向量检索。
+
+- 正则先找出形如 ABC-123 的片段（不区分大小写，统一转大写）
+- 只认已知项目前缀；再用缓存的 jira_key 集合校验，避免 "UTF-8" / "SHA-256" 这类误判
+- 每条 commit 最多取 RECO_EXPLICIT_MAX_KEYS 个，在校验之后截断：误判的片段不占名额
+- key 集合每 JIRA_KEY_CACHE_REFRESH_S 秒整体重载一次；集合里没有但项目已知的 key（刚建的 issue）
+  一批查一次库，查到就并入集合，查不到在 JIRA_KEY_NEGATIVE_TTL 秒内不再查
+"""
+import os, re, time, threading
+from typing import List
+
+JIRA_KEY_CACHE_REFRESH_S = float(os.getenv("JIRA_KEY_CACHE_REFRESH_S", "300"))
+JIRA_KEY_NEGATIVE_TTL = float(os.getenv("JIRA_KEY_NEGATIVE_TTL", "60"))
+MAX_KEYS_PER_COMMIT = int(os.getenv("RECO_EXPLICIT_MAX_KEYS", "3"))
+
+# 后面紧跟 "-3" / ".3" 的是版本号之类的片段（v1-2-3、v1-2.3），不是 key
+KEY_RE = re.compile(r"(?<![A-Za-z0-9_])([A-Za-z][A-Za-z0-9_]*-[1-9][0-9]*)(?![A-Za-z0-9_]|-[A-Za-z0-9]|\.[0-9])")
+
+def find_keys(text: str) -> List[str]:
+    """按出现顺序去重返回全部候选 key（未校验，数量上限在 KeyCache.resolve 校验之后再截断）。"""
+    return list(dict.fromkeys(m.group(1).upper() for m in KEY_RE.finditer(text or "")))
+
+class KeyCache:
+    def __init__(self, pool, refresh_s: float = JIRA_KEY_CACHE_REFRESH_S, negative_ttl: float = JIRA_KEY_NEGATIVE_TTL,
+                 max_keys: int = MAX_KEYS_PER_COMMIT):
+        self.pool = pool
+        self.refresh_s = refresh_s
+        self.negative_ttl = negative_ttl
+        self.max_keys = max(1, max_keys)
+        # 整体替换、不原地修改：读线程不加锁
+        self._keys = frozenset()
+        self._projects = frozenset()
+        self._loaded_at = None
+        self._neg = {}
+        self._reload = threading.Lock()
+        self._lock = threading.Lock()
+        self.stats = {"keys": 0, "reloads": 0, "hits": 0, "db_hits": 0, "rejected": 0, "errors": 0}
+
+    def _maybe_reload(self):
+        stale = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_s
+        # 重载期间其它消费线程继续用旧集合；首次加载时等它完成
+        if not stale or not self._reload.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_s:
+                return
+            with self.pool.connection() as db:
+                keys = frozenset(r[0] for r in db.execute("SELECT jira_key FROM jira_issues"))
+            self._keys = keys
+            self._projects = frozenset(k.rsplit("-", 1)[0] for k in keys)
+            with self._lock:
+                self._neg.clear()
+            self.stats["keys"] = len(keys)
+            self.stats["reloads"] += 1
+        finally:
+            # 出错也记时间，按周期重试，不在每条消息上重查
+            self._loaded_at = time.monotonic()
+            self._reload.release()
+
+    def resolve(self, mentioned: List[List[str]]) -> List[List[str]]:
+        """mentioned：每条 commit 的候选 key；返回校验通过的 key（保持顺序，每条最多 max_keys 个）。"""
+        if not any(mentioned):
+            return [[] for _ in mentioned]
+        try:
+            self._maybe_reload()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[KEYS] reload failed: {type(e).__name__}: {e}", flush=True)
+        keys, projects, now = self._keys, self._projects, time.monotonic()
+
+        unknown = set()
+        for ks in mentioned:
+            for k in ks:
+                if k in keys or k.rsplit("-", 1)[0] not in projects:
+                    continue
+                exp = self._neg.get(k)
+                if exp is None or exp < now:
+                    unknown.add(k)
+        if unknown:
+            keys = self._lookup(unknown, now)
+
+        out = []
+        for ks in mentioned:
+            ok = [k for k in ks if k in keys]
+            self.stats["hits"] += len(ok)
+            self.stats["rejected"] += len(ks) - len(ok)
+            out.append(ok[:self.max_keys])
+        return out
+
+    def _lookup(self, unknown, now: float):
+        try:
+            with self.pool.connection() as db:
+                found = {r[0] for r in db.execute("SELECT jira_key FROM jira_issues WHERE jira_key = ANY(%s)",
+                                                  (list(unknown),), prepare=True)}
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[KEYS] lookup failed: {type(e).__name__}: {e}", flush=True)
+            return self._keys
+        with self._lock:
+            for k in unknown - found:
+                self._neg[k] = now + self.negative_ttl
+            if found:
+                self._keys = self._keys | found
+                self.stats["keys"] = len(self._keys)
+                self.stats["db_hits"] += len(found)
+        return self._keys
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, projects=len(self._projects), negative=len(self._neg))
@@ -1,94 +1,148 @@
-import os, json, time
-import requests
+import os, sys, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import psycopg
-from typing import List, Tuple, Optional
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pgvec
+from embed_client import BATCH, EMBED_BASE, EMBED_DIM, EMBED_MODEL, AdaptiveBatch, default_client
+from issue_text import to_text, content_hash
+from metrics import report_job
 
 PG_HOST = os.environ.get("POSTGRES_HOST","postgres")
 PG_DB   = os.environ.get("POSTGRES_DB","contextual")
 PG_USER = os.environ.get("POSTGRES_USER","postgres")
 PG_PASS = os.environ.get("POSTGRES_PASSWORD","postgres")
 
-EMBED_BASE = os.environ.get("EMBED_API_BASE","http://host.docker.internal:1234/v1").rstrip("/")
-EMBED_KEY  = os.environ.get("EMBED_API_KEY","lm-studio")
-EMBED_MODEL= os.environ.get("EMBED_MODEL","Qwen3-Embedding-0.6B-GGUF")
-EMBED_DIM  = int(os.environ.get("EMBED_DIM","1024"))
-
 def pg_conn():
     dsn = f"host={PG_HOST} dbname={PG_DB} user={PG_USER} password={PG_PASS}"
-    return psycopg.connect(dsn)
+    conn = psycopg.connect(dsn)
+    pgvec.configure(conn)
+    return conn
 
-def _to_text(title: Optional[str], desc: Optional[str]) -> str:
-    t = (title or "").strip()
-    d = (desc or "").strip()
-    # 控制长度，避免极端长文本
-    if len(d) > 4000: d = d[:4000]
-    return (t + "\n\n" + d).strip()
+def backfill_hashes(cur, project_key: str, page: int = 1000) -> int:
+    """迁移前同步进来的行没有 content_hash，按当前 title/description 补上。"""
+    n, last_id = 0, 0
+    while True:
+        cur.execute("""
+            SELECT id, title, COALESCE(description,'')
+            FROM jira_issues
+            WHERE project_key=%s AND content_hash IS NULL AND id > %s
+            ORDER BY id ASC
+            LIMIT %s
+        """, (project_key, last_id, page))
+        rows = cur.fetchall()
+        if not rows:
+            return n
+        cur.execute("""
+            UPDATE jira_issues j SET content_hash = u.h
+            FROM unnest(%s::bigint[], %s::bytea[]) AS u(id, h)
+            WHERE j.id = u.id AND j.content_hash IS NULL
+        """, ([r[0] for r in rows], [content_hash(to_text(r[1], r[2])) for r in rows]))
+        n += len(rows)
+        last_id = rows[-1][0]
 
-def _vec_literal(vec: List[float]) -> str:
-    # pgvector 的文本字面量，例如: [0.1,0.2,...]
-    return "[" + ",".join(str(float(x)) for x in vec) + "]"
+def adopt_existing(cur, project_key: str) -> int:
+    # 旧任务写的向量没记模型和文本 hash：视为当前模型、当前文本，避免整库重跑一遍
+    cur.execute("""
+        UPDATE jira_issues SET embedding_hash = content_hash, embedding_model = %s
+        WHERE project_key=%s AND embedding IS NOT NULL AND embedding_model IS NULL
+    """, (EMBED_MODEL, project_key))
+    return cur.rowcount
 
-def fetch_pending(cur, project_key: str, limit: int) -> List[Tuple[int,str,str,str]]:
+def fetch_pending(cur, project_key: str, limit: int, after_id: int = 0) -> List[Tuple[int,str,str,str]]:
+    # keyset 分页：按 id 往后翻，每页都是一次索引范围扫描，不重复排序已处理过的行
+    # 待处理 = 没有向量 / 向量来自别的模型 / 文本在上次 embedding 之后改过
     cur.execute("""
         SELECT id, jira_key, title, COALESCE(description,'')
         FROM jira_issues
-        WHERE project_key=%s AND embedding IS NULL
-        ORDER BY updated_at DESC NULLS LAST, id ASC
+        WHERE project_key=%s AND id > %s
+          AND (embedding IS NULL
+               OR embedding_model IS DISTINCT FROM %s
+               OR embedding_hash IS DISTINCT FROM content_hash)
+        ORDER BY id ASC
         LIMIT %s
-    """, (project_key, limit))
+    """, (project_key, after_id, EMBED_MODEL, limit), prepare=True)
     return cur.fetchall()
 
-def embed_batch(texts: List[str]) -> List[List[float]]:
-    r = requests.post(
-        EMBED_BASE + "/embeddings",
-        headers={"Authorization": f"Bearer {EMBED_KEY}"},
-        json={"model": EMBED_MODEL, "input": texts},
-        timeout=60,
-    )
-    r.raise_for_status()
-    js = r.json()
-    vecs = [item["embedding"] for item in js.get("data", [])]
-    if not vecs:
-        raise RuntimeError(f"Empty embeddings response: {js}")
-    # 维度校验
-    if len(vecs[0]) != EMBED_DIM:
-        raise RuntimeError(f"Embedding dim mismatch: got {len(vecs[0])}, expect {EMBED_DIM}")
-    return vecs
+def write_embeddings(cur, ids: List[int], vecs: List[List[float]], hashes: List[bytes]):
+    # 二进制 COPY 到临时暂存表，再一条 UPDATE ... FROM 合并
+    # embedding_hash 记的是实际送去 embedding 的文本；期间若被 sync 改过，下一轮仍会重嵌
+    assert len(ids) == len(vecs) == len(hashes)
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS _embed_stage (id bigint, embedding vector, text_hash bytea)")
+    pgvec.copy_vectors(cur, "_embed_stage", ids, vecs, hashes)
+    cur.execute("""
+        UPDATE jira_issues j
+        SET embedding = s.embedding, embedding_hash = s.text_hash, embedding_model = %s, embedded_at = NOW()
+        FROM _embed_stage s
+        WHERE j.id = s.id
+    """, (EMBED_MODEL,))
+    cur.execute("TRUNCATE _embed_stage")
 
-def write_embeddings(cur, ids: List[int], vecs: List[List[float]]):
-    assert len(ids) == len(vecs)
-    for _id, v in zip(ids, vecs):
-        cur.execute(
-            "UPDATE jira_issues SET embedding = %s::vector WHERE id = %s",
-            (_vec_literal(v), _id)
-        )
+def embed_adaptive(texts: List[str], ctl: AdaptiveBatch) -> List[List[float]]:
+    """共享客户端的回填优先级：超时 / 413 / 5xx 对半拆开重试并缩小后续批，单条抖动退避。"""
+    return default_client().embed(texts, priority=BATCH, ctl=ctl)
 
-def run(project_key: str, batch_size: int = 32, limit: int = 1000):
-    print(f"[EMBED] project={project_key} model={EMBED_MODEL} dim={EMBED_DIM} base={EMBED_BASE}", flush=True)
-    total = 0
+def run(project_key: str, batch_size: int = 32, limit: int = 1000, concurrency: int = 4, adopt: bool = False):
+    cap = default_client().batch_max_concurrency
+    if concurrency > cap:
+        # 多出来的线程只会在客户端的并发名额上排队
+        print(f"[EMBED] concurrency {concurrency} capped to EMBED_BATCH_MAX_CONCURRENCY={cap}", flush=True)
+        concurrency = cap
+    print(f"[EMBED] project={project_key} model={EMBED_MODEL} dim={EMBED_DIM} base={EMBED_BASE} concurrency={concurrency}", flush=True)
     with pg_conn() as conn:
         with conn.cursor() as cur:
+            n_hash = backfill_hashes(cur, project_key)
+            n_adopt = adopt_existing(cur, project_key) if adopt else 0
+        conn.commit()
+    if n_hash or n_adopt:
+        print(f"[HASH] backfilled={n_hash} adopted={n_adopt}", flush=True)
+    ctl = AdaptiveBatch(batch_size)
+    page_size = max(256, batch_size * concurrency * 4)
+    buf = deque()
+    last_id, read, total = 0, 0, 0
+    exhausted = False
+    t_start = time.perf_counter()
+
+    # 读（keyset 分页进缓冲）-> K 个并发 embedding 请求 -> 完成一个写一个（COPY + UPDATE FROM）
+    with pg_conn() as conn, ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as ex:
+        with conn.cursor() as cur:
+            inflight = {}
             while True:
-                rows = fetch_pending(cur, project_key, min(batch_size, limit - total))
-                if not rows:
-                    break
-                ids, keys, texts = [], [], []
-                for _id, key, title, desc in rows:
-                    ids.append(_id); keys.append(key); texts.append(_to_text(title, desc))
-                try:
-                    vecs = embed_batch(texts)
-                except requests.HTTPError as e:
-                    # 简单退避重试
-                    print(f"[HTTPERR] {e.response.status_code} {e.response.text[:200]}", flush=True)
-                    time.sleep(2)
-                    vecs = embed_batch(texts)
-                write_embeddings(cur, ids, vecs)
-                conn.commit()
-                total += len(ids)
-                print(f"[BATCH] size={len(ids)} total={total} last={keys[-1]}", flush=True)
-                if total >= limit:
+                while len(inflight) < concurrency:
+                    if not buf and not exhausted:
+                        rows = fetch_pending(cur, project_key, min(page_size, limit - read), last_id)
+                        conn.commit()
+                        if rows:
+                            last_id = rows[-1][0]
+                            read += len(rows)
+                            buf.extend(rows)
+                        exhausted = not rows or read >= limit
+                    if not buf:
+                        break
+                    chunk = [buf.popleft() for _ in range(min(ctl.size, len(buf)))]
+                    texts = [to_text(title, desc) for _, _, title, desc in chunk]
+                    inflight[ex.submit(embed_adaptive, texts, ctl)] = (chunk, [content_hash(t) for t in texts])
+                if not inflight:
                     break
-    print(f"[DONE] embedded={total}", flush=True)
+
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    chunk, hashes = inflight.pop(fut)
+                    vecs = fut.result()
+                    write_embeddings(cur, [r[0] for r in chunk], vecs, hashes)
+                    # 提交时才投递：core 的进程内向量索引收到后立即增量刷新
+                    cur.execute("SELECT pg_notify('jira_embeddings', %s)", (project_key,))
+                    conn.commit()
+                    total += len(chunk)
+                    elapsed = time.perf_counter() - t_start
+                    print(f"[BATCH] size={len(chunk)} total={total} next_batch={ctl.size} inflight={len(inflight)} "
+                          f"rate={total/elapsed:.1f} issues/s last={chunk[-1][1]}", flush=True)
+
+    elapsed = time.perf_counter() - t_start
+    print(f"[DONE] embedded={total} elapsed={elapsed:.1f}s rate={total/elapsed if elapsed else 0:.1f} issues/s", flush=True)
+    report_job("embed_jira", project_key, total, elapsed, batch_size=ctl.size)
 
 def _argv():
     import argparse
@@ -96,8 +150,13 @@ def _argv():
     ap.add_argument("--project", required=True)
     ap.add_argument("--batch", type=int, default=32)
     ap.add_argument("--limit", type=int, default=1000, help="max rows to process this run")
+    ap.add_argument("--concurrency", type=int, default=int(os.environ.get("EMBED_CONCURRENCY","4")),
+                    help="concurrent embedding requests")
+    ap.add_argument("--adopt-existing", action="store_true",
+                    help="treat vectors written before content hashing as current for EMBED_MODEL instead of re-embedding them")
     return ap.parse_args()
 
 if __name__ == "__main__":
     args = _argv()
-    run(args.project, batch_size=args.batch, limit=args.limit)
+    run(args.project, batch_size=args.batch, limit=args.limit, concurrency=max(1, args.concurrency),
+        adopt=args.adopt_existing)
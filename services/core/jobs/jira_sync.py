@@ -1,8 +1,14 @@
 import os, sys, time, json, datetime as dt
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+import ijson
 import requests
 import psycopg
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jira_issue import ISSUE_COLS, ISSUE_FIELDS, RAW_ALL, RAW_FIELDS, UPSERT_SET, issue_row
+from metrics import report_job
+
 JIRA_URL = os.environ.get("JIRA_URL","").rstrip("/")
 JIRA_EMAIL = os.environ.get("JIRA_EMAIL","")
 JIRA_API_TOKEN = os.environ.get("JIRA_API_TOKEN","")
@@ -12,27 +18,13 @@ PG_DB   = os.environ.get("POSTGRES_DB","contextual")
 PG_USER = os.environ.get("POSTGRES_USER","postgres")
 PG_PASS = os.environ.get("POSTGRES_PASSWORD","postgres")
 
+# Jira 请求复用 keep-alive 连接
+_http = requests.Session()
+
 def pg_conn():
     dsn = f"host={PG_HOST} dbname={PG_DB} user={PG_USER} password={PG_PASS}"
     return psycopg.connect(dsn)
 
-def _plain_text_description(desc):
-    if not desc:
-        return None
-    if isinstance(desc, str):
-        return desc
-    try:
-        def walk(node):
-            t = node.get("type")
-            if t == "text":
-                return node.get("text","")
-            if "content" in node and isinstance(node["content"], list):
-                return "".join(walk(c) for c in node["content"])
-            return ""
-        return walk(desc)
-    except Exception:
-        return None
-
 def _upsert_project(cur, project_key: str, name: str, raw: Dict[str,Any]):
     cur.execute("""
         INSERT INTO jira_projects(project_key, name, raw, updated_at)
@@ -41,51 +33,30 @@ def _upsert_project(cur, project_key: str, name: str, raw: Dict[str,Any]):
         SET name=EXCLUDED.name, raw=EXCLUDED.raw, updated_at=NOW()
     """, (project_key, name, json.dumps(raw)))
 
-def _upsert_issue(cur, issue: Dict[str,Any]):
-    key = issue["key"]
-    f = issue.get("fields", {}) or {}
-    proj_key = (f.get("project") or {}).get("key") or key.split("-")[0]
-    title = f.get("summary") or ""
-    desc_plain = _plain_text_description(f.get("description"))
-    status = (f.get("status") or {}).get("name")
-    priority = (f.get("priority") or {}).get("name")
-    assignee = f.get("assignee")
-    reporter = f.get("reporter")
-    url = f"{JIRA_URL}/browse/{key}"
-
-    def parse_ts(s):
-        if not s: return None
-        try:
-            return dt.datetime.fromisoformat(s.replace("Z","+00:00"))
-        except Exception:
-            return None
-    created_ts = parse_ts(f.get("created"))
-    updated_ts = parse_ts(f.get("updated"))
-
+def _bulk_upsert_issues(cur, rows: List[tuple]) -> int:
+    """整页 COPY 到临时暂存表，再一条 INSERT ... SELECT ... ON CONFLICT 合并。rows 为 jira_issue.issue_row() 的结果。"""
+    if not rows:
+        return 0
     cur.execute("""
-        INSERT INTO jira_issues(
-            jira_key, project_key, title, description, status, priority,
-            assignee, reporter, url, created_at, updated_at, raw
+        CREATE TEMP TABLE IF NOT EXISTS _issue_stage (
+            jira_key text, project_key text, title text, description text, status text, priority text,
+            assignee jsonb, reporter jsonb, url text, created_at timestamptz, updated_at timestamptz, raw jsonb,
+            content_hash bytea
         )
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        ON CONFLICT (jira_key) DO UPDATE SET
-            project_key=EXCLUDED.project_key,
-            title=EXCLUDED.title,
-            description=EXCLUDED.description,
-            status=EXCLUDED.status,
-            priority=EXCLUDED.priority,
-            assignee=EXCLUDED.assignee,
-            reporter=EXCLUDED.reporter,
-            url=EXCLUDED.url,
-            created_at=COALESCE(EXCLUDED.created_at, jira_issues.created_at),
-            updated_at=COALESCE(EXCLUDED.updated_at, jira_issues.updated_at),
-            raw=EXCLUDED.raw
-    """, (
-        key, proj_key, title, desc_plain, status, priority,
-        json.dumps(assignee) if assignee else None,
-        json.dumps(reporter) if reporter else None,
-        url, created_ts, updated_ts, json.dumps(issue)
-    ))
+    """)
+    cur.execute("TRUNCATE _issue_stage")
+    with cur.copy(f"COPY _issue_stage ({', '.join(ISSUE_COLS)}) FROM STDIN") as cp:
+        for row in rows:
+            cp.write_row(row)
+    # 同一批里同 key 出现多次时只取最新一条（ON CONFLICT 不允许同一行被改两次）
+    cur.execute(f"""
+        INSERT INTO jira_issues({", ".join(ISSUE_COLS)})
+        SELECT DISTINCT ON (jira_key) {", ".join(ISSUE_COLS)}
+        FROM _issue_stage
+        ORDER BY jira_key, updated_at DESC NULLS LAST
+        ON CONFLICT (jira_key) DO UPDATE SET {UPSERT_SET}
+    """)
+    return cur.rowcount
 
 def _get_sync_state(cur, project_key: str):
     cur.execute("SELECT last_issue_updated FROM jira_sync_state WHERE project_key=%s", (project_key,))
@@ -110,22 +81,97 @@ def _jira_search_page(project_key: str, since: Optional[dt.datetime], next_token
     body = {
         "jql": jql,
         "maxResults": 100,
-        "fields": ["summary","description","status","priority","assignee","reporter","project","created","updated"]
+        "fields": ISSUE_FIELDS
     }
     if next_token:
         body["nextPageToken"] = next_token
 
-    r = requests.post(f"{JIRA_URL}/rest/api/3/search/jql",
-                      json=body, auth=(JIRA_EMAIL, JIRA_API_TOKEN), timeout=30)
-    if r.status_code == 429:
+    while True:
+        with _http.post(f"{JIRA_URL}/rest/api/3/search/jql", json=body, auth=(JIRA_EMAIL, JIRA_API_TOKEN),
+                        timeout=30, stream=True) as r:
+            if r.status_code != 429:
+                r.raise_for_status()
+                r.raw.decode_content = True
+                return _parse_search_page(r.raw)
         time.sleep(2)
-        return _jira_search_page(project_key, since, next_token)
-    r.raise_for_status()
-    js = r.json()
-    issues = js.get("issues", []) or (js.get("data", {}) or {}).get("issues", [])
-    return issues, js.get("nextPageToken"), js.get("isLast", js.get("nextPageToken") is None)
 
-def sync_project(project_key: str, full: bool=False, since_cli: Optional[str]=None):
+_ISSUE_PREFIXES = ("issues.item", "data.issues.item")
+
+def _parse_search_page(fp):
+    """边读边解析一页搜索结果：每个 issue 读完立即转成行元组，整页响应和 issue 字典都不常驻内存。
+
+    返回 (rows, next_token, is_last)。
+    """
+    rows, meta, builder = [], {}, None
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event == "end_map" and prefix in _ISSUE_PREFIXES:
+                rows.append(issue_row(builder.value))
+                builder = None
+        elif event == "start_map" and prefix in _ISSUE_PREFIXES:
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix in ("nextPageToken", "isLast"):
+            meta[prefix] = value
+    token = meta.get("nextPageToken")
+    return rows, token, meta.get("isLast", token is None)
+
+_ROW_UPDATED = ISSUE_COLS.index("updated_at")
+
+def table_sizes(cur) -> Dict[str, float]:
+    """jira_issues 的空间占用（MB）与 raw 平均存储字节数（压缩后）。avg 要扫全表，大表上要几秒。"""
+    cur.execute("""
+        SELECT pg_total_relation_size(c.oid), pg_relation_size(c.oid),
+               COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0), pg_indexes_size(c.oid),
+               (SELECT COALESCE(avg(pg_column_size(raw)), 0) FROM jira_issues),
+               (SELECT count(*) FROM jira_issues)
+        FROM pg_class c WHERE c.oid = 'jira_issues'::regclass
+    """)
+    total, heap, toast, idx, raw_avg, n = cur.fetchone()
+    mb = lambda b: round(b / 1048576, 1)
+    return {"total_mb": mb(total), "heap_mb": mb(heap), "toast_mb": mb(toast), "indexes_mb": mb(idx),
+            "raw_avg_bytes": round(float(raw_avg)), "rows": n}
+
+def _print_sizes(cur, when: str):
+    print(f"[SIZE] {when} " + " ".join(f"{k}={v}" for k, v in table_sizes(cur).items()), flush=True)
+
+SLIM_BATCH = 1000
+
+def slim_raw(project_key: str, sizes: bool=False):
+    """把已有行的 raw 改写成当前 JIRA_RAW_FIELDS 投影；已经符合投影的行不动。
+
+    改写释放的空间要 VACUUM FULL jira_issues（锁表）或 pg_repack 之后才还给磁盘。
+    """
+    if RAW_ALL:
+        print("[SLIM] JIRA_RAW_FIELDS=* keeps full issues, nothing to do", flush=True)
+        return
+    keep = list(RAW_FIELDS)
+    with pg_conn() as conn, conn.cursor() as cur:
+        if sizes:
+            _print_sizes(cur, "before")
+        cur.execute("SELECT COALESCE(min(id), 0), COALESCE(max(id), 0) FROM jira_issues WHERE project_key=%s",
+                    (project_key,))
+        lo, hi = cur.fetchone()
+        total, t_start = 0, time.perf_counter()
+        for start in range(lo - 1, hi, SLIM_BATCH):
+            cur.execute("""
+                UPDATE jira_issues SET raw = CASE WHEN %(none)s THEN NULL ELSE jsonb_build_object(
+                    'id', raw->'id', 'key', raw->'key',
+                    'fields', COALESCE((SELECT jsonb_object_agg(k, v) FROM jsonb_each(raw->'fields') AS e(k, v)
+                                        WHERE k = ANY(%(keep)s) AND v <> 'null'::jsonb), '{}'::jsonb)) END
+                WHERE project_key=%(p)s AND id > %(a)s AND id <= %(b)s AND raw IS NOT NULL
+                  AND (%(none)s OR raw - ARRAY['id','key','fields'] <> '{}'::jsonb
+                       OR COALESCE(raw->'fields', '{}'::jsonb) - %(keep)s::text[] <> '{}'::jsonb)
+            """, {"none": not keep, "keep": keep, "p": project_key, "a": start, "b": start + SLIM_BATCH})
+            conn.commit()
+            total += cur.rowcount
+        print(f"[SLIM] project={project_key} fields={','.join(keep) or '<none>'} rewritten={total} "
+              f"elapsed={time.perf_counter() - t_start:.1f}s", flush=True)
+        if sizes:
+            _print_sizes(cur, "after")
+
+def sync_project(project_key: str, full: bool=False, since_cli: Optional[str]=None, sizes: bool=False):
     assert JIRA_URL and JIRA_EMAIL and JIRA_API_TOKEN, "Missing Jira config"
 
     proj = requests.get(f"{JIRA_URL}/rest/api/3/project/{project_key}",
@@ -142,33 +188,48 @@ def sync_project(project_key: str, full: bool=False, since_cli: Optional[str]=No
                 try: since = dt.datetime.fromisoformat(since_cli)
                 except Exception: pass
 
-            print(f"[SYNC] project={project_key} name={proj_name} since={since} full={full}", flush=True)
+            print(f"[SYNC] project={project_key} name={proj_name} since={since} full={full} "
+                  f"raw_fields={'*' if RAW_ALL else (','.join(RAW_FIELDS) or '<none>')}", flush=True)
+            if sizes:
+                _print_sizes(cur, "before")
 
             total = 0
             max_updated = since
-            token = None
-            while True:
-                issues, token, is_last = _jira_search_page(project_key, since, token)
-                for it in issues:
-                    _upsert_issue(cur, it)
-                    upd = (it.get("fields") or {}).get("updated")
-                    if upd:
-                        try:
-                            ts = dt.datetime.fromisoformat(upd.replace("Z","+00:00"))
-                            if (max_updated is None) or (ts > max_updated):
-                                max_updated = ts
-                        except Exception:
-                            pass
-                conn.commit()
-                batch = len(issues)
-                total += batch
-                print(f"[BATCH] token={'<start>' if token is None else str(token)[:8]} size={batch} total={total}", flush=True)
-                if is_last or batch == 0:
-                    break
+            t_start = time.perf_counter()
+            # 拉取与写入重叠：写当前页的同时，后台线程已在下载下一页
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="jira-fetch") as ex:
+                fut = ex.submit(_jira_search_page, project_key, since, None)
+                while True:
+                    t_fetch = time.perf_counter()
+                    rows, token, is_last = fut.result()
+                    wait_s = time.perf_counter() - t_fetch
+                    batch = len(rows)
+                    if not (is_last or batch == 0):
+                        fut = ex.submit(_jira_search_page, project_key, since, token)
+
+                    t0 = time.perf_counter()
+                    _bulk_upsert_issues(cur, rows)
+                    conn.commit()
+                    write_s = time.perf_counter() - t0
+                    for row in rows:
+                        ts = row[_ROW_UPDATED]
+                        if ts and ((max_updated is None) or (ts > max_updated)):
+                            max_updated = ts
+                    total += batch
+                    rate = batch / write_s if write_s > 0 else 0.0
+                    overall = total / (time.perf_counter() - t_start)
+                    print(f"[BATCH] token={'<start>' if token is None else str(token)[:8]} size={batch} total={total} "
+                          f"write={write_s*1000:.0f}ms ({rate:.0f} issues/s) fetch_wait={wait_s*1000:.0f}ms overall={overall:.0f} issues/s", flush=True)
+                    if is_last or batch == 0:
+                        break
 
             _set_sync_state(cur, project_key, max_updated)
             conn.commit()
-            print(f"[DONE] total={total} last_updated={max_updated}", flush=True)
+            elapsed = time.perf_counter() - t_start
+            print(f"[DONE] total={total} last_updated={max_updated} elapsed={elapsed:.1f}s", flush=True)
+            report_job("jira_sync", project_key, total, elapsed)
+            if sizes:
+                _print_sizes(cur, "after")
 
 def _argv():
     import argparse
@@ -176,12 +237,18 @@ def _argv():
     ap.add_argument("--project", required=True, help="Jira project key, e.g. SCRUM")
     ap.add_argument("--full", action="store_true", help="Full sync (ignore stored state)")
     ap.add_argument("--since", help="Override since ISO timestamp, e.g. 2025-01-01T00:00:00+00:00")
+    ap.add_argument("--sizes", action="store_true", help="Print jira_issues table/TOAST/raw sizes before and after")
+    ap.add_argument("--slim-raw", action="store_true",
+                    help="Rewrite raw of existing rows to the JIRA_RAW_FIELDS projection instead of syncing")
     return ap.parse_args()
 
 if __name__ == "__main__":
     args = _argv()
     try:
-        sync_project(args.project, full=args.full, since_cli=args.since)
+        if args.slim_raw:
+            slim_raw(args.project, sizes=args.sizes)
+        else:
+            sync_project(args.project, full=args.full, since_cli=args.since, sizes=args.sizes)
     except Exception as e:
         print("ERR", type(e).__name__, str(e))
         sys.exit(2)
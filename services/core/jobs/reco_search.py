@@ -1,41 +1,67 @@
-import os, argparse, json
-import requests, psycopg
+import os, sys, argparse
+import psycopg
+from psycopg import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embed_cache import EmbeddingCache
+from embed_client import EMBED_MODEL, default_client
+import pgvec
+import routing
 
 PG_HOST = os.environ.get("POSTGRES_HOST","postgres")
 PG_DB   = os.environ.get("POSTGRES_DB","contextual")
 PG_USER = os.environ.get("POSTGRES_USER","postgres")
 PG_PASS = os.environ.get("POSTGRES_PASSWORD","postgres")
 
-EMBED_BASE  = os.environ.get("EMBED_API_BASE","http://host.docker.internal:1234/v1").rstrip("/")
-EMBED_KEY   = os.environ.get("EMBED_API_KEY","lm-studio")
-EMBED_MODEL = os.environ.get("EMBED_MODEL","Qwen3-Embedding-0.6B-GGUF")
+def _dsn():
+    return f"host={PG_HOST} dbname={PG_DB} user={PG_USER} password={PG_PASS}"
+
+def _embed_remote(texts):
+    return default_client().embed(texts)
 
-def _vec_lit(vec):
-    return "[" + ",".join(str(float(x)) for x in vec) + "]"
+_cache = None
 
 def embed(text: str):
-    r = requests.post(
-        EMBED_BASE + "/embeddings",
-        headers={"Authorization": f"Bearer {EMBED_KEY}"},
-        json={"model": EMBED_MODEL, "input": [text]},
-        timeout=30
-    )
-    r.raise_for_status()
-    return r.json()["data"][0]["embedding"]
-
-def search(project_key: str, query_vec, topk: int = 5):
-    dsn = f"host={PG_HOST} dbname={PG_DB} user={PG_USER} password={PG_PASS}"
-    with psycopg.connect(dsn) as conn, conn.cursor() as cur:
+    # 与 core 共用 embedding_cache 表：同一 query 不重复计算
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(EMBED_MODEL, _dsn())
+    return _cache.embed([text], _embed_remote)[0]
+
+def search(project_key: str, query_vec, topk: int = 5, ef_search: int = None, probes: int = None, mode: str = None):
+    with psycopg.connect(_dsn()) as conn:
+        pgvec.configure(conn)
+        if ef_search or probes:
+            # 命令行临时覆盖 PG_HNSW_EF_SEARCH / PG_IVFFLAT_PROBES，便于对比召回
+            pgvec.search_settings(conn, ef_search, probes)
+        # 与 core 相同的按项目检索方式（routing.py）；--mode 可强制指定以对比
+        mode = mode or routing.project_modes(conn).get(project_key, "exact")
+        print(f"[MODE] {mode} quant={pgvec.VECTOR_QUANT or '-'}")
+        cur = conn.cursor()
+        routing.apply_mode(cur, mode)
         # 使用 cosine 距离（<=> 越小越近）；同时给出相似度 score = 1 - distance
-        vec = _vec_lit(query_vec)
-        cur.execute(f"""
-            SELECT jira_key, title, status, updated_at,
-                   (1 - (embedding <=> %s::vector)) AS score
-            FROM jira_issues
-            WHERE project_key=%s AND embedding IS NOT NULL
-            ORDER BY embedding <=> %s::vector ASC
-            LIMIT %s
-        """, (vec, project_key, vec, topk))
+        # 查询向量二进制绑定一次；PG_VECTOR_QUANT 非空时先按量化索引取候选，再按 float32 精确重排
+        proj = sql.Literal(project_key) if mode == "partial" else sql.Placeholder("project")
+        quant = pgvec.VECTOR_QUANT if mode != "exact" else ""
+        source = sql.SQL("jira_issues") if not quant else sql.SQL("""(
+                    SELECT jira_key, project_key, title, status, updated_at, embedding FROM jira_issues
+                    WHERE project_key={proj} AND embedding IS NOT NULL
+                    ORDER BY {ann} ASC
+                    LIMIT %(cand)s
+                ) c""").format(proj=proj, ann=sql.SQL(pgvec.ann_order("%(vec)b::vector", quant)))
+        cur.execute(sql.SQL("""
+            SELECT jira_key, title, status, updated_at, (1 - d) AS score
+            FROM (
+                SELECT jira_key, title, status, updated_at, embedding <=> %(vec)b AS d
+                FROM {source}
+                WHERE project_key={proj} AND embedding IS NOT NULL
+                ORDER BY d ASC
+                LIMIT %(k)s
+            ) s
+            ORDER BY d ASC
+        """).format(source=source, proj=proj),
+            {"vec": pgvec.to_f32(query_vec), "project": project_key, "k": topk,
+             "cand": max(topk, pgvec.RERANK_CANDIDATES)})
         rows = cur.fetchall()
     return rows
 
@@ -44,12 +70,15 @@ if __name__ == "__main__":
     ap.add_argument("--project", required=True)
     ap.add_argument("--text", required=True, help="query text, e.g. commit msg + filenames")
     ap.add_argument("--topk", type=int, default=3)
+    ap.add_argument("--ef-search", type=int, help="override hnsw.ef_search for this query")
+    ap.add_argument("--probes", type=int, help="override ivfflat.probes for this query")
+    ap.add_argument("--mode", choices=routing.MODES, help="force a search path (default: same as core)")
     args = ap.parse_args()
 
     q = args.text.strip()
     print(f"[QUERY] {q}")
     v = embed(q)
-    rows = search(args.project, v, args.topk)
+    rows = search(args.project, v, args.topk, ef_search=args.ef_search, probes=args.probes, mode=args.mode)
     if not rows:
         print("[RESULT] empty")
     else:
@@ -0,0 +1,185 @@
+"""在线重建 jira_issues.embedding 的 ANN 索引（语料规模变化较大、或想换 HNSW / ivfflat 参数时）。
+
+CREATE INDEX CONCURRENTLY 建新索引 -> 删旧索引 -> 改名，期间检索不中断、写入不锁表。
+
+  python reindex_vectors.py                                # HNSW，m=16 ef_construction=64
+  python reindex_vectors.py --m 24 --ef-construction 128
+  python reindex_vectors.py --method ivfflat               # lists 按当前行数估算
+  python reindex_vectors.py --dry-run                      # 只打印将执行的 SQL
+  python reindex_vectors.py --quant binary                 # 量化索引（pgvector >= 0.7），配合 PG_VECTOR_QUANT
+  python reindex_vectors.py --quant binary --replace-all   # 同时删掉其它全表索引（float32 / 另一种方法）
+
+默认只替换同一方法、同一量化方式的旧索引：float32 索引还要给未设 PG_VECTOR_QUANT 的检索和精确重排用。
+
+按项目建部分索引（WHERE project_key = '...'），每个项目只在自己的图 / 聚类里检索：
+  python reindex_vectors.py --per-project                  # 向量行数 >= --min-rows 的项目各建一个
+  python reindex_vectors.py --per-project --project SCRUM
+  python reindex_vectors.py --per-project --drop-global    # 建完后删掉全表索引
+行数不到 --min-rows 的项目由 core 精确检索（routing.py），不需要 ANN 索引。
+"""
+import os, sys, re, math, time
+import psycopg
+from psycopg import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pgvec
+from routing import EXACT_SEARCH_MAX_ROWS, partial_indexes
+
+PG_HOST = os.environ.get("POSTGRES_HOST","postgres")
+PG_DB   = os.environ.get("POSTGRES_DB","contextual")
+PG_USER = os.environ.get("POSTGRES_USER","postgres")
+PG_PASS = os.environ.get("POSTGRES_PASSWORD","postgres")
+
+INDEX_NAME = {"hnsw": "idx_jira_issues_embedding_hnsw", "ivfflat": "idx_jira_issues_embedding_cosine"}
+
+def pg_conn():
+    dsn = f"host={PG_HOST} dbname={PG_DB} user={PG_USER} password={PG_PASS}"
+    # CONCURRENTLY 不能在事务块里执行
+    return psycopg.connect(dsn, autocommit=True)
+
+def ivfflat_lists(rows: int) -> int:
+    # pgvector 建议：100 万行以内 rows/1000，以上 sqrt(rows)
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+def _quant_of(indexdef: str) -> str:
+    if "halfvec_cosine_ops" in indexdef:
+        return "halfvec"
+    if "bit_hamming_ops" in indexdef:
+        return "binary"
+    return ""
+
+def _existing_indexes(cur, method: str = None, quant: str = None):
+    """embedding 上的全表 ANN 索引名；给了 method / quant 时只要方法 / 量化方式相同的。"""
+    # 量化索引是表达式索引（indkey 为 0），按索引定义匹配 embedding 列
+    cur.execute("""
+        SELECT i.relname, am.amname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_am am ON am.oid = i.relam
+        WHERE x.indrelid = 'jira_issues'::regclass AND am.amname IN ('hnsw','ivfflat')
+          AND pg_get_indexdef(x.indexrelid) ~ '\\membedding\\M'
+          AND x.indpred IS NULL
+    """)
+    return [name for name, am, indexdef in cur.fetchall()
+            if (method is None or am == method) and (quant is None or _quant_of(indexdef) == quant)]
+
+def index_name(method: str, quant: str = "") -> str:
+    return INDEX_NAME[method] + (f"_{quant}" if quant else "")
+
+def partial_index_name(method: str, project: str, quant: str = "") -> str:
+    return f"idx_jira_issues_emb_{method}_" + (f"{quant}_" if quant else "") + re.sub(r"[^a-z0-9]+", "_", project.lower())[:32]
+
+def build_sql(method: str, rows: int, m: int, ef_construction: int, lists: int = None,
+              target: str = None, where: str = "", quant: str = ""):
+    if method == "hnsw":
+        opts = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    else:
+        opts = f"lists = {int(lists or ivfflat_lists(rows))}"
+    tmp = (target or index_name(method, quant)) + "_new"
+    return tmp, (f"CREATE INDEX CONCURRENTLY {tmp} ON jira_issues "
+                 f"USING {method} ({pgvec.index_expr(quant)}) WITH ({opts})" + (f" WHERE {where}" if where else ""))
+
+def _execute(cur, steps, maintenance_work_mem: str):
+    cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+    for s in steps:
+        t0 = time.perf_counter()
+        cur.execute(s)
+        print(f"[STEP] {s[:100]} ({time.perf_counter()-t0:.1f}s)", flush=True)
+    cur.execute("ANALYZE jira_issues")
+
+def run(method: str = "hnsw", m: int = 16, ef_construction: int = 64, lists: int = None,
+        maintenance_work_mem: str = "1GB", dry_run: bool = False, quant: str = "", replace_all: bool = False):
+    with pg_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM jira_issues WHERE embedding IS NOT NULL")
+        rows = cur.fetchone()[0]
+        tmp, create = build_sql(method, rows, m, ef_construction, lists, quant=quant)
+        # 上次中断留下的 _new（可能是 INVALID 索引）在第一步删掉，不算旧索引
+        found = _existing_indexes(cur) if replace_all else _existing_indexes(cur, method, quant)
+        old = [n for n in found if n != tmp]
+        target = index_name(method, quant)
+        steps = [f"DROP INDEX CONCURRENTLY IF EXISTS {tmp}", create]
+        steps += [f"DROP INDEX CONCURRENTLY IF EXISTS {name}" for name in old]
+        steps.append(f"ALTER INDEX {tmp} RENAME TO {target}")
+
+        print(f"[REINDEX] rows={rows} method={method} quant={quant or '-'} existing={old or '-'}", flush=True)
+        if dry_run:
+            for s in steps:
+                print("  " + s + ";")
+            return
+
+        _execute(cur, steps, maintenance_work_mem)
+        print(f"[DONE] {target}", flush=True)
+
+def run_per_project(method: str = "hnsw", m: int = 16, ef_construction: int = 64, lists: int = None,
+                    maintenance_work_mem: str = "1GB", min_rows: int = EXACT_SEARCH_MAX_ROWS,
+                    project: str = None, drop_global: bool = False, dry_run: bool = False, quant: str = ""):
+    with pg_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT project_key, count(*) FROM jira_issues WHERE embedding IS NOT NULL GROUP BY project_key")
+        counts = dict(cur.fetchall())
+        if project:
+            targets = [project]
+        else:
+            targets = sorted(p for p, n in counts.items() if n >= min_rows)
+        existing = partial_indexes(conn)
+
+        steps = []
+        for p in targets:
+            target = partial_index_name(method, p, quant)
+            where = sql.SQL("project_key = {}").format(sql.Literal(p)).as_string(conn)
+            tmp, create = build_sql(method, counts.get(p, 0), m, ef_construction, lists, target=target, where=where,
+                                    quant=quant)
+            old = [n for n in existing.get(p, []) if n != tmp]
+            print(f"[REINDEX] project={p} rows={counts.get(p, 0)} method={method} quant={quant or '-'} "
+                  f"existing={old or '-'}", flush=True)
+            steps += [f"DROP INDEX CONCURRENTLY IF EXISTS {tmp}", create]
+            steps += [f"DROP INDEX CONCURRENTLY IF EXISTS {name}" for name in old]
+            steps.append(f"ALTER INDEX {tmp} RENAME TO {target}")
+        small = sorted(p for p, n in counts.items() if p not in targets and p not in existing)
+        if small:
+            print(f"[REINDEX] below --min-rows={min_rows}, searched exactly: {','.join(small)}", flush=True)
+        if drop_global:
+            steps += [f"DROP INDEX CONCURRENTLY IF EXISTS {name}" for name in _existing_indexes(cur)]
+
+        if dry_run:
+            for s in steps:
+                print("  " + s + ";")
+            return
+        _execute(cur, steps, maintenance_work_mem)
+        print(f"[DONE] {len(targets)} partial index(es)", flush=True)
+
+def _argv():
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--method", choices=["hnsw","ivfflat"], default="hnsw")
+    ap.add_argument("--m", type=int, default=int(os.environ.get("PG_HNSW_M","16")))
+    ap.add_argument("--ef-construction", type=int, default=int(os.environ.get("PG_HNSW_EF_CONSTRUCTION","64")))
+    ap.add_argument("--lists", type=int, help="ivfflat lists (default: estimated from row count)")
+    ap.add_argument("--maintenance-work-mem", default="1GB", help="index build memory; HNSW builds much faster when the graph fits")
+    ap.add_argument("--quant", choices=["none", "halfvec", "binary"], default=pgvec.VECTOR_QUANT or "none",
+                    help="index a quantized expression (pgvector >= 0.7; default PG_VECTOR_QUANT). "
+                         "Search only uses it when PG_VECTOR_QUANT matches")
+    ap.add_argument("--replace-all", action="store_true",
+                    help="drop every other table-wide ANN index on embedding, not only the same method / --quant")
+    ap.add_argument("--per-project", action="store_true", help="one partial index per project instead of one table-wide index")
+    ap.add_argument("--min-rows", type=int, default=EXACT_SEARCH_MAX_ROWS,
+                    help="--per-project: only projects with at least this many vectors (default EXACT_SEARCH_MAX_ROWS)")
+    ap.add_argument("--project", help="--per-project: only this project")
+    ap.add_argument("--drop-global", action="store_true", help="--per-project: drop the table-wide index afterwards")
+    ap.add_argument("--dry-run", action="store_true")
+    return ap.parse_args()
+
+if __name__ == "__main__":
+    args = _argv()
+    quant = "" if args.quant == "none" else args.quant
+    try:
+        if args.per_project:
+            run_per_project(args.method, args.m, args.ef_construction, args.lists, args.maintenance_work_mem,
+                            args.min_rows, args.project, args.drop_global, args.dry_run, quant)
+        else:
+            run(args.method, args.m, args.ef_construction, args.lists, args.maintenance_work_mem, args.dry_run, quant,
+                args.replace_all)
+    except Exception as e:
+        print("ERR", type(e).__name__, str(e))
+        sys.exit(2)
@@ -1,147 +1,186 @@
-import os, json, time, base64, hmac, hashlib, urllib.parse
-import pika, requests
-import psycopg
-from fastapi import FastAPI
+import os, json, time, asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+import mq
+import metrics
+import routing
+from metrics import MESSAGES, STAGE_SECONDS, log_event, timed
+from db import POSTGRES_DSN, make_pool, pool_stats
+from dedup import Deduper, commit_key
+from dingtalk import DEFAULT_BOT, render_action_card, render_push_card
+from embed_cache import EmbeddingCache
+from embed_client import EMBED_MODEL, default_client
+from jira_events import JiraEventWorker
+from jira_keys import KeyCache, find_keys
+from pgvec import RERANK_CANDIDATES, to_f32
+from sender import DingSender
+from vector_index import VectorIndex
 
 # ===== env & consts =====
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST","rabbitmq")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER","guest")
-RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD","guest")
-QUEUE_RAW = "git_commit_raw"
-
-POSTGRES_DSN = f"host={os.getenv('POSTGRES_HOST','postgres')} dbname={os.getenv('POSTGRES_DB','contextual')} user={os.getenv('POSTGRES_USER','postgres')} password={os.getenv('POSTGRES_PASSWORD','postgres')}"
-DING_URL = os.getenv("DINGTALK_WEBHOOK_URL","")
-DING_SECRET = os.getenv("DINGTALK_SECRET","")
-PUBLIC_BASE = os.getenv("PUBLIC_BASE_URL","http://localhost:8003")
-
-# embedding / jira
-EMBED_BASE  = os.getenv("EMBED_API_BASE","http://host.docker.internal:1234/v1").rstrip("/")
-EMBED_KEY   = os.getenv("EMBED_API_KEY","lm-studio")
-EMBED_MODEL = os.getenv("EMBED_MODEL","Qwen3-Embedding-0.6B-GGUF")
+QUEUE_RAW = mq.QUEUE_RAW
+EVENT_PUSH = "git_push_raw"   # webhook push 级合并：一条消息带整个 push 的 commit
+
+# jira（embedding 服务的配置见 embed_client.py）
 JIRA_PROJECT_KEY = os.getenv("JIRA_PROJECT_KEY","SCRUM")
 
-# 阈值：低置信度提示 & 抑制发送
-CONFIDENCE_WARN = float(os.getenv("RECO_LOW_SCORE", "0.60"))  # 低于此在标题上提示
+# 阈值：抑制发送（低置信度标题提示见 dingtalk.CONFIDENCE_WARN）
 RECO_MIN_SCORE  = float(os.getenv("RECO_MIN_SCORE", "0.70"))  # 低于此不发卡片（直接丢弃）
 
-app = FastAPI()
+# commit message 里写了已存在的 Jira key 时直接作为 top-1，不做 embedding / 检索
+RECO_EXPLICIT_KEYS = os.getenv("RECO_EXPLICIT_KEYS", "1") == "1"
+# 1 = 仍然检索，向量结果作为显式 key 之后的补充候选（不再省 embedding 调用）
+RECO_EXPLICIT_WITH_SEARCH = os.getenv("RECO_EXPLICIT_WITH_SEARCH", "0") == "1"
+EXPLICIT_KEY_SCORE = 1.0
+
+# 消费攒批：最多 N 条 / 最多等待 T 毫秒，整批 embedding + 检索
+BATCH_SIZE     = int(os.getenv("CORE_BATCH_SIZE", "16"))
+BATCH_WAIT_MS  = int(os.getenv("CORE_BATCH_WAIT_MS", "50"))
+PREFETCH_COUNT = int(os.getenv("CORE_PREFETCH", "10"))
+
+# 消费者线程数（每个一条独立连接）、优雅排空超时、断线重连间隔
+CONSUMERS       = int(os.getenv("CORE_CONSUMERS", "4"))
+DRAIN_TIMEOUT   = float(os.getenv("CORE_DRAIN_TIMEOUT", "30"))
+RECONNECT_DELAY = float(os.getenv("CORE_RECONNECT_DELAY", "5"))
+
+# 进程内向量索引（JIRA_PROJECT_KEY 的向量常驻内存）；未就绪或出错时回退 Postgres
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "0") == "1"
+
+# 队列深度采样间隔（秒，由 0 号消费者在自己的连接上被动声明队列取得）
+QUEUE_DEPTH_INTERVAL = float(os.getenv("CORE_QUEUE_DEPTH_INTERVAL", "15"))
+
+# 钉钉发送阶段是否随本进程启动（多实例时只在一个实例开启，令牌桶才准确）
+DING_SENDER_ENABLED = os.getenv("DING_SENDER_ENABLED", "1") == "1"
+
+# Jira webhook 事件（单条 upsert + 立即 embedding）是否随本进程消费
+JIRA_EVENTS_ENABLED = os.getenv("JIRA_EVENTS_ENABLED", "1") == "1"
+
+PG_POOL = make_pool("core")
+DEDUP = Deduper()
+KEY_CACHE = KeyCache(PG_POOL) if RECO_EXPLICIT_KEYS else None
+ROUTER = routing.Router(PG_POOL, JIRA_PROJECT_KEY)
+VINDEX = VectorIndex(JIRA_PROJECT_KEY, POSTGRES_DSN, EMBED_MODEL) if VECTOR_INDEX_ENABLED else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    PG_POOL.open()
+    if VINDEX is not None:
+        VINDEX.start()   # 后台加载，加载完成前检索走 Postgres
+    # 连接池就绪后启动消费线程；uvicorn 收到 SIGTERM 时走到 finally 做优雅排空
+    # 注意：每个 uvicorn worker 进程都会各自启动 CORE_CONSUMERS 个消费者
+    workers = start_consumers(CONSUMERS)
+    if DING_SENDER_ENABLED:
+        workers.append(DingSender(PG_POOL, reconnect_delay=RECONNECT_DELAY))
+        workers[-1].start()
+    if JIRA_EVENTS_ENABLED:
+        workers.append(JiraEventWorker(PG_POOL, _embed_remote, EMBED_MODEL, reconnect_delay=RECONNECT_DELAY))
+        workers[-1].start()
+    app.state.workers = workers
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(mq.drain_threads, workers, DRAIN_TIMEOUT)
+        if VINDEX is not None:
+            await asyncio.to_thread(VINDEX.close)
+        PG_POOL.close()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
-# ===== DingTalk helpers =====
-def ding_sign_url(base_url:str, secret:str):
-    ts = str(int(time.time() * 1000))
-    string_to_sign = f"{ts}\n{secret}".encode("utf-8")
-    h = hmac.new(secret.encode("utf-8"), string_to_sign, digestmod=hashlib.sha256).digest()
-    sign = urllib.parse.quote_plus(base64.b64encode(h))
-    return f"{base_url}&timestamp={ts}&sign={sign}"
-
-def send_action_card(trace_id:str, commit_hash:str, repo:str, top1_key:str, candidates=None, score:float=None):
-    url = ding_sign_url(DING_URL, DING_SECRET) if DING_SECRET and "sign=" not in DING_URL else DING_URL
-    keyword = os.getenv("DINGTALK_KEYWORD","").strip()
-
-    # 文案
-    title = "是否关联到该 Jira 任务？"
-    if score is not None and score < CONFIDENCE_WARN:
-        title = "（低置信度）是否关联到该 Jira 任务？"
-
-    body_lines = [
-        "**Contextual 推荐关联**",
-        f"仓库：{repo}",
-        f"Commit：`{commit_hash}`",
-        "",
-        f"猜测的 Jira：**{top1_key}**" + (f"（置信度 {score:.2f}）" if score is not None else "")
-    ]
-
-    # === 带上 top1 / selected 参数 ===
-    def cb_url(jira_key:str, fb:bool, selected:str=None):
-        sel = selected or jira_key
-        base = f"{PUBLIC_BASE}/callback/dingtalk"
-        q = {
-            "trace_id": trace_id,
-            "commit": commit_hash,
-            "jira": jira_key,          # 兼容旧版
-            "feedback": "true" if fb else "false",
-            "top1": top1_key,
-            "selected": sel
-        }
-        return base + "?" + urllib.parse.urlencode(q)
-
-    btns = []
-    btns.append({"title":"✅ Yes, link it", "actionURL": cb_url(top1_key, True, selected=top1_key)})
+@app.get("/metrics")
+def prom_metrics():
+    body, ctype = metrics.render()
+    return Response(content=body, media_type=ctype)
 
-    if candidates:
-        body_lines.append("")
-        body_lines.append("**其它候选：**")
-        for k, s in candidates:
-            if k == top1_key:
-                continue
-            body_lines.append(f"- {k}（{s:.2f}）")
-            btns.append({"title": f"👉 {k}", "actionURL": cb_url(k, True, selected=k)})
-
-    btns.append({"title":"❌ Not sure", "actionURL": cb_url(top1_key, False, selected=top1_key)})
-
-    body_text = "\n".join(body_lines)
-    if keyword:
-        body_text = f"{keyword}\n\n" + body_text
-
-    payload = {
-        "msgtype": "actionCard",
-        "actionCard": {
-            "title": title,
-            "text": body_text,
-            "btns": btns[:4],   # 钉钉建议 ≤4 个按钮
-            "btnOrientation":"0"
-        }
-    }
-    r = requests.post(url, json=payload, timeout=(5, 10))
-    try:
-        data = r.json()
-    except Exception:
-        data = {"raw": r.text}
-    print("[DINGTALK RESP]", r.status_code, data)
-    r.raise_for_status()
-    if isinstance(data, dict) and data.get("errcode",0)!=0:
-        raise RuntimeError(f"DingTalk send failed: {data}")
-    return data
+@app.get("/stats")
+def stats():
+    out = {"embed_cache": EMBED_CACHE.snapshot(), "embed_client": EMBED_CLIENT.snapshot(), "pg_pool": pool_stats(PG_POOL), "dedup": DEDUP.snapshot()}
+    if KEY_CACHE is not None:
+        out["explicit_keys"] = KEY_CACHE.snapshot()
+    out["routing"] = ROUTER.snapshot()
+    if VINDEX is not None:
+        out["vector_index"] = VINDEX.snapshot()
+    for w in getattr(app.state, "workers", []):
+        if isinstance(w, DingSender):
+            out["ding_sender"] = dict(w.stats)
+        elif isinstance(w, JiraEventWorker):
+            out["jira_events"] = dict(w.stats)
+    return out
 
 # ===== Embedding & Search helpers =====
-def _vec_lit(vec):
-    return "[" + ",".join(str(float(x)) for x in vec) + "]"
+EMBED_CLIENT = default_client()
+
+def _embed_remote(texts):
+    """一次批量 embedding（共享客户端：keep-alive、并发上限、拆批重试、熔断）；返回顺序与 texts 一致。"""
+    return EMBED_CLIENT.embed(texts)
+
+# 相同 query 文本（cherry-pick / rebase / 多分支推同一 commit）直接命中缓存
+EMBED_CACHE = EmbeddingCache(EMBED_MODEL, pool=PG_POOL)
+
+def embed_texts(texts):
+    return EMBED_CACHE.embed(texts, _embed_remote)
 
 def embed_text(text:str):
-    r = requests.post(
-        EMBED_BASE + "/embeddings",
-        headers={"Authorization": f"Bearer {EMBED_KEY}"},
-        json={"model": EMBED_MODEL, "input": [text]},
-        timeout=(5, 30)
-    )
-    r.raise_for_status()
-    js = r.json()
-    return js["data"][0]["embedding"]
-
-def search_topk(project_key:str, query_vec, k:int=3):
-    vec = _vec_lit(query_vec)
-    with psycopg.connect(POSTGRES_DSN) as db, db.cursor() as cur:
-        cur.execute(f"""
-            SELECT jira_key, (1 - (embedding <=> %s::vector)) AS score
-            FROM jira_issues
-            WHERE project_key=%s AND embedding IS NOT NULL
-            ORDER BY embedding <=> %s::vector ASC
-            LIMIT %s
-        """, (vec, project_key, vec, k))
-        rows = cur.fetchall()
-    return rows  # [(key, score), ...]
+    return embed_texts([text])[0]
 
-def build_query_from_payload(p:dict) -> str:
+def search_topk_batch(project_key:str, query_vecs, k:int=3, mode:str="global"):
+    """多条查询向量一次往返：LATERAL 对每个向量各做一次 Top-K。返回与 query_vecs 等长的 [[(key, score), ...], ...]。
+
+    mode 见 routing.py：partial 走项目自己的部分索引，exact 精确排序，global 走全表索引。
+    PG_VECTOR_QUANT 非空时首轮走量化索引取 PG_RERANK_CANDIDATES 个候选，再按 float32 精确重排。
+    """
+    if not query_vecs:
+        return []
+    out = [[] for _ in query_vecs]
+    with PG_POOL.connection() as db, db.cursor() as cur:
+        routing.apply_mode(cur, mode)
+        cur.execute(routing.topk_batch_query(mode, project_key),
+                    {"vecs": [to_f32(v) for v in query_vecs], "project": project_key, "k": k,
+                     "cand": max(k, RERANK_CANDIDATES)}, prepare=True)
+        for ord_, key, score in cur.fetchall():
+            out[ord_ - 1].append((key, score))
+    return out
+
+def search_candidates(project_key:str, query_vecs, k:int=3):
+    """优先查进程内索引（仅 JIRA_PROJECT_KEY）；未启用 / 未就绪 / 出错时走 Postgres。"""
+    if VINDEX is not None and project_key == VINDEX.project_key:
+        try:
+            rows = VINDEX.search_batch(query_vecs, k)
+            if rows is not None:
+                return rows
+        except Exception as e:
+            VINDEX.stats["errors"] += 1
+            print("[VINDEX] search error, fallback postgres:", e)
+    return search_topk_batch(project_key, query_vecs, k, mode=ROUTER.mode(project_key))
+
+def search_routed(projects, query_vecs, k:int=3):
+    """projects[i]：第 i 个查询向量要检索的项目列表。每个项目一次往返，多项目的结果按 score 合并取 Top-K。"""
+    out = [[] for _ in query_vecs]
+    by_project = {}
+    for i, ps in enumerate(projects):
+        for p in ps:
+            by_project.setdefault(p, []).append(i)
+    for p, idx in by_project.items():
+        for i, rows in zip(idx, search_candidates(p, [query_vecs[i] for i in idx], k)):
+            out[i].extend(rows)
+    for i, ps in enumerate(projects):
+        if len(ps) > 1:
+            out[i] = sorted(out[i], key=lambda r: r[1], reverse=True)[:k]
+    return out
+
+def commit_message(p:dict):
     msg = p.get("commit_message") or p.get("message")
     if not msg:
         msg = (p.get("head_commit") or {}).get("message")
     if not msg and isinstance(p.get("commits"), list):
         msgs = [c.get("message","") for c in p["commits"] if c.get("message")]
         msg = "; ".join(msgs)[:500] if msgs else None
+    return msg
+
+def build_query_from_payload(p:dict) -> str:
+    msg = commit_message(p)
 
     files = []
     hc = p.get("head_commit") or {}
@@ -161,63 +200,309 @@ def build_query_from_payload(p:dict) -> str:
     return "\n".join(parts)
 
 # ===== MQ consumer =====
-def consume():
-    creds = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-    conn = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=creds))
-    ch = conn.channel()
-    ch.queue_declare(queue=QUEUE_RAW, durable=True)
-
-    def _cb(chx, method, props, body):
-        msg = json.loads(body)
-        p = msg.get("payload",{})
-        repo = p.get("repo","") or (p.get("repository") or {}).get("full_name","")
-        commit_hash = p.get("commit_hash","") or (p.get("head_commit") or {}).get("id","")[:12]
-        trace_id = msg.get("trace_id","")
-
-        # === embedding 检索 Top-K ===
-        top1 = "DEMO-1"; score = None; candidates = None
-        try:
-            query_text = build_query_from_payload(p)
-            qvec = embed_text(query_text)
-            rows = search_topk(JIRA_PROJECT_KEY, qvec, k=3)
-            if rows:
-                candidates = rows
-                top1, score = rows[0]
-                print(f"[RECO] project={JIRA_PROJECT_KEY} top1={top1} score={score:.4f} q='{query_text[:120]}'")
+def _parse_payload(trace_id:str, p:dict):
+    repo = p.get("repo","") or (p.get("repository") or {}).get("full_name","")
+    # 完整 SHA：新消息带 commit_sha；旧消息的 trace_id 就是 commit id
+    sha = p.get("commit_sha") or (p.get("head_commit") or {}).get("id") or trace_id
+    return {
+        "trace_id": trace_id,
+        "repo": repo,
+        "commit_hash": p.get("commit_hash","") or (p.get("head_commit") or {}).get("id","")[:12],
+        "dedup_key": commit_key(repo, sha),
+        "query_text": build_query_from_payload(p),
+        # 只扫 commit message：文件路径 / 仓库名里的 "v-2" 之类不算
+        "mentioned": find_keys(commit_message(p)) if KEY_CACHE is not None else [],
+    }
+
+def _parse_msg(body):
+    """返回 (items, push)：单 commit 消息 push 为 None；git_push_raw（webhook 合并模式）每个 commit 一个 item。"""
+    msg = json.loads(body)
+    p = msg.get("payload",{})
+    if msg.get("event_type") != EVENT_PUSH:
+        return [_parse_payload(msg.get("trace_id",""), p)], None
+    items = [_parse_payload(c.get("commit_sha",""), c) for c in p.get("commits") or []]
+    for it, c in zip(items, p.get("commits") or []):
+        it["subject"] = (c.get("message") or "").split("\n", 1)[0]
+    push = {"trace_id": msg.get("trace_id",""), "repo": p.get("repo",""), "ref": p.get("ref",""),
+            "commit_hash": (p.get("head_sha") or msg.get("trace_id",""))[:12]}
+    return items, push
+
+def recommend_batch(items):
+    """批量推荐：message 里有已存在的 Jira key 的直接用它；其余一次 embedding 请求 + 一次向量检索往返。
+
+    检索失败时这些条目回退 DEMO-1（与单条逻辑一致），显式 key 的条目不受影响。
+    """
+    results = [("DEMO-1", None, None)] * len(items)
+    if not items:
+        return results
+    explicit = [[] for _ in items]
+    projects = [ROUTER.default for _ in items]
+    all_rows = {}
+    try:
+        # key 校验 / 路由也会查库：出错时与检索失败一样整批回退，不让异常带走消费者
+        if KEY_CACHE is not None:
+            with timed(STAGE_SECONDS, stage="explicit_keys"):
+                explicit = KEY_CACHE.resolve([it.get("mentioned") or [] for it in items])
+        projects = [ROUTER.projects_for(it["repo"]) for it in items]
+        search_idx = [i for i, ks in enumerate(explicit) if not ks or RECO_EXPLICIT_WITH_SEARCH]
+        if search_idx:
+            with timed(STAGE_SECONDS, stage="embed"):
+                qvecs = embed_texts([items[i]["query_text"] for i in search_idx])
+            with timed(STAGE_SECONDS, stage="search"):
+                all_rows = dict(zip(search_idx, search_routed([projects[i] for i in search_idx], qvecs, k=3)))
+    except Exception as e:
+        failed = [i for i, ks in enumerate(explicit) if not ks]
+        MESSAGES.labels(outcome="fallback").inc(len(failed))
+        log_event("RECO ERROR", error=f"{type(e).__name__}: {e}", batch=len(items),
+                  trace_ids=[items[i]["trace_id"] for i in failed])
+
+    results = []
+    for i, it in enumerate(items):
+        ks, rows = explicit[i], all_rows.get(i)
+        if ks:
+            # 显式 key 排在前面，向量结果（若有）只作补充候选
+            cands = [(k, EXPLICIT_KEY_SCORE) for k in ks] + [(k, s) for k, s in (rows or []) if k not in ks]
+            metrics.RECO_PATH.labels(path="explicit_key").inc()
+            log_event("RECO", it["trace_id"], project=",".join(projects[i]), top1=ks[0], explicit=",".join(ks),
+                      searched=rows is not None)
+            results.append((ks[0], EXPLICIT_KEY_SCORE, cands))
+        elif rows:
+            top1, score = rows[0]
+            metrics.RECO_PATH.labels(path="vector").inc()
+            log_event("RECO", it["trace_id"], project=",".join(projects[i]), top1=top1, score=float(score), q=it["query_text"][:120])
+            results.append((top1, score, rows))
+        else:
+            metrics.RECO_PATH.labels(path="fallback").inc()
+            if i in all_rows:
+                MESSAGES.labels(outcome="fallback").inc()
+                log_event("RECO", it["trace_id"], project=",".join(projects[i]), top1=None, fallback="DEMO-1")
+            results.append(("DEMO-1", None, None))
+    return results
+
+def deliver(chx, delivery_tag, item, top1, score, candidates):
+    trace_id, repo, commit_hash = item["trace_id"], item["repo"], item["commit_hash"]
+    # 去重标记在发布成功之后才写：发布失败 / 中途崩溃时重投的消息照常出卡片
+    # === 低分抑制：低于 RECO_MIN_SCORE 则不发卡片 ===
+    try:
+        if isinstance(score, (int,float)) and score < RECO_MIN_SCORE:
+            MESSAGES.labels(outcome="dropped_low_score").inc()
+            log_event("RECO DROP", trace_id, top1=top1, score=float(score), min_score=RECO_MIN_SCORE)
+            chx.basic_ack(delivery_tag=delivery_tag)
+            DEDUP.mark_many([item["dedup_key"]])
+            return
+
+        # 渲染好的卡片交给发送阶段（ding_outbound），钉钉故障不再回头重跑推荐
+        out = {
+            "schema_version": "1.0",
+            "trace_id": trace_id,
+            "tenant_id": "tenant-demo",
+            "commit_hash": commit_hash,
+            "repo": repo,
+            "top1": top1,
+            "confidence": float(score) if isinstance(score, (int,float)) else 0.5,
+            "bot": DEFAULT_BOT,
+            "attempt": 0,
+            "card": render_action_card(trace_id, commit_hash, repo, top1, candidates=candidates, score=score),
+        }
+        mq.publish_json(chx, mq.QUEUE_DING, json.dumps(out).encode())
+        DEDUP.mark_many([item["dedup_key"]])
+        chx.basic_ack(delivery_tag=delivery_tag)
+        MESSAGES.labels(outcome="carded").inc()
+    except Exception as e:
+        MESSAGES.labels(outcome="error").inc()
+        log_event("ENQUEUE ERROR", trace_id, error=f"{type(e).__name__}: {e}", action="requeue")
+        chx.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+def group_push(items, recs):
+    """push 内的 commit 按 top1 分组：[(jira_key, best_score, [(item, score), ...]), ...]，commit 多的组在前。"""
+    groups = {}
+    for item, (top1, score, _) in zip(items, recs):
+        groups.setdefault(top1, []).append((item, score))
+    out = []
+    for key, members in groups.items():
+        scores = [s for _, s in members if isinstance(s, (int,float))]
+        out.append((key, max(scores) if scores else None, members))
+    out.sort(key=lambda g: (-len(g[2]), -(g[1] or 0.0)))
+    return out
+
+def deliver_push(chx, delivery_tag, push, items, recs):
+    """合并模式：整个 push 一张汇总卡片（同一 Jira 的 commit 归为一组），整条消息一次 ack。"""
+    trace_id = push["trace_id"]
+    keys, kept = [item["dedup_key"] for item in items], []
+    for item, rec in zip(items, recs):
+        # 与单条消息相同的低分抑制，只是逐个 commit 做；去重标记同样等整张卡片发布成功后再写
+        score = rec[1]
+        if isinstance(score, (int,float)) and score < RECO_MIN_SCORE:
+            MESSAGES.labels(outcome="dropped_low_score").inc()
+            log_event("RECO DROP", item["trace_id"], top1=rec[0], score=float(score), min_score=RECO_MIN_SCORE, push=trace_id)
+            continue
+        kept.append((item, rec))
+    if not kept:
+        chx.basic_ack(delivery_tag=delivery_tag)
+        DEDUP.mark_many(keys)
+        return
+    try:
+        groups = group_push([i for i, _ in kept], [r for _, r in kept])
+        top1, score, _ = groups[0]
+        out = {
+            "schema_version": "1.0",
+            "trace_id": trace_id,
+            "tenant_id": "tenant-demo",
+            "commit_hash": push["commit_hash"],
+            "repo": push["repo"],
+            "top1": top1,
+            "confidence": float(score) if isinstance(score, (int,float)) else 0.5,
+            "bot": DEFAULT_BOT,
+            "attempt": 0,
+            "card": render_push_card(trace_id, push["commit_hash"], push["repo"], [
+                (key, best, [(it["commit_hash"], it.get("subject", "")) for it, _ in members])
+                for key, best, members in groups]),
+            # sender 发卡片时写入 push_card_commits：大 push 的按钮不内联 commit，回调按 trace_id 查
+            "groups": [[key, [it["commit_hash"] for it, _ in members]] for key, _, members in groups],
+        }
+        mq.publish_json(chx, mq.QUEUE_DING, json.dumps(out).encode())
+        DEDUP.mark_many(keys)
+        chx.basic_ack(delivery_tag=delivery_tag)
+        MESSAGES.labels(outcome="carded").inc(len(kept))
+        metrics.PUSH_COMMITS.observe(len(kept))
+        log_event("PUSH CARD", trace_id, repo=push["repo"], commits=len(kept), groups=len(groups), top1=top1)
+    except Exception as e:
+        MESSAGES.labels(outcome="error").inc(len(kept))
+        log_event("ENQUEUE ERROR", trace_id, error=f"{type(e).__name__}: {e}", action="requeue", push=True)
+        chx.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+def process_batch(chx, batch):
+    """batch: [(delivery_tag, body), ...]；推荐整批做，ack/nack 逐条做。"""
+    metrics.BATCH_SIZE.observe(len(batch))
+    with timed(STAGE_SECONDS, stage="batch"):
+        _process_batch(chx, batch)
+
+def _process_batch(chx, batch):
+    # unit：一条 MQ 消息（单 commit，或合并模式下的整个 push），ack/nack 以它为单位
+    units = []
+    with timed(STAGE_SECONDS, stage="parse"):
+        for tag, body in batch:
+            try:
+                items, push = _parse_msg(body)
+                units.append((tag, items, push))
+            except Exception as e:
+                # 无法解析的消息重投也没用，直接丢弃
+                MESSAGES.labels(outcome="bad").inc()
+                log_event("BAD MESSAGE", error=f"{type(e).__name__}: {e}")
+                chx.basic_nack(delivery_tag=tag, requeue=False)
+
+    # 去重：已处理过的 commit（重投 / 多分支推送 / webhook 重试）以及本批内的重复，直接 ack
+    with timed(STAGE_SECONDS, stage="dedup"):
+        seen = iter(DEDUP.seen_many([it["dedup_key"] for _, items, _ in units for it in items]))
+    fresh_units, batch_keys = [], set()
+    for tag, items, push in units:
+        fresh = []
+        for item in items:
+            k = item["dedup_key"]
+            if next(seen) or (k and k in batch_keys):
+                DEDUP.suppressed()
+                MESSAGES.labels(outcome="duplicate").inc()
+                continue
+            if k:
+                batch_keys.add(k)
+            fresh.append(item)
+        if not fresh:
+            chx.basic_ack(delivery_tag=tag)
+            continue
+        fresh_units.append((tag, fresh, push))
+
+    # 整批（含 push 里的全部 commit）一次 embedding + 检索
+    try:
+        results = iter(recommend_batch([it for _, items, _ in fresh_units for it in items]))
+    except Exception as e:
+        # 兜底：整批重投，消费者继续跑
+        log_event("BATCH ERROR", error=f"{type(e).__name__}: {e}", units=len(fresh_units))
+        for tag, _, _ in fresh_units:
+            chx.basic_nack(delivery_tag=tag, requeue=True)
+        return
+    for tag, items, push in fresh_units:
+        recs = [next(results) for _ in items]
+        with timed(STAGE_SECONDS, stage="deliver"):
+            if push is None:
+                top1, score, candidates = recs[0]
+                deliver(chx, tag, items[0], top1, score, candidates)
             else:
-                print("[RECO] no candidate, fallback DEMO-1")
-        except Exception as e:
-            print("reco error:", e, "fallback DEMO-1")
+                deliver_push(chx, tag, push, items, recs)
 
-        # === 低分抑制：低于 RECO_MIN_SCORE 则不发卡片 ===
-        try:
-            if isinstance(score, (int,float)) and score < RECO_MIN_SCORE:
-                print(f"[RECO DROP] top1={top1} score={score:.4f} < {RECO_MIN_SCORE:.2f}, skip sending")
-                chx.basic_ack(delivery_tag=method.delivery_tag)
+class ConsumerWorker(mq.ConsumerThread):
+    """推荐消费者：攒批、处理、ack 都在本线程（连接线程）内完成。"""
+
+    def __init__(self, idx: int):
+        super().__init__(f"core-consumer-{idx}", reconnect_delay=RECONNECT_DELAY)
+        self.idx = idx
+        self._flush = lambda: None
+
+    def setup(self, conn, ch):
+        ch.queue_declare(queue=QUEUE_RAW, durable=True)
+        mq.declare_ding_queues(ch)
+        # 卡片转发到 ding_outbound 需 broker 确认后才 ack 原消息
+        ch.confirm_delivery()
+
+        # 攒批：凑够 BATCH_SIZE 条或等待 BATCH_WAIT_MS 后整批处理（定时器跑在连接线程上，ack 安全）
+        pending = []
+        timer = [None]
+
+        def _flush():
+            if timer[0] is not None:
+                conn.remove_timeout(timer[0])
+                timer[0] = None
+            if not pending:
                 return
+            batch = pending[:]
+            pending.clear()
+            process_batch(ch, batch)
 
-            res = send_action_card(trace_id, commit_hash, repo, top1, candidates=candidates, score=score)
-            confidence = float(score) if isinstance(score, (int,float)) else 0.5
-            with psycopg.connect(POSTGRES_DSN) as db:
-                db.execute(
-                    "INSERT INTO notifications(trace_id,tenant_id,commit_hash,recommended_jira_key,confidence,delivered_at) VALUES(%s,%s,%s,%s,%s,NOW())",
-                    (trace_id,"tenant-demo", commit_hash, top1, confidence)
-                )
-            chx.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception as e:
-            print("send ding error:", e)
-            chx.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        def _on_timer():
+            timer[0] = None
+            _flush()
 
-    ch.basic_qos(prefetch_count=10)
-    ch.basic_consume(queue=QUEUE_RAW, on_message_callback=_cb)
-    print(" [*] Core consuming. Ctrl+C to exit.")
-    try:
-        ch.start_consuming()
-    except KeyboardInterrupt:
-        ch.stop_consuming()
-    conn.close()
-
-# 启动消费线程
-import threading
-t = threading.Thread(target=consume, daemon=True)
-t.start()
+        def _cb(chx, method, props, body):
+            # webhook 发布时写入的时间戳：排队等待时间（消费滞后）
+            sent = (props.headers or {}).get("x-published-at")
+            if isinstance(sent, (int, float)):
+                metrics.CONSUMER_LAG.observe(max(0.0, time.time() - sent))
+            pending.append((method.delivery_tag, body))
+            if len(pending) >= BATCH_SIZE:
+                _flush()
+            elif timer[0] is None:
+                timer[0] = conn.call_later(BATCH_WAIT_MS / 1000.0, _on_timer)
+
+        self._flush = _flush
+        if self.idx == 0 and QUEUE_DEPTH_INTERVAL > 0:
+            self._sample_queues(conn)
+        ch.basic_qos(prefetch_count=max(PREFETCH_COUNT, BATCH_SIZE))
+        ch.basic_consume(queue=QUEUE_RAW, on_message_callback=_cb, consumer_tag=f"core-{os.getpid()}-{self.idx}")
+        print(f" [*] Core consumer {self.idx} consuming (batch={BATCH_SIZE} wait={BATCH_WAIT_MS}ms)", flush=True)
+
+    def drain(self):
+        self._flush()
+
+    def _sample_queues(self, conn):
+        # 单独的 channel：被动声明失败（队列不存在）只会关掉这个 channel
+        probe = conn.channel()
+
+        def _tick():
+            if not probe.is_open:
+                return
+            for q in (QUEUE_RAW, mq.QUEUE_DING, mq.QUEUE_DING_DLQ):
+                try:
+                    m = probe.queue_declare(queue=q, passive=True).method
+                except Exception as e:
+                    print(f"[METRICS] queue depth probe failed for {q}: {e}", flush=True)
+                    return
+                metrics.QUEUE_DEPTH.labels(queue=q).set(m.message_count)
+                metrics.QUEUE_CONSUMERS.labels(queue=q).set(m.consumer_count)
+            conn.call_later(QUEUE_DEPTH_INTERVAL, _tick)
+
+        _tick()
+
+def start_consumers(n: int):
+    workers = [ConsumerWorker(i) for i in range(n)]
+    for w in workers:
+        w.start()
+    return workers
@@ -0,0 +1,94 @@
+"""Prometheus 指标与按 trace_id 关联的结构化日志（core 服务及 jobs 共用）。
+
+- 服务进程：GET /metrics 暴露本模块注册的指标（单进程；uvicorn 多 worker 时每个 worker 各自一份）
+- jobs（jira_sync / embed_jira）：跑完调用 report_job()，配置了 PROMETHEUS_PUSHGATEWAY 时推到 Pushgateway
+- log_event()：LOG_FORMAT=text 时输出 "[TAG] trace_id=... k=v"，LOG_FORMAT=json 时每行一个 JSON 对象
+"""
+import os, json, time, datetime as dt
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, push_to_gateway)
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+PUSHGATEWAY = os.getenv("PROMETHEUS_PUSHGATEWAY", "")
+SERVICE = "core"
+
+# 秒；覆盖一次 SQL（毫秒级）到一次 embedding 超时（30s）
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram("contextual_core_stage_seconds",
+                          "Consumer processing time per stage (batch, parse, dedup, explicit_keys, embed, search, deliver)",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+MESSAGES = Counter("contextual_core_messages_total", "Commit messages handled by the core consumer, by outcome", ["outcome"])
+RECO_PATH = Counter("contextual_core_reco_path_total", "How each commit got its top-1 (explicit_key, vector, fallback)", ["path"])
+BATCH_SIZE = Histogram("contextual_core_batch_size", "Messages per consumer batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+PUSH_COMMITS = Histogram("contextual_core_push_commits", "Commits summarised per coalesced push card",
+                         buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+CONSUMER_LAG = Histogram("contextual_core_consumer_lag_seconds", "Time from webhook publish to consumer receive",
+                         buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900, 3600))
+QUEUE_DEPTH = Gauge("contextual_queue_depth", "Messages ready in a RabbitMQ queue (sampled)", ["queue"])
+QUEUE_CONSUMERS = Gauge("contextual_queue_consumers", "Consumers attached to a RabbitMQ queue (sampled)", ["queue"])
+EMBED_REQUEST = Histogram("contextual_embed_request_seconds", "Remote embedding request latency", buckets=LATENCY_BUCKETS)
+EMBED_INFLIGHT = Gauge("contextual_embed_inflight", "Embedding requests in flight (all priorities)")
+EMBED_ERRORS = Counter("contextual_embed_errors_total", "Failed embedding requests by HTTP status / exception, or circuit_open", ["kind"])
+EMBED_SPLITS = Counter("contextual_embed_splits_total", "Embedding requests split in half and retried (413, or timeout / 5xx at batch priority)")
+DING_SEND = Histogram("contextual_ding_send_seconds", "DingTalk robot POST latency", buckets=LATENCY_BUCKETS)
+DING_MESSAGES = Counter("contextual_ding_messages_total", "DingTalk outbound messages by outcome", ["outcome"])
+DING_THROTTLE = Counter("contextual_ding_throttle_seconds_total", "Time spent waiting on the per-bot token bucket")
+NOTIFY_INSERT = Histogram("contextual_ding_notification_insert_seconds", "notifications INSERT latency after a send",
+                          buckets=LATENCY_BUCKETS)
+JIRA_EVENTS = Counter("contextual_jira_events_total", "Jira webhook events handled by core, by event and outcome",
+                      ["event", "outcome"])
+JIRA_EVENT_SECONDS = Histogram("contextual_jira_event_seconds", "Jira event handling time per stage (upsert, embed)",
+                               ["stage"], buckets=LATENCY_BUCKETS)
+
+@contextmanager
+def timed(hist, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        (hist.labels(**labels) if labels else hist).observe(time.perf_counter() - t0)
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def log_event(tag: str, trace_id: str = None, **fields):
+    if LOG_FORMAT == "json":
+        rec = {"ts": dt.datetime.now(dt.timezone.utc).isoformat(timespec="milliseconds"), "svc": SERVICE,
+               "event": tag.lower()}
+        if trace_id is not None:
+            rec["trace_id"] = trace_id
+        rec.update(fields)
+        print(json.dumps(rec, ensure_ascii=False, default=str), flush=True)
+        return
+    parts = [f"[{tag}]"]
+    if trace_id is not None:
+        parts.append(f"trace_id={trace_id}")
+    for k, v in fields.items():
+        if isinstance(v, float):
+            v = f"{v:.4f}"
+        elif isinstance(v, str) and (" " in v or not v):
+            v = repr(v)
+        parts.append(f"{k}={v}")
+    print(" ".join(parts), flush=True)
+
+def report_job(job: str, project: str, items: int, seconds: float, **extra):
+    """批处理任务结束时的吞吐指标；未配置 Pushgateway 时什么都不做（日志里已有同样的数字）。"""
+    if not PUSHGATEWAY:
+        return
+    reg = CollectorRegistry()
+    labels = {"project": project}
+    Gauge("contextual_job_last_run_items", "Items processed in the last run", ["project"], registry=reg).labels(**labels).set(items)
+    Gauge("contextual_job_last_run_seconds", "Wall time of the last run", ["project"], registry=reg).labels(**labels).set(seconds)
+    Gauge("contextual_job_last_run_items_per_second", "Throughput of the last run", ["project"], registry=reg) \
+        .labels(**labels).set(items / seconds if seconds > 0 else 0.0)
+    Gauge("contextual_job_last_success_timestamp_seconds", "Unix time the last run finished", ["project"], registry=reg) \
+        .labels(**labels).set(time.time())
+    for k, v in extra.items():
+        Gauge(f"contextual_job_last_run_{k}", k, ["project"], registry=reg).labels(**labels).set(v)
+    try:
+        push_to_gateway(PUSHGATEWAY, job=job, registry=reg, timeout=5)
+    except Exception as e:
+        print(f"[METRICS] push to {PUSHGATEWAY} failed: {type(e).__name__}: {e}", flush=True)
@@ -0,0 +1,110 @@
+"""RabbitMQ 连接参数、队列拓扑与消费线程基类（core 内共享）。"""
+import os, time, threading
+import pika
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST","rabbitmq")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER","guest")
+RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD","guest")
+
+QUEUE_RAW = "git_commit_raw"
+# webhook 转发的 Jira issue 事件（created / updated / deleted）
+QUEUE_JIRA = "jira_issue_events"
+
+# 钉钉发送：主队列 -> 失败按延迟档位进重试队列（TTL 到期死信回主队列） -> 超过次数进 DLQ
+QUEUE_DING = "ding_outbound"
+QUEUE_DING_DLQ = "ding_outbound.dlq"
+DING_RETRY_DELAYS = [int(x) for x in os.getenv("DING_RETRY_DELAYS", "5,30,120,600").split(",") if x.strip()]
+
+def params():
+    creds = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+    return pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=creds, heartbeat=60)
+
+def retry_queue(delay_s: int) -> str:
+    return f"{QUEUE_DING}.retry.{delay_s}s"
+
+def declare_ding_queues(ch):
+    ch.queue_declare(queue=QUEUE_DING, durable=True)
+    ch.queue_declare(queue=QUEUE_DING_DLQ, durable=True)
+    for d in DING_RETRY_DELAYS:
+        ch.queue_declare(queue=retry_queue(d), durable=True, arguments={
+            "x-message-ttl": d * 1000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": QUEUE_DING,
+        })
+
+def publish_json(ch, queue: str, body: bytes, headers=None):
+    ch.basic_publish(
+        exchange="", routing_key=queue, body=body,
+        properties=pika.BasicProperties(delivery_mode=2, content_type="application/json", headers=headers),
+    )
+
+class ConsumerThread(threading.Thread):
+    """后台消费线程基类：一条独立连接 + 一个 channel，所有 ack 都在本线程完成。
+
+    子类实现 setup(conn, ch) 注册 basic_consume；drain() 在停止消费后、关连接前调用，
+    用于把已收进本地的消息处理完。断线后按 reconnect_delay 重连。
+    stop() 线程安全：通过 add_callback_threadsafe 让连接线程自己 stop_consuming；
+    已预取但未 ack 的消息随 channel 关闭由 broker 重新入队。
+    """
+
+    def __init__(self, name: str, reconnect_delay: float = 5.0):
+        super().__init__(name=name, daemon=True)
+        self.reconnect_delay = reconnect_delay
+        self._stopping = threading.Event()
+        self._conn = None
+        self._ch = None
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def setup(self, conn, ch):
+        raise NotImplementedError
+
+    def drain(self):
+        pass
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self._session()
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                print(f"[{self.name}] connection lost: {type(e).__name__}: {e}, reconnect in {self.reconnect_delay}s", flush=True)
+                self._stopping.wait(self.reconnect_delay)
+        print(f"[{self.name}] stopped", flush=True)
+
+    def _session(self):
+        conn = pika.BlockingConnection(params())
+        ch = conn.channel()
+        self._conn, self._ch = conn, ch
+        try:
+            self.setup(conn, ch)
+            if not self._stopping.is_set():
+                ch.start_consuming()
+            # 优雅退出：已收进本地缓冲的消息处理完并 ack
+            self.drain()
+        finally:
+            self._conn, self._ch = None, None
+            if conn.is_open:
+                conn.close()
+
+    def stop(self):
+        self._stopping.set()
+        conn, ch = self._conn, self._ch
+        if conn is not None and ch is not None:
+            try:
+                conn.add_callback_threadsafe(ch.stop_consuming)
+            except pika.exceptions.AMQPError:
+                pass
+
+def drain_threads(threads, timeout: float):
+    for t in threads:
+        t.stop()
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    alive = [t.name for t in threads if t.is_alive()]
+    if alive:
+        print(f"[DRAIN] timeout after {timeout}s, still running: {alive} (unacked messages will be requeued)", flush=True)
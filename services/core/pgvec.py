@@ -0,0 +1,97 @@
+"""pgvector 二进制传输。
+
+向量统一用 float32 ndarray 表示，经 pgvector 的 psycopg 适配器以二进制格式收发
+（SQL 里用 %b 占位），取代 "[0.1,0.2,...]" 文本字面量：
+每维 4 字节而不是约 20 字节的十进制串，两端也省掉格式化/解析。
+"""
+import os
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from pgvector.psycopg import register_vector
+
+# ANN 检索的召回 / 延迟旋钮（会话级，连接建立时设置；留空 = 用 pgvector 默认值）
+# hnsw.ef_search：候选列表大小，越大召回越高越慢（pgvector 默认 40，需 >= top-k）
+# ivfflat.probes：扫描的聚类数（默认 1，一般取 sqrt(lists) 左右）
+HNSW_EF_SEARCH = os.getenv("PG_HNSW_EF_SEARCH", "")
+IVFFLAT_PROBES = os.getenv("PG_IVFFLAT_PROBES", "")
+
+# ANN 首轮检索用量化表达式索引（需要 pgvector >= 0.7，migration 013 / reindex_vectors.py --quant 建索引）：
+# 留空 = float32 原值；halfvec = 半精度；binary = 每维 1 bit（汉明距离）
+# 量化时先取 PG_RERANK_CANDIDATES 个候选，再按表里的 float32 原值精确重排，返回的 score 不受量化影响
+VECTOR_QUANT = os.getenv("PG_VECTOR_QUANT", "").strip().lower()
+RERANK_CANDIDATES = int(os.getenv("PG_RERANK_CANDIDATES", "200"))
+EMBED_DIM = int(os.getenv("EMBED_DIM", "1024"))
+QUANTS = ("", "halfvec", "binary")
+if VECTOR_QUANT not in QUANTS:
+    raise ValueError(f"PG_VECTOR_QUANT must be one of halfvec, binary or empty, got {VECTOR_QUANT!r}")
+
+def index_expr(quant: str = VECTOR_QUANT, dim: int = EMBED_DIM) -> str:
+    """CREATE INDEX 里的列 / 表达式 + 操作符类；查询的排序表达式必须与之一致才能走索引。"""
+    if quant == "halfvec":
+        return f"(embedding::halfvec({dim})) halfvec_cosine_ops"
+    if quant == "binary":
+        return f"(binary_quantize(embedding)::bit({dim})) bit_hamming_ops"
+    return "embedding vector_cosine_ops"
+
+def ann_order(q: str, quant: str = VECTOR_QUANT, dim: int = EMBED_DIM) -> str:
+    """首轮 ANN 的 ORDER BY 表达式；q 为查询向量（vector）的 SQL 片段。"""
+    if quant == "halfvec":
+        return f"embedding::halfvec({dim}) <=> {q}::halfvec({dim})"
+    if quant == "binary":
+        return f"binary_quantize(embedding)::bit({dim}) <~> binary_quantize({q})"
+    return f"embedding <=> {q}"
+
+def rerank_settings(cur, candidates: int = RERANK_CANDIDATES):
+    """量化检索时本事务的 hnsw.ef_search 至少等于候选数（HNSW 一次最多返回 ef_search 行，上限 1000）。"""
+    cur.execute("""
+        SELECT set_config('hnsw.ef_search',
+                          least(greatest(current_setting('hnsw.ef_search', true)::int, %s), 1000)::text, true)
+    """, (int(candidates),))
+
+def to_f32(vec) -> np.ndarray:
+    return np.asarray(vec, dtype=np.float32)
+
+def search_settings(conn, ef_search=None, probes=None):
+    """设置本会话的 hnsw.ef_search / ivfflat.probes；参数为空时取环境变量。"""
+    ef_search = ef_search or HNSW_EF_SEARCH
+    probes = probes or IVFFLAT_PROBES
+    if ef_search:
+        conn.execute("SELECT set_config('hnsw.ef_search', %s, false)", (str(int(ef_search)),))
+    if probes:
+        conn.execute("SELECT set_config('ivfflat.probes', %s, false)", (str(int(probes)),))
+
+def configure(conn):
+    """注册 vector 类型适配器并应用检索参数；可直接作为连接池的 configure 回调。"""
+    register_vector(conn)
+    search_settings(conn)
+    if not conn.autocommit:
+        # TypeInfo 查询会开启事务，归还连接池前需结束
+        conn.commit()
+
+def from_db(v) -> np.ndarray:
+    # 适配器加载出来的是 pgvector.Vector；未注册时是文本
+    if v is None:
+        return None
+    if hasattr(v, "to_numpy"):
+        return v.to_numpy().astype(np.float32, copy=False)
+    if isinstance(v, str):
+        return np.array([float(x) for x in v.strip("[]").split(",") if x], dtype=np.float32)
+    return to_f32(v)
+
+def copy_vectors(cur, table: str, ids: Sequence[int], vecs: Iterable, hashes: Optional[Sequence[bytes]] = None):
+    """二进制 COPY (id, embedding) 到 table（一般是临时暂存表）；给了 hashes 时同时写 text_hash 列。"""
+    if hashes is None:
+        with cur.copy(f"COPY {table} (id, embedding) FROM STDIN WITH (FORMAT BINARY)") as cp:
+            cp.set_types(["int8", "vector"])
+            for _id, v in zip(ids, vecs):
+                cp.write_row((_id, to_f32(v)))
+        return
+    with cur.copy(f"COPY {table} (id, embedding, text_hash) FROM STDIN WITH (FORMAT BINARY)") as cp:
+        cp.set_types(["int8", "vector", "bytea"])
+        for _id, v, h in zip(ids, vecs, hashes):
+            cp.write_row((_id, to_f32(v), h))
+
+def text_literal(vec) -> str:
+    # 仅用于对比压测 / 调试
+    return "[" + ",".join(str(float(x)) for x in vec) + "]"
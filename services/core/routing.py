@@ -0,0 +1,172 @@
+"""repo -> Jira 项目路由，以及每个项目的向量检索方式。
+
+- repo_projects（migration 012）：一个仓库可对应多个项目，按 "owner/name" -> "owner/*" -> "*" 依次匹配；
+  都没有（或表不存在）时走 JIRA_PROJECT_KEY
+- 检索方式按项目决定，与路由一起每 ROUTING_REFRESH_S 秒从库里重载：
+  partial：该项目有自己的部分 ANN 索引（reindex_vectors.py --per-project），SQL 里 project_key 写成字面量，
+           预编译的通用计划也能证明命中索引谓词
+  exact：向量行数 <= EXACT_SEARCH_MAX_ROWS，关掉 index scan 按 project_key 取出全部行精确排序；
+         小项目在全表 ANN 索引上先扫后滤，经常凑不满 k 条
+  global：其余情况照旧走全表 ANN 索引
+"""
+import os, re, time, threading
+from typing import Dict, List
+
+from psycopg import sql
+
+import pgvec
+
+ROUTING_REFRESH_S = float(os.getenv("ROUTING_REFRESH_S", "300"))
+EXACT_SEARCH_MAX_ROWS = int(os.getenv("EXACT_SEARCH_MAX_ROWS", "5000"))
+
+MODES = ("partial", "exact", "global")
+
+_PRED_RE = re.compile(r"project_key\s*=\s*'((?:[^']|'')+)'")
+
+def index_quant(indexdef: str) -> str:
+    if "binary_quantize(" in indexdef:
+        return "binary"
+    return "halfvec" if "halfvec" in indexdef else ""
+
+def partial_indexes(conn, quant: str = None) -> Dict[str, List[str]]:
+    """jira_issues.embedding 上按 project_key 建的有效部分 ANN 索引：{project: [index name, ...]}。
+    给了 quant 时只算该量化方式的索引（查询表达式对不上的索引用不到）。"""
+    out = {}
+    for name, pred, indexdef in conn.execute("""
+        SELECT i.relname, pg_get_expr(x.indpred, x.indrelid), pg_get_indexdef(x.indexrelid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_am am ON am.oid = i.relam
+        WHERE x.indrelid = 'jira_issues'::regclass AND am.amname IN ('hnsw','ivfflat')
+          AND pg_get_indexdef(x.indexrelid) ~ '\\membedding\\M'
+          AND x.indpred IS NOT NULL AND x.indisvalid
+    """):
+        m = _PRED_RE.search(pred or "")
+        if m and (quant is None or index_quant(indexdef) == quant):
+            out.setdefault(m.group(1).replace("''", "'"), []).append(name)
+    return out
+
+def project_modes(conn, exact_max_rows: int = EXACT_SEARCH_MAX_ROWS, quant: str = pgvec.VECTOR_QUANT) -> Dict[str, str]:
+    partial = partial_indexes(conn, quant)
+    modes = {}
+    for project, n in conn.execute(
+            "SELECT project_key, count(*) FROM jira_issues WHERE embedding IS NOT NULL GROUP BY project_key"):
+        if project in partial:
+            modes[project] = "partial"
+        else:
+            modes[project] = "exact" if n <= exact_max_rows else "global"
+    return modes
+
+def topk_batch_query(mode: str, project: str, quant: str = pgvec.VECTOR_QUANT) -> sql.Composed:
+    """LATERAL 批量 Top-K；partial 时 project_key 内联为字面量，其余用参数 %(project)s。
+
+    quant 非空（exact 除外）时首轮按量化表达式取 %(cand)s 个候选，外层再按 float32 原值重排。
+    """
+    proj = sql.Literal(project) if mode == "partial" else sql.Placeholder("project")
+    if not quant or mode == "exact":
+        return sql.SQL("""
+        SELECT q.ord, r.jira_key, r.score
+        FROM unnest(%(vecs)b::vector[]) WITH ORDINALITY AS q(vec, ord)
+        CROSS JOIN LATERAL (
+            SELECT jira_key, (1 - (embedding <=> q.vec)) AS score
+            FROM jira_issues
+            WHERE project_key={proj} AND embedding IS NOT NULL
+            ORDER BY embedding <=> q.vec ASC
+            LIMIT %(k)s
+        ) r
+        ORDER BY q.ord, r.score DESC
+    """).format(proj=proj)
+    return sql.SQL("""
+        SELECT q.ord, r.jira_key, r.score
+        FROM unnest(%(vecs)b::vector[]) WITH ORDINALITY AS q(vec, ord)
+        CROSS JOIN LATERAL (
+            SELECT jira_key, (1 - (embedding <=> q.vec)) AS score
+            FROM (
+                SELECT jira_key, embedding
+                FROM jira_issues
+                WHERE project_key={proj} AND embedding IS NOT NULL
+                ORDER BY {ann} ASC
+                LIMIT %(cand)s
+            ) c
+            ORDER BY embedding <=> q.vec ASC
+            LIMIT %(k)s
+        ) r
+        ORDER BY q.ord, r.score DESC
+    """).format(proj=proj, ann=sql.SQL(pgvec.ann_order("q.vec", quant)))
+
+def apply_mode(cur, mode: str, quant: str = pgvec.VECTOR_QUANT):
+    """exact：本事务内不用 index scan（ANN 索引也是 index scan），按 project_key 位图扫描后精确排序。
+    量化检索：本事务的 hnsw.ef_search 放大到候选数。"""
+    if mode == "exact":
+        cur.execute("SET LOCAL enable_indexscan = off")
+    elif quant:
+        pgvec.rerank_settings(cur)
+
+class Router:
+    def __init__(self, pool, default_project: str, refresh_s: float = ROUTING_REFRESH_S):
+        self.pool = pool
+        self.default = [default_project]
+        self.refresh_s = refresh_s
+        # 整体替换、不原地修改：读线程不加锁
+        self._routes = {}
+        self._modes = None
+        self._loaded_at = None
+        self._reload = threading.Lock()
+        self.stats = {"routes": 0, "reloads": 0, "errors": 0, "routed": 0, "default": 0}
+
+    def _maybe_reload(self):
+        stale = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_s
+        # 重载期间其它消费线程继续用旧映射；首次加载时等它完成
+        if not stale or not self._reload.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_s:
+                return
+            self._load()
+        finally:
+            # 出错也记时间，按周期重试，不在每批消息上重查
+            self._loaded_at = time.monotonic()
+            self._reload.release()
+
+    def _load(self):
+        routes = {}
+        try:
+            with self.pool.connection() as db:
+                for repo, project in db.execute("SELECT repo, project_key FROM repo_projects ORDER BY repo, project_key"):
+                    routes.setdefault(repo, []).append(project)
+            self._routes = routes
+            self.stats["routes"] = len(routes)
+        except Exception as e:
+            # 多半是还没跑 012：全部走默认项目
+            self.stats["errors"] += 1
+            print(f"[ROUTING] load repo_projects failed: {type(e).__name__}: {e}", flush=True)
+        try:
+            with self.pool.connection() as db:
+                self._modes = project_modes(db)
+            self.stats["reloads"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[ROUTING] load search modes failed: {type(e).__name__}: {e}", flush=True)
+
+    def projects_for(self, repo: str) -> List[str]:
+        self._maybe_reload()
+        routes = self._routes
+        owner = (repo or "").split("/", 1)[0]
+        projects = routes.get(repo) or routes.get(f"{owner}/*") or routes.get("*")
+        if projects:
+            self.stats["routed"] += 1
+            return projects
+        self.stats["default"] += 1
+        return self.default
+
+    def mode(self, project: str) -> str:
+        modes = self._modes
+        if modes is None:
+            # 还没加载成功：保持旧行为
+            return "global"
+        # 没有向量的项目精确检索也只是一次空的位图扫描
+        return modes.get(project, "exact")
+
+    def snapshot(self) -> dict:
+        modes = self._modes or {}
+        return dict(self.stats, modes={m: sum(1 for v in modes.values() if v == m) for m in MODES})
@@ -0,0 +1,160 @@
+"""钉钉发送阶段：消费 ding_outbound，按机器人限流发送，失败延迟重试，超过次数进 DLQ。
+
+推荐阶段（core consumer）只负责把渲染好的卡片放进队列，钉钉故障不会再回头重跑
+embedding / 向量检索。
+
+默认随 core 进程启动（DING_SENDER_ENABLED=1）；令牌桶是进程内的，多实例部署时
+只在一个实例上开启，或单独运行：
+  python sender.py              # 独立发送进程
+  python sender.py --redrive    # 把 DLQ 里的消息重置次数后放回 ding_outbound
+"""
+import os, sys, json, signal, threading
+import pika
+
+import mq
+import metrics
+from dingtalk import DEFAULT_BOT, TokenBucket, post_card
+from metrics import log_event, timed
+
+DING_MAX_ATTEMPTS = int(os.getenv("DING_MAX_ATTEMPTS", "6"))
+
+class DingSender(mq.ConsumerThread):
+    def __init__(self, pool, reconnect_delay: float = 5.0):
+        super().__init__("ding-sender", reconnect_delay=reconnect_delay)
+        self.pool = pool
+        self._buckets = {}
+        self.stats = {"sent": 0, "retried": 0, "dead_lettered": 0, "throttled_s": 0.0}
+
+    def _bucket(self, bot: str) -> TokenBucket:
+        b = self._buckets.get(bot)
+        if b is None:
+            b = self._buckets[bot] = TokenBucket()
+        return b
+
+    def setup(self, conn, ch):
+        mq.declare_ding_queues(ch)
+        # 重试 / DLQ 的转发要等 broker 确认后才 ack 原消息
+        ch.confirm_delivery()
+        ch.basic_qos(prefetch_count=1)
+
+        def _cb(chx, method, props, body):
+            self._handle(conn, chx, method.delivery_tag, body)
+
+        ch.basic_consume(queue=mq.QUEUE_DING, on_message_callback=_cb, consumer_tag=f"ding-sender-{os.getpid()}")
+        print(f" [*] DingTalk sender consuming {mq.QUEUE_DING} (max_attempts={DING_MAX_ATTEMPTS} delays={mq.DING_RETRY_DELAYS})", flush=True)
+
+    def _handle(self, conn, ch, tag, body):
+        try:
+            msg = json.loads(body)
+            card = msg["card"]
+        except Exception as e:
+            log_event("DING BAD MESSAGE", error=f"{type(e).__name__}: {e}")
+            mq.publish_json(ch, mq.QUEUE_DING_DLQ, body, headers={"error": str(e)[:200]})
+            metrics.DING_MESSAGES.labels(outcome="bad").inc()
+            ch.basic_ack(delivery_tag=tag)
+            return
+
+        bot = msg.get("bot") or DEFAULT_BOT
+        wait = self._bucket(bot).reserve()
+        if wait > 0:
+            # conn.sleep 期间仍处理心跳，不会在回调里重入分发
+            self.stats["throttled_s"] += wait
+            metrics.DING_THROTTLE.inc(wait)
+            conn.sleep(wait)
+
+        try:
+            with timed(metrics.DING_SEND):
+                post_card(card, bot, trace_id=msg.get("trace_id"))
+        except Exception as e:
+            self._retry_or_dead_letter(ch, msg, e)
+            ch.basic_ack(delivery_tag=tag)
+            return
+
+        self.stats["sent"] += 1
+        metrics.DING_MESSAGES.labels(outcome="sent").inc()
+        self._record_notification(msg)
+        ch.basic_ack(delivery_tag=tag)
+
+    def _retry_or_dead_letter(self, ch, msg, err):
+        attempt = int(msg.get("attempt", 0)) + 1
+        msg["attempt"] = attempt
+        msg["last_error"] = f"{type(err).__name__}: {err}"[:500]
+        body = json.dumps(msg).encode()
+        if attempt >= DING_MAX_ATTEMPTS or not mq.DING_RETRY_DELAYS:
+            log_event("DING DLQ", msg.get("trace_id"), attempts=attempt, error=msg["last_error"])
+            mq.publish_json(ch, mq.QUEUE_DING_DLQ, body)
+            self.stats["dead_lettered"] += 1
+            metrics.DING_MESSAGES.labels(outcome="dead_lettered").inc()
+            return
+        delay = mq.DING_RETRY_DELAYS[min(attempt - 1, len(mq.DING_RETRY_DELAYS) - 1)]
+        log_event("DING RETRY", msg.get("trace_id"), attempt=attempt, delay_s=delay, error=msg["last_error"])
+        mq.publish_json(ch, mq.retry_queue(delay), body)
+        self.stats["retried"] += 1
+        metrics.DING_MESSAGES.labels(outcome="retried").inc()
+
+    def _record_notification(self, msg):
+        # 卡片已发出：入库失败只告警，不能再重发（否则群里出现重复卡片）
+        try:
+            with timed(metrics.NOTIFY_INSERT), self.pool.connection() as db:
+                db.execute(
+                    "INSERT INTO notifications(trace_id,tenant_id,commit_hash,recommended_jira_key,confidence,delivered_at) VALUES(%s,%s,%s,%s,%s,NOW())",
+                    (msg.get("trace_id",""), msg.get("tenant_id","tenant-demo"), msg.get("commit_hash",""), msg.get("top1"), msg.get("confidence")),
+                    prepare=True,
+                )
+                if msg.get("groups"):
+                    # push 汇总卡片：每个 commit 及它所在组的 top-1，一条语句写完
+                    pairs = [(h, key) for key, hashes in msg["groups"] for h in hashes]
+                    db.execute("""
+                        INSERT INTO push_card_commits(trace_id, commit_hash, recommended_jira_key)
+                        SELECT %s, c, k FROM unnest(%s::text[], %s::text[]) AS t(c, k)
+                        ON CONFLICT (trace_id, commit_hash) DO NOTHING
+                    """, (msg.get("trace_id",""), [h for h, _ in pairs], [k for _, k in pairs]), prepare=True)
+        except Exception as e:
+            log_event("DING NOTIFY INSERT FAILED", msg.get("trace_id"), error=f"{type(e).__name__}: {e}")
+
+def redrive_dlq(limit: int = 0) -> int:
+    conn = pika.BlockingConnection(mq.params())
+    ch = conn.channel()
+    mq.declare_ding_queues(ch)
+    ch.confirm_delivery()
+    n = 0
+    while not limit or n < limit:
+        method, props, body = ch.basic_get(queue=mq.QUEUE_DING_DLQ)
+        if method is None:
+            break
+        try:
+            msg = json.loads(body)
+            msg["attempt"] = 0
+            body = json.dumps(msg).encode()
+        except Exception:
+            pass
+        mq.publish_json(ch, mq.QUEUE_DING, body)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        n += 1
+    conn.close()
+    return n
+
+def _argv():
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--redrive", action="store_true", help="move DLQ messages back to ding_outbound")
+    ap.add_argument("--limit", type=int, default=0, help="max messages to redrive (0 = all)")
+    return ap.parse_args()
+
+if __name__ == "__main__":
+    args = _argv()
+    if args.redrive:
+        print(f"[REDRIVE] moved={redrive_dlq(args.limit)}")
+        sys.exit(0)
+
+    from db import make_pool
+    pool = make_pool("ding-sender")
+    pool.open()
+    sender = DingSender(pool)
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    signal.signal(signal.SIGINT, lambda *_: done.set())
+    sender.start()
+    done.wait()
+    mq.drain_threads([sender], float(os.getenv("CORE_DRAIN_TIMEOUT", "30")))
+    pool.close()
@@ -0,0 +1,321 @@
+"""进程内向量索引：单个项目的 embedding 矩阵常驻内存，Top-K 用矩阵乘 + argpartition。
+
+- 启动时从 Postgres 全量加载（行已归一化，点积即 cosine 相似度，与 1 - (a <=> b) 一致）；
+  配置了 VECTOR_INDEX_SNAPSHOT_DIR 时优先 mmap 快照文件，冷启动不用再拉全表
+- 后台线程 LISTEN jira_embeddings（embed_jira 每批提交后 NOTIFY），
+  收到通知或每 VECTOR_INDEX_REFRESH_S 秒按 embedded_at 水位增量拉取新写入的向量
+- LISTEN jira_issue_deleted（Jira webhook 删除 issue 时 NOTIFY，payload 为 jira_key），对应行立即移除
+- LISTEN jira_issue_moved（014 迁移的触发器在 project_key 变化时 NOTIFY，payload 为 {"key", "from"}），
+  从旧项目的索引移除；触发器同时刷新 embedded_at，新项目的索引按水位拉到它
+- 追加写在预留容量里，写完再切换可见行数；被重新 embedding 的行原地覆盖
+- 检索的矩阵乘和写入共用一把锁：remove 会把最后一行挪进空位，不加锁的检索会把挪来的向量记到旧 key 上
+- 未就绪 / 出错时调用方回退到 Postgres 检索
+"""
+import os, json, time, threading, datetime as dt
+from typing import List, Optional
+
+import numpy as np
+import psycopg
+
+import pgvec
+
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")       # float16 内存减半，检索时分块转 float32
+VECTOR_INDEX_SNAPSHOT_DIR = os.getenv("VECTOR_INDEX_SNAPSHOT_DIR", "")
+VECTOR_INDEX_REFRESH_S = float(os.getenv("VECTOR_INDEX_REFRESH_S", "30"))
+VECTOR_INDEX_OVERLAP_S = float(os.getenv("VECTOR_INDEX_OVERLAP_S", "60"))  # 增量查询回看窗口，兜住晚提交的事务
+
+NOTIFY_CHANNEL = "jira_embeddings"
+DELETE_CHANNEL = "jira_issue_deleted"
+MOVE_CHANNEL = "jira_issue_moved"
+_F16_CHUNK = 16384
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(m, axis=-1, keepdims=True)
+    n[n == 0] = 1.0
+    return m / n
+
+class VectorIndex:
+    def __init__(self, project_key: str, dsn: str, model: str, dtype: str = VECTOR_INDEX_DTYPE,
+                 snapshot_dir: str = VECTOR_INDEX_SNAPSHOT_DIR, refresh_s: float = VECTOR_INDEX_REFRESH_S):
+        self.project_key = project_key
+        self.dsn = dsn
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        self.snapshot_dir = snapshot_dir
+        self.refresh_s = refresh_s
+
+        self._mat = None          # (capacity, dim)，前 _n 行可见
+        self._n = 0
+        self._keys: List[str] = []
+        self._row = {}            # jira_key -> 行号
+        self._ts = {}             # jira_key -> 增量拉到的 embedded_at，回看窗口里重复出现的行跳过
+        self._watermark = None    # 已加载的最大 embedded_at
+        self._write = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dirty = False
+        self.ready = False
+        self.stats = {"rows": 0, "loaded_from": None, "load_s": 0.0, "refreshes": 0, "refreshed_rows": 0,
+                      "removed": 0, "searches": 0, "errors": 0}
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vector-index", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        if self.ready and self._dirty:
+            self._save_snapshot()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.ready:
+                    self._load()
+                # 断线后只重连 LISTEN，按水位补齐增量，不重新全量加载
+                self._listen_loop()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[VINDEX] error: {type(e).__name__}: {e}, retry in {self.refresh_s}s", flush=True)
+                self._stop.wait(self.refresh_s)
+
+    def _load(self):
+        t0 = time.perf_counter()
+        src = "snapshot" if self._load_snapshot() else "postgres"
+        if src == "postgres":
+            self._load_full()
+            self._save_snapshot()
+        self.stats.update(loaded_from=src, load_s=round(time.perf_counter() - t0, 3), rows=self._n)
+        self.ready = True
+        print(f"[VINDEX] project={self.project_key} rows={self._n} from={src} in {self.stats['load_s']}s", flush=True)
+
+    def _connect(self, autocommit: bool = False):
+        conn = psycopg.connect(self.dsn, autocommit=autocommit)
+        pgvec.configure(conn)
+        return conn
+
+    # ---------- 加载 ----------
+    def _paths(self):
+        base = os.path.join(self.snapshot_dir, f"vindex-{self.project_key}")
+        return base + ".npy", base + ".json"
+
+    def _load_snapshot(self) -> bool:
+        if not self.snapshot_dir or self._mat is not None:
+            return False
+        npy, meta_path = self._paths()
+        if not (os.path.exists(npy) and os.path.exists(meta_path)):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("model") != self.model or meta.get("dtype") != self.dtype.name:
+            print(f"[VINDEX] snapshot model/dtype mismatch ({meta.get('model')}/{meta.get('dtype')}), reload from postgres", flush=True)
+            return False
+        # 只读 mmap：页按需读入；第一次增量写入时才复制成可写数组
+        mat = np.load(npy, mmap_mode="r")
+        keys = meta["keys"]
+        if mat.shape[0] != len(keys):
+            return False
+        wm = meta.get("watermark")
+        self._install(mat, keys, dt.datetime.fromisoformat(wm) if wm else None)
+        return True
+
+    def _load_full(self):
+        vecs, keys, wm = [], [], None
+        with self._connect() as conn, conn.cursor(name="vindex_load") as cur:
+            cur.itersize = 5000
+            cur.execute("""
+                SELECT jira_key, embedding, embedded_at
+                FROM jira_issues
+                WHERE project_key=%s AND embedding IS NOT NULL
+                ORDER BY id
+            """, (self.project_key,), binary=True)
+            for key, emb, ts in cur:
+                keys.append(key)
+                vecs.append(pgvec.from_db(emb))
+                if ts is not None and (wm is None or ts > wm):
+                    wm = ts
+        mat = _normalize(np.vstack(vecs)).astype(self.dtype) if vecs else None
+        self._install(mat, keys, wm)
+
+    def _install(self, mat, keys, watermark):
+        with self._write:
+            self._mat = mat
+            self._keys = list(keys)
+            self._row = {k: i for i, k in enumerate(self._keys)}
+            self._n = len(self._keys)
+            self._watermark = watermark
+
+    def _save_snapshot(self):
+        if not self.snapshot_dir or self._mat is None:
+            return
+        npy, meta_path = self._paths()
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with self._write:
+            n, mat, keys, wm = self._n, self._mat, self._keys[:self._n], self._watermark
+            # 先写临时文件再 rename，避免进程中途退出留下半个快照
+            with open(npy + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(mat[:n]))
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump({"model": self.model, "dtype": self.dtype.name,
+                           "watermark": wm.isoformat() if wm else None, "keys": keys}, f)
+            os.replace(npy + ".tmp", npy)
+            os.replace(meta_path + ".tmp", meta_path)
+            self._dirty = False
+        print(f"[VINDEX] snapshot saved rows={n} -> {npy}", flush=True)
+
+    # ---------- 增量刷新 ----------
+    def _listen_loop(self):
+        with self._connect(autocommit=True) as conn:
+            conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            conn.execute(f"LISTEN {DELETE_CHANNEL}")
+            conn.execute(f"LISTEN {MOVE_CHANNEL}")
+            self.refresh(conn)
+            while not self._stop.is_set():
+                # 有通知立即刷新，否则每 refresh_s 秒轮询一次（通知丢失 / 其它写入路径兜底）
+                # 按 1 秒切片等待，停止时不用等满一个周期
+                deadline, notified = time.monotonic() + self.refresh_s, False
+                while not (notified or self._stop.is_set() or time.monotonic() >= deadline):
+                    for n in conn.notifies(timeout=1.0, stop_after=1):
+                        if n.channel == DELETE_CHANNEL:
+                            self.remove(n.payload)
+                        elif n.channel == MOVE_CHANNEL:
+                            self._moved(n.payload)
+                        else:
+                            notified = True
+                if not self._stop.is_set():
+                    self.refresh(conn)
+
+    def refresh(self, conn) -> int:
+        if self._watermark is None:
+            where, params = "embedded_at IS NOT NULL", (self.project_key,)
+        else:
+            where = "embedded_at > %s::timestamptz - make_interval(secs => %s)"
+            params = (self.project_key, self._watermark, VECTOR_INDEX_OVERLAP_S)
+        cur = conn.execute(f"""
+            SELECT jira_key, embedding, embedded_at
+            FROM jira_issues
+            WHERE project_key=%s AND embedding IS NOT NULL AND {where}
+        """, params, binary=True)
+        rows = [r for r in cur.fetchall() if self._ts.get(r[0]) != r[2]]
+        if not rows:
+            return 0
+        self._apply(rows)
+        self.stats["refreshes"] += 1
+        self.stats["refreshed_rows"] += len(rows)
+        self.stats["rows"] = self._n
+        return len(rows)
+
+    def _apply(self, rows):
+        wm = self._watermark
+        with self._write:
+            new_keys, new_vecs, upd_idx, upd_vecs = [], [], [], []
+            for key, emb, ts in rows:
+                v = pgvec.from_db(emb)
+                i = self._row.get(key)
+                if i is None:
+                    new_keys.append(key); new_vecs.append(v)
+                else:
+                    upd_idx.append(i); upd_vecs.append(v)
+                self._ts[key] = ts
+                if ts is not None and (wm is None or ts > wm):
+                    wm = ts
+
+            mat, n = self._mat, self._n
+            need = n + len(new_keys)
+            if mat is None or not mat.flags.writeable or need > mat.shape[0]:
+                # 按 1.25 倍预留容量，避免每次增量都整块复制
+                dim = (mat.shape[1] if mat is not None else len((new_vecs or upd_vecs)[0]))
+                grown = np.zeros((max(need, int(need * 1.25) + 64), dim), dtype=self.dtype)
+                if mat is not None:
+                    grown[:n] = mat[:n]
+                mat = grown
+            if upd_idx:
+                # 原地覆盖：检索持同一把锁，不会读到半新半旧的行
+                mat[upd_idx] = _normalize(np.vstack(upd_vecs)).astype(self.dtype)
+            if new_keys:
+                mat[n:need] = _normalize(np.vstack(new_vecs)).astype(self.dtype)
+                for j, k in enumerate(new_keys):
+                    self._row[k] = n + j
+                self._keys.extend(new_keys)
+            # 先写数据再发布行数，检索线程看到的 _n 行总是完整的
+            self._mat = mat
+            self._n = need
+            self._watermark = wm
+            self._dirty = True
+
+    def remove(self, key: str) -> bool:
+        """删除一行：最后一行挪到空位，再缩小可见行数。"""
+        with self._write:
+            i = self._row.pop(key, None)
+            if i is None:
+                return False
+            self._ts.pop(key, None)
+            last = self._n - 1
+            mat = self._mat
+            if not mat.flags.writeable:
+                mat = np.array(mat[:self._n])
+            # keys 换成新列表：正在检索的线程仍按旧列表取 key，不会越界
+            keys = self._keys[:last + 1]
+            if i != last:
+                mat[i] = mat[last]
+                keys[i] = keys[last]
+                self._row[keys[i]] = i
+            keys.pop()
+            self._keys = keys
+            self._mat = mat
+            self._n = last
+            self._dirty = True
+        self.stats["rows"] = self._n
+        self.stats["removed"] += 1
+        return True
+
+    def _moved(self, payload: str) -> bool:
+        """issue 换了项目：只有旧项目的索引删掉它（新项目那边由 embedded_at 增量加进来）。"""
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return False
+        if msg.get("from") != self.project_key:
+            return False
+        return self.remove(msg.get("key"))
+
+    # ---------- 检索 ----------
+    def _scores(self, mat, q: np.ndarray) -> np.ndarray:
+        if mat.dtype == np.float32:
+            return q @ mat.T
+        # float16 没有 BLAS：分块转成 float32 再乘
+        out = np.empty((q.shape[0], mat.shape[0]), dtype=np.float32)
+        for s in range(0, mat.shape[0], _F16_CHUNK):
+            out[:, s:s + _F16_CHUNK] = q @ mat[s:s + _F16_CHUNK].astype(np.float32).T
+        return out
+
+    def search_batch(self, query_vecs, k: int = 3) -> Optional[list]:
+        """返回与 query_vecs 等长的 [[(key, score), ...], ...]；未就绪返回 None（调用方走 Postgres）。"""
+        if not self.ready:
+            return None
+        if not query_vecs:
+            return []
+        q = _normalize(np.vstack([pgvec.to_f32(v) for v in query_vecs]))
+        with self._write:
+            # mat / n / keys 同一时刻取，打分期间不让 remove 挪行
+            mat, n, keys = self._mat, self._n, self._keys
+            if mat is None or n == 0:
+                return [[] for _ in query_vecs]
+            sims = self._scores(mat[:n], q)
+        # 之后 remove 只会换新的 keys 列表、_apply 只往后追加，手里这份 keys 与 sims 一致
+        kk = min(k, n)
+        top = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+        out = []
+        for r in range(sims.shape[0]):
+            idx = top[r][np.argsort(-sims[r, top[r]])]
+            out.append([(keys[i], float(sims[r, i])) for i in idx])
+        self.stats["searches"] += len(out)
+        return out
+
+    def snapshot(self) -> dict:
+        wm = self._watermark
+        return dict(self.stats, ready=self.ready, dtype=self.dtype.name, watermark=wm.isoformat() if wm else None,
+                    capacity=int(self._mat.shape[0]) if self._mat is not None else 0)
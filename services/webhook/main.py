@@ -1,26 +1,443 @@
-import hmac, hashlib, os, json
-import pika
-from fastapi import FastAPI, Header, Request, HTTPException
+import hmac, hashlib, os, json, time, asyncio, datetime as dt
+from collections import deque
+from contextlib import asynccontextmanager
+import aio_pika
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from fastapi import FastAPI, Header, Request, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD", "guest")
 GIT_SECRET = os.getenv("GIT_WEBHOOK_SECRET", "replace_me_github_secret")
 
+# 同时等待 broker 确认的消息上限（跨所有并发请求共享）
+PUBLISH_MAX_INFLIGHT = int(os.getenv("WEBHOOK_PUBLISH_MAX_INFLIGHT", "256"))
+PUBLISH_TIMEOUT = float(os.getenv("WEBHOOK_PUBLISH_TIMEOUT", "5"))
+# 超过该大小的 payload 放到线程池里解析，避免大 push 的 json.loads 卡住事件循环
+INLINE_PARSE_BYTES = int(os.getenv("WEBHOOK_INLINE_PARSE_BYTES", "65536"))
+
+# 入口去重：同一 (repo, commit SHA) 在 TTL 内只入队一次（GitHub 重试 / 多分支推同一 commit）
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_INGEST_TTL = int(os.getenv("DEDUP_INGEST_TTL", str(3 * 86400)))
+
+# push 级合并：一次 push 至少这么多个（去重后的）commit 时只发一条消息，core 合并成一张汇总卡片
+# 0 = 关闭，始终每个 commit 一条消息
+WEBHOOK_PUSH_COALESCE_MIN = int(os.getenv("WEBHOOK_PUSH_COALESCE_MIN", "0"))
+
+# 快速应答：验签、去重后放进进程内缓冲立即返回 202，后台攒批发布；broker 不可用时写本地追加日志（spill），
+# 连上后按顺序重放。进程崩溃最多丢缓冲里还没发出 / 写盘的消息（约一个刷新周期）
+FAST_ACK = os.getenv("WEBHOOK_FAST_ACK", "0") == "1"
+BUFFER_MAX = int(os.getenv("WEBHOOK_BUFFER_MAX", "10000"))        # 内存缓冲上限（条），满了直接写 spill
+FLUSH_BATCH = int(os.getenv("WEBHOOK_FLUSH_BATCH", "256"))
+FLUSH_MS = int(os.getenv("WEBHOOK_FLUSH_MS", "20"))
+BROKER_RETRY_S = float(os.getenv("WEBHOOK_BROKER_RETRY_S", "5"))  # 发布失败后多久再试（期间新消息直接写 spill）
+SPILL_DIR = os.getenv("WEBHOOK_SPILL_DIR", "/data/webhook-spill")
+SPILL_MAX_BYTES = int(os.getenv("WEBHOOK_SPILL_MAX_BYTES", str(1 << 30)))  # 超过后拒绝新请求（503，GitHub 会重试）
+
+# Jira webhook：Jira Cloud 配置了 secret 时带 X-Hub-Signature（HMAC-SHA256）；
+# 不支持签名的 Jira（Server/DC）在回调 URL 上带 ?token=<同一个 secret>
+JIRA_WEBHOOK_SECRET = os.getenv("JIRA_WEBHOOK_SECRET", "")
+
 QUEUE_RAW = "git_commit_raw"
+QUEUE_JIRA = "jira_issue_events"
+JIRA_EVENTS = ("jira:issue_created", "jira:issue_updated", "jira:issue_deleted")
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# ===== metrics =====
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+INGEST_SECONDS = Histogram("contextual_webhook_ingest_seconds", "End-to-end /ingest/git handling time", buckets=LATENCY_BUCKETS)
+PARSE_SECONDS = Histogram("contextual_webhook_parse_seconds", "Push payload parse time", buckets=LATENCY_BUCKETS)
+PUSHES = Counter("contextual_webhook_pushes_total", "Pushes received, by how they were enqueued (commits, coalesced)", ["mode"])
+PUBLISH_SECONDS = Histogram("contextual_webhook_publish_seconds", "Time to publish one push and get broker confirms", buckets=LATENCY_BUCKETS)
+COMMITS = Counter("contextual_webhook_commits_total", "Commits received, by outcome", ["outcome"])
+JIRA_EVENTS_TOTAL = Counter("contextual_webhook_jira_events_total", "Jira webhook events received, by event and outcome",
+                            ["event", "outcome"])
+BUFFER_DEPTH = Gauge("contextual_webhook_buffer_depth", "Messages waiting in the fast-ack buffer")
+SPILL_MESSAGES = Gauge("contextual_webhook_spill_messages", "Messages in the local spill log not yet replayed")
+SPILL_BYTES = Gauge("contextual_webhook_spill_bytes", "Bytes in the local spill log not yet replayed")
+OUTBOUND = Counter("contextual_webhook_outbound_total", "Fast-ack buffer messages by outcome (published, spilled, replayed, rejected)",
+                   ["outcome"])
+
+def log_event(tag: str, trace_id: str = None, **fields):
+    # 与 core/metrics.log_event 同格式：LOG_FORMAT=json 时一行一个 JSON
+    if LOG_FORMAT == "json":
+        rec = {"ts": dt.datetime.now(dt.timezone.utc).isoformat(timespec="milliseconds"), "svc": "webhook", "event": tag.lower()}
+        if trace_id is not None:
+            rec["trace_id"] = trace_id
+        rec.update(fields)
+        print(json.dumps(rec, ensure_ascii=False, default=str), flush=True)
+        return
+    kv = " ".join(f"{k}={v}" for k, v in fields.items())
+    print(f"[{tag}]" + (f" trace_id={trace_id}" if trace_id is not None else "") + (f" {kv}" if kv else ""), flush=True)
+
+class Publisher:
+    """进程级 asyncio 发布器。
+
+    - aio-pika RobustConnection：断线后在后台自动重连并恢复通道
+    - 通道开启 publisher confirms；一次 push 的消息并发发出，整批一起等待确认
+    - 信号量限制在途（未确认）消息数，broker 变慢时请求在这里排队而不是无限堆积
+    - 启动时 broker 不可用不影响进程启动：第一次发布时再连，连不上该请求报错（last_error 供 /health 查看）
+    """
+
+    def __init__(self, queue: str = QUEUE_RAW, max_inflight: int = PUBLISH_MAX_INFLIGHT, extra_queues=(QUEUE_JIRA,)):
+        self.queue = queue
+        self.extra_queues = tuple(extra_queues)
+        self._sem = asyncio.Semaphore(max_inflight)
+        self._start_lock = asyncio.Lock()
+        self._conn = None
+        self._ch = None
+        self.last_error = None
+
+    @property
+    def connected(self) -> bool:
+        return self._ch is not None and not self._ch.is_closed
+
+    async def start(self):
+        # 并发请求同时发现没连上时只建一条连接
+        async with self._start_lock:
+            if self._ch is not None:
+                return
+            try:
+                if self._conn is None:
+                    self._conn = await aio_pika.connect_robust(
+                        host=RABBITMQ_HOST, login=RABBITMQ_USER, password=RABBITMQ_PASSWORD, heartbeat=60,
+                        timeout=PUBLISH_TIMEOUT,
+                    )
+                ch = await self._conn.channel(publisher_confirms=True)
+                for q in (self.queue,) + self.extra_queues:
+                    await ch.declare_queue(q, durable=True)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            self._ch, self.last_error = ch, None
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+        self._conn, self._ch = None, None
+
+    async def _publish_one(self, body: bytes, queue: str):
+        async with self._sem:
+            # x-published-at：core 据此统计排队等待时间（消费滞后）
+            msg = aio_pika.Message(body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT, content_type="application/json",
+                                   headers={"x-published-at": time.time()})
+            await self._ch.default_exchange.publish(msg, routing_key=queue, timeout=PUBLISH_TIMEOUT)
+
+    async def publish_batch(self, bodies, queue: str = None):
+        if not bodies:
+            return 0
+        if self._ch is None:
+            # 启动时 broker 不可用：此时再连（快速应答模式下由 flusher 重试时连上）
+            await self.start()
+        await asyncio.gather(*(self._publish_one(b, queue or self.queue) for b in bodies))
+        return len(bodies)
+
+class BufferFull(RuntimeError):
+    pass
+
+class OutboundBuffer:
+    """快速应答模式的出站缓冲，只在事件循环里访问。
+
+    - put()：放进内存；满了直接追加到 spill；spill 也超过上限时抛 BufferFull
+    - 后台任务每 FLUSH_MS（或攒够 FLUSH_BATCH 条）按队列批量发布；失败的整批写进 spill，
+      之后 BROKER_RETRY_S 秒内新消息也直接写 spill，不再等超时
+    - spill 里有消息时先按文件顺序重放完，再发内存里的，整体保持先进先出
+      （只有正在发布的那一批失败、同时缓冲又溢出时会错位，core 不依赖 commit 顺序）
+    - spill 一行一条 {"q": 队列, "b": 消息体}；重放时先改名为 .replay，发完再删。
+      重放中途进程退出会从头重放，重复的 commit 由 core 去重
+    """
+
+    def __init__(self, publish, spill_dir: str = SPILL_DIR, max_buffer: int = BUFFER_MAX, batch: int = FLUSH_BATCH,
+                 flush_ms: int = FLUSH_MS, retry_s: float = BROKER_RETRY_S, spill_max_bytes: int = SPILL_MAX_BYTES):
+        self.publish = publish       # async (bodies, queue) -> None
+        self.spill_path = os.path.join(spill_dir, "outbound.spill")
+        self.replay_path = self.spill_path + ".replay"
+        self.max_buffer = max_buffer
+        self.batch = max(1, batch)
+        self.flush_s = flush_ms / 1000.0
+        self.retry_s = retry_s
+        self.spill_max_bytes = spill_max_bytes
+        self._buf = deque()
+        self._file_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = None
+        self._down_until = 0.0
+        self._replay_off = 0
+        self.spill_msgs = 0
+        self.spill_bytes = 0
+        self.stats = {"buffered": 0, "published": 0, "spilled": 0, "replayed": 0, "rejected": 0, "publish_errors": 0}
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        # 上次退出时没重放完的 spill
+        self.spill_msgs, self.spill_bytes = await asyncio.to_thread(self._scan)
+        if self.spill_msgs:
+            log_event("SPILL", pending=self.spill_msgs, bytes=self.spill_bytes, action="replay")
+        self._gauges()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+        # 最后一次：能发就发，发不出去的都落盘
+        await self.flush(replay=False)
+
+    def _scan(self):
+        n = size = 0
+        for path in (self.replay_path, self.spill_path):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for line in f:
+                        if line.endswith(b"\n"):
+                            n += 1
+                            size += len(line)
+        return n, size
+
+    def _gauges(self):
+        BUFFER_DEPTH.set(len(self._buf))
+        SPILL_MESSAGES.set(self.spill_msgs)
+        SPILL_BYTES.set(self.spill_bytes)
+
+    async def put(self, queue: str, bodies) -> str:
+        """整组放进缓冲，返回 "buffered" / "spilled"；放不下抛 BufferFull，调用方返回 503。"""
+        items = [(queue, b) for b in bodies]
+        if not items:
+            return "buffered"
+        if len(self._buf) + len(items) <= self.max_buffer:
+            self._buf.extend(items)
+            self.stats["buffered"] += len(items)
+            if len(self._buf) >= self.batch:
+                self._wake.set()
+            self._gauges()
+            return "buffered"
+        # 缓冲里较早的消息一起落盘，保持顺序
+        older = list(self._buf)
+        self._buf.clear()
+        try:
+            await self._spill(older + items)
+        except Exception:
+            self._buf.extendleft(reversed(older))
+            self.stats["rejected"] += len(items)
+            OUTBOUND.labels(outcome="rejected").inc(len(items))
+            raise
+        return "spilled"
+
+    async def _spill(self, items):
+        lines = b"".join(json.dumps({"q": q, "b": b.decode()}).encode() + b"\n" for q, b in items)
+        async with self._file_lock:
+            if self.spill_bytes + len(lines) > self.spill_max_bytes:
+                raise BufferFull(f"spill log full ({self.spill_bytes} bytes)")
+            await asyncio.to_thread(self._append, lines)
+            self.spill_msgs += len(items)
+            self.spill_bytes += len(lines)
+        self.stats["spilled"] += len(items)
+        OUTBOUND.labels(outcome="spilled").inc(len(items))
+        self._gauges()
+
+    def _append(self, data: bytes):
+        with open(self.spill_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_chunk(self, off: int, n: int):
+        """从 off 起读最多 n 条完整的行；返回 (items, 新 off, 是否已读到文件尾)。"""
+        items = []
+        with open(self.replay_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(off)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # 写了一半的行（崩溃时）：丢弃
+                off += len(line)
+                rec = json.loads(line)
+                items.append((rec["q"], rec["b"].encode(), len(line)))
+                if len(items) >= n:
+                    break
+        # 条数正好是 n 的整数倍时最后一块也是满的：按偏移判断是否到头
+        return items, off, len(items) < n or off >= size
+
+    async def _publish(self, items):
+        # 按队列分组、组内保持顺序
+        by_queue = {}
+        for q, b in items:
+            by_queue.setdefault(q, []).append(b)
+        for q, bodies in by_queue.items():
+            await self.publish(bodies, q)
+
+    def _broker_down(self, e: Exception, n: int):
+        self._down_until = time.monotonic() + self.retry_s
+        self.stats["publish_errors"] += 1
+        log_event("PUBLISH ERROR", error=f"{type(e).__name__}: {e}", messages=n, action="spill", retry_s=self.retry_s)
+
+    def _is_down(self) -> bool:
+        return time.monotonic() < self._down_until
+
+    async def _replay(self):
+        while self.spill_msgs and not self._is_down():
+            if not os.path.exists(self.replay_path):
+                async with self._file_lock:
+                    if not os.path.exists(self.spill_path):
+                        return
+                    os.replace(self.spill_path, self.replay_path)
+                    self._replay_off = 0
+            chunk, off, eof = await asyncio.to_thread(self._read_chunk, self._replay_off, self.batch)
+            if chunk:
+                try:
+                    await self._publish([(q, b) for q, b, _ in chunk])
+                except Exception as e:
+                    self._broker_down(e, len(chunk))
+                    return
+            self._replay_off = off
+            self.spill_msgs -= len(chunk)
+            self.spill_bytes -= sum(n for _, _, n in chunk)
+            self.stats["replayed"] += len(chunk)
+            OUTBOUND.labels(outcome="replayed").inc(len(chunk))
+            if eof:
+                async with self._file_lock:
+                    os.remove(self.replay_path)
+                    # 以磁盘为准重新计数（崩溃留下的半行不算）
+                    self.spill_msgs, self.spill_bytes = await asyncio.to_thread(self._scan)
+                log_event("SPILL", replayed=self.stats["replayed"], pending=self.spill_msgs)
+            self._gauges()
+
+    async def flush(self, replay: bool = True):
+        if replay:
+            await self._replay()
+        while self._buf:
+            batch = [self._buf.popleft() for _ in range(min(self.batch, len(self._buf)))]
+            # broker 不可用，或 spill 还没重放完（保持顺序）：直接落盘
+            if self._is_down() or self.spill_msgs:
+                try:
+                    await self._spill(batch)
+                except Exception as e:
+                    # spill 写不进去：放回缓冲，下个周期再试；put() 会因缓冲已满拒绝新请求
+                    self._buf.extendleft(reversed(batch))
+                    log_event("SPILL ERROR", error=f"{type(e).__name__}: {e}", buffered=len(self._buf))
+                    break
+                continue
+            try:
+                await self._publish(batch)
+            except Exception as e:
+                self._broker_down(e, len(batch))
+                self._buf.extendleft(reversed(batch))
+                continue
+            self.stats["published"] += len(batch)
+            OUTBOUND.labels(outcome="published").inc(len(batch))
+        self._gauges()
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log_event("FLUSH ERROR", error=f"{type(e).__name__}: {e}", buffered=len(self._buf))
+                await asyncio.sleep(self.flush_s)
 
-app = FastAPI()
+    def snapshot(self) -> dict:
+        return dict(self.stats, pending=len(self._buf), spill_messages=self.spill_msgs, spill_bytes=self.spill_bytes,
+                    broker_down=self._is_down())
 
-def _channel():
-    creds = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-    conn = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=creds))
-    ch = conn.channel()
-    ch.queue_declare(queue=QUEUE_RAW, durable=True)
-    return conn, ch
+class Deduper:
+    """Redis SET NX 原子占位；Redis 不可用时放行（fail-open）。"""
+
+    PREFIX = "ctx:dedup:ingest:"
+
+    def __init__(self, url: str = REDIS_URL, enabled: bool = DEDUP_ENABLED, ttl: int = DEDUP_INGEST_TTL):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._r = aioredis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5) if enabled else None
+        self.stats = {"suppressed": 0, "claimed": 0, "errors": 0}
+
+    def _key(self, repo: str, sha: str) -> str:
+        return f"{self.PREFIX}{repo}:{sha}"
+
+    async def claim(self, repo: str, shas):
+        """返回与 shas 等长的 bool：True = 首次出现，应当入队。"""
+        if not self.enabled or not shas:
+            return [True] * len(shas)
+        try:
+            async with self._r.pipeline(transaction=False) as pipe:
+                for sha in shas:
+                    pipe.set(self._key(repo, sha), "1", nx=True, ex=self.ttl)
+                res = [bool(x) for x in await pipe.execute()]
+        except RedisError as e:
+            self.stats["errors"] += 1
+            log_event("DEDUP", error=f"{type(e).__name__}: {e}", action="fail-open")
+            return [True] * len(shas)
+        n_new = sum(res)
+        self.stats["claimed"] += n_new
+        self.stats["suppressed"] += len(res) - n_new
+        return res
+
+    async def release(self, repo: str, shas):
+        # 入队失败要释放占位，否则 GitHub 重试会被当成重复
+        if not self.enabled or not shas:
+            return
+        try:
+            await self._r.delete(*[self._key(repo, s) for s in shas])
+        except RedisError as e:
+            self.stats["errors"] += 1
+            log_event("DEDUP", error=f"{type(e).__name__}: {e}", action="release-failed")
+
+    async def close(self):
+        if self._r is not None:
+            await self._r.aclose()
+
+publisher = Publisher()
+deduper = Deduper()
+# 发布时再取模块级 publisher（压测脚本会替换它）
+outbound = OutboundBuffer(lambda bodies, queue: publisher.publish_batch(bodies, queue=queue)) if FAST_ACK else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # broker 不可用也照常启动：/health 报告连接状态，发布时再连；快速应答模式下消息先落盘，连上后重放
+    try:
+        await publisher.start()
+    except Exception as e:
+        log_event("PUBLISHER", error=f"{type(e).__name__}: {e}",
+                  action="spill until broker is up" if outbound is not None else "connect on first publish")
+    if outbound is not None:
+        await outbound.start()
+    try:
+        yield
+    finally:
+        if outbound is not None:
+            await outbound.close()
+        await publisher.close()
+        await deduper.close()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    out = {"ok": True, "broker": {"connected": publisher.connected}}
+    if publisher.last_error:
+        out["broker"]["error"] = publisher.last_error
+    return out
+
+@app.get("/metrics")
+def prom_metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats")
+def stats():
+    out = {"dedup": dict(deduper.stats, enabled=deduper.enabled)}
+    if outbound is not None:
+        out["outbound"] = outbound.snapshot()
+    return out
 
 def verify_github_sig(sig256: str, body: bytes):
     if not sig256 or not sig256.startswith("sha256="):
@@ -28,31 +445,191 @@ def verify_github_sig(sig256: str, body: bytes):
     digest = hmac.new(GIT_SECRET.encode(), body, hashlib.sha256).hexdigest()
     return hmac.compare_digest(digest, sig256.split("=",1)[1])
 
-@app.post("/ingest/git")
-async def ingest(request: Request, x_hub_signature_256: str = Header(None)):
-    body = await request.body()
-    if not verify_github_sig(x_hub_signature_256, body):
-        raise HTTPException(status_code=401, detail="invalid signature")
+def commit_payload(repo: str, commit: dict) -> dict:
+    return {
+        "repo": repo,
+        "commit_hash": commit.get("id","")[:12],
+        "commit_sha": commit.get("id",""),
+        "author_email": commit.get("author",{}).get("email",""),
+        "message": commit.get("message",""),
+        "files_changed": len(commit.get("modified",[])+commit.get("added",[])+commit.get("removed",[]))
+    }
 
-    payload = json.loads(body)
+def build_messages(payload: dict):
+    """返回 (repo, [(commit_sha, body), ...], push)；push 为合并模式用的元信息与各 commit 的 payload。"""
     # 提取最小字段（为空则给默认）
     repo = payload.get("repository",{}).get("full_name","unknown/repo")
     tenant_id = "tenant-demo"
+    msgs, commits = [], []
     for commit in payload.get("commits",[]):
+        p = commit_payload(repo, commit)
         msg = {
             "schema_version":"1.0",
             "trace_id": commit.get("id",""),
             "tenant_id": tenant_id,
             "event_type":"git_commit_raw",
-            "payload":{
-                "repo": repo,
-                "commit_hash": commit.get("id","")[:12],
-                "author_email": commit.get("author",{}).get("email",""),
-                "message": commit.get("message",""),
-                "files_changed": len(commit.get("modified",[])+commit.get("added",[])+commit.get("removed",[]))
-            }
+            "payload": p,
+        }
+        msgs.append((commit.get("id",""), json.dumps(msg).encode()))
+        commits.append(p)
+    push = {"repo": repo, "ref": payload.get("ref",""), "head_sha": payload.get("after","") or (payload.get("head_commit") or {}).get("id",""),
+            "commits": commits}
+    return repo, msgs, push
+
+def build_push_message(push: dict, commits) -> bytes:
+    """整个 push 一条消息（event_type=git_push_raw）；trace_id 取 push 的 head SHA。"""
+    head = push["head_sha"] or commits[-1]["commit_sha"]
+    return json.dumps({
+        "schema_version":"1.0",
+        "trace_id": head,
+        "tenant_id": "tenant-demo",
+        "event_type":"git_push_raw",
+        "payload":{
+            "repo": push["repo"],
+            "ref": push["ref"],
+            "head_sha": head,
+            "commits": commits,
         }
-        conn, ch = _channel()
-        ch.basic_publish(exchange="", routing_key=QUEUE_RAW, body=json.dumps(msg).encode(), properties=pika.BasicProperties(delivery_mode=2))
-        conn.close()
-    return {"accepted": True}
+    }).encode()
+
+def _parse_push(body: bytes):
+    """坏载荷一律抛 ValueError（调用方回 400）：不是 JSON、不是对象、字段类型不对。"""
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"invalid JSON: {e}")
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be a JSON object")
+    try:
+        return build_messages(payload)
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"malformed push payload: {type(e).__name__}: {e}")
+
+@app.post("/ingest/git")
+async def ingest(request: Request, response: Response, x_hub_signature_256: str = Header(None)):
+    with INGEST_SECONDS.time():
+        out = await _ingest(request, x_hub_signature_256)
+    if outbound is not None:
+        response.status_code = 202
+    return out
+
+async def _enqueue(queue: str, bodies) -> str:
+    """快速应答模式放进缓冲（"buffered" / "spilled"）；否则直接发布并等确认（"published"）。"""
+    if outbound is not None:
+        try:
+            return await outbound.put(queue, bodies)
+        except BufferFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    t0 = time.perf_counter()
+    try:
+        await publisher.publish_batch(bodies, queue=queue)
+    except Exception as e:
+        # broker 不可用：503 让 GitHub / Jira 稍后重投
+        raise HTTPException(status_code=503, detail=f"broker unavailable: {type(e).__name__}: {e}")
+    PUBLISH_SECONDS.observe(time.perf_counter() - t0)
+    return "published"
+
+async def _ingest(request: Request, x_hub_signature_256: str):
+    body = await request.body()
+    if not verify_github_sig(x_hub_signature_256, body):
+        raise HTTPException(status_code=401, detail="invalid signature")
+
+    t0 = time.perf_counter()
+    try:
+        if len(body) > INLINE_PARSE_BYTES:
+            repo, msgs, push = await asyncio.to_thread(_parse_push, body)
+        else:
+            repo, msgs, push = _parse_push(body)
+    except ValueError as e:
+        # 与 /ingest/jira 一致：坏载荷重投也没用，回 400 而不是 500
+        log_event("INGEST BAD PAYLOAD", error=str(e)[:200])
+        raise HTTPException(status_code=400, detail=str(e))
+    PARSE_SECONDS.observe(time.perf_counter() - t0)
+
+    # 没有 SHA 的 commit 不参与去重
+    with_sha = [i for i, (sha, _) in enumerate(msgs) if sha]
+    fresh = [True] * len(msgs)
+    for i, ok in zip(with_sha, await deduper.claim(repo, [msgs[i][0] for i in with_sha])):
+        fresh[i] = ok
+    claimed = [sha for (sha, _), ok in zip(msgs, fresh) if ok and sha]
+    bodies = [b for (_, b), ok in zip(msgs, fresh) if ok]
+    trace_ids = [sha for (sha, _), ok in zip(msgs, fresh) if ok]
+    n_fresh = len(bodies)
+    coalesced = 0 < WEBHOOK_PUSH_COALESCE_MIN <= n_fresh
+    if coalesced:
+        bodies = [build_push_message(push, [c for c, ok in zip(push["commits"], fresh) if ok])]
+    if n_fresh:
+        PUSHES.labels(mode="coalesced" if coalesced else "commits").inc()
+    try:
+        where = await _enqueue(QUEUE_RAW, bodies)
+    except Exception as e:
+        COMMITS.labels(outcome="publish_failed").inc(n_fresh)
+        log_event("INGEST ERROR", repo=repo, error=f"{type(e).__name__}: {e}", trace_ids=trace_ids)
+        await deduper.release(repo, claimed)
+        raise
+    COMMITS.labels(outcome="enqueued").inc(n_fresh)
+    COMMITS.labels(outcome="duplicate").inc(len(msgs) - n_fresh)
+    # 每个 commit 一行，trace_id 与 core / 回调日志对得上；合并时再带上 push 的 trace_id
+    for tid in trace_ids:
+        log_event("INGEST", tid, repo=repo, **({"push": push["head_sha"]} if coalesced else {}),
+                  **({"queued": where} if outbound is not None else {}))
+    return {"accepted": True, "enqueued": n_fresh, "duplicates": len(msgs) - n_fresh, "coalesced": coalesced, "queued": where}
+
+def verify_jira(sig: str, token: str, body: bytes) -> bool:
+    if not JIRA_WEBHOOK_SECRET:
+        return False
+    if sig and sig.startswith("sha256="):
+        digest = hmac.new(JIRA_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(digest, sig.split("=",1)[1])
+    return bool(token) and hmac.compare_digest(token, JIRA_WEBHOOK_SECRET)
+
+def build_jira_message(payload: dict):
+    """返回 (event, jira_key, body)；不是 issue 增删改事件时 body 为 None。"""
+    event = payload.get("webhookEvent", "")
+    issue = payload.get("issue") or {}
+    key = issue.get("key", "")
+    if event not in JIRA_EVENTS or not key:
+        return event, key, None
+    msg = {
+        "schema_version":"1.0",
+        "trace_id": f"{key}@{payload.get('timestamp','')}",
+        "tenant_id": "tenant-demo",
+        "event_type":"jira_issue_event",
+        "payload":{
+            "event": event,
+            "jira_key": key,
+            # 删除事件只需要 key
+            "issue": {"key": key} if event == "jira:issue_deleted" else issue,
+            "timestamp": payload.get("timestamp"),
+        }
+    }
+    return event, key, json.dumps(msg).encode()
+
+@app.post("/ingest/jira")
+async def ingest_jira(request: Request, response: Response, token: str = None, x_hub_signature: str = Header(None)):
+    body = await request.body()
+    if not verify_jira(x_hub_signature, token, body):
+        raise HTTPException(status_code=401, detail="invalid signature")
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        JIRA_EVENTS_TOTAL.labels(event="unknown", outcome="bad").inc()
+        raise HTTPException(status_code=400, detail=f"invalid JSON: {e}")
+    if not isinstance(payload, dict):
+        JIRA_EVENTS_TOTAL.labels(event="unknown", outcome="bad").inc()
+        raise HTTPException(status_code=400, detail="payload must be a JSON object")
+    event, key, msg = build_jira_message(payload)
+    if msg is None:
+        JIRA_EVENTS_TOTAL.labels(event=event or "unknown", outcome="ignored").inc()
+        return {"accepted": False, "ignored": event}
+    try:
+        where = await _enqueue(QUEUE_JIRA, [msg])
+    except Exception as e:
+        JIRA_EVENTS_TOTAL.labels(event=event, outcome="publish_failed").inc()
+        log_event("JIRA INGEST ERROR", key, event=event, error=f"{type(e).__name__}: {e}")
+        raise
+    JIRA_EVENTS_TOTAL.labels(event=event, outcome="enqueued").inc()
+    log_event("JIRA INGEST", key, event=event)
+    if outbound is not None:
+        response.status_code = 202
+    return {"accepted": True, "jira_key": key, "event": event, "queued": where}
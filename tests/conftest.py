@@ -0,0 +1,30 @@
+"""服务代码不是包：按各服务镜像里的布局把目录放进 sys.path；webhook 的 main.py 按路径加载（整个会话只加载一次，
+Prometheus 指标重复注册会报错）。"""
+import os, sys, importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "core"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+# 被测模块在 import 时读取环境变量：没有 RabbitMQ / Redis，连接都指向本机关着的端口
+os.environ.update({
+    "RABBITMQ_HOST": "127.0.0.1", "WEBHOOK_PUBLISH_TIMEOUT": "1",
+    "DEDUP_ENABLED": "0", "JIRA_WEBHOOK_SECRET": "test-secret",
+    "PUBLIC_BASE_URL": "https://cb.example.com",
+})
+
+def load(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+@pytest.fixture(scope="session")
+def webhook():
+    return load("webhook_main", "services/webhook/main.py")
+
+@pytest.fixture(scope="session")
+def callback():
+    return load("callback_main", "services/callback/main.py")
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import main
+
+class Chan:
+    def __init__(self, fail: bool = False):
+        self.fail, self.events = fail, []
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if self.fail:
+            raise ConnectionError("broker gone")
+        self.events.append(("publish", routing_key, json.loads(body)))
+    def basic_ack(self, delivery_tag):
+        self.events.append(("ack", delivery_tag))
+    def basic_nack(self, delivery_tag, requeue):
+        self.events.append(("nack", delivery_tag, requeue))
+
+class Marks:
+    def __init__(self, chan):
+        self.chan = chan
+    def mark_many(self, keys):
+        self.chan.events.append(("mark", list(keys)))
+
+def _item(sha):
+    return {"trace_id": f"t-{sha}", "repo": "org/repo", "commit_hash": sha, "subject": f"fix {sha}",
+            "dedup_key": f"k:{sha}"}
+
+@pytest.fixture
+def chan(monkeypatch):
+    def make(fail=False):
+        ch = Chan(fail)
+        monkeypatch.setattr(main, "DEDUP", Marks(ch))
+        return ch
+    return make
+
+def test_deliver_marks_after_publish(chan):
+    ch = chan()
+    main.deliver(ch, 7, _item("a1"), "SCRUM-1", 0.9, [("SCRUM-1", 0.9)])
+    assert [e[0] for e in ch.events] == ["publish", "mark", "ack"]
+    assert ch.events[1] == ("mark", ["k:a1"])
+
+def test_failed_publish_is_requeued_without_mark(chan):
+    ch = chan(fail=True)
+    main.deliver(ch, 7, _item("a1"), "SCRUM-1", 0.9, [("SCRUM-1", 0.9)])
+    assert ch.events == [("nack", 7, True)]
+    ch = chan(fail=True)
+    push = {"trace_id": "p1", "repo": "org/repo", "commit_hash": "b2"}
+    main.deliver_push(ch, 8, push, [_item("b1"), _item("b2")], [("SCRUM-1", 0.9, None), ("SCRUM-2", 0.8, None)])
+    assert ch.events == [("nack", 8, True)]
+
+def test_push_marks_every_commit_once_published(chan):
+    ch = chan()
+    push = {"trace_id": "p1", "repo": "org/repo", "commit_hash": "b2"}
+    low = main.RECO_MIN_SCORE - 0.1
+    main.deliver_push(ch, 8, push, [_item("b1"), _item("b2")], [("SCRUM-1", 0.9, None), ("SCRUM-2", low, None)])
+    assert [e[0] for e in ch.events] == ["publish", "mark", "ack"]
+    assert ch.events[1] == ("mark", ["k:b1", "k:b2"])
@@ -0,0 +1,125 @@
+import socket, time
+
+import numpy as np
+import pytest
+import requests
+
+import embed_client
+import fakes
+from embed_client import BATCH, AdaptiveBatch, CircuitBreaker, EmbedClient, EmbedUnavailable
+
+DIM = 16
+
+@pytest.fixture(scope="module")
+def server():
+    srv, url, stats = fakes.start_embeddings(dim=DIM, latency_ms=0, per_item_ms=0, max_batch=4)
+    yield url, stats
+    srv.shutdown()
+
+def _client(url, **kw):
+    return EmbedClient(base=url + "/v1", dim=DIM, **kw)
+
+def test_413_splits_until_batches_fit(server):
+    url, _ = server
+    c = _client(url)
+    ctl = AdaptiveBatch(16)
+    texts = [f"text {i}" for i in range(10)]
+    vecs = c.embed(texts, priority=BATCH, retries=1, ctl=ctl)
+    assert len(vecs) == 10 and c.stats["splits"] > 0 and c.stats["errors"] > 0
+    # 拆开后结果与逐条请求一致、顺序不变
+    for t, v in zip(texts, vecs):
+        assert np.allclose(v, c.embed([t])[0])
+    assert ctl.failed_at is not None and ctl.size < ctl.failed_at
+
+def test_single_text_413_fails_without_retry(monkeypatch):
+    c = EmbedClient(base="http://127.0.0.1:9/v1", dim=DIM)
+    calls = []
+
+    def too_large(texts, timeout):
+        calls.append(len(texts))
+        r = requests.Response()
+        r.status_code = 413
+        raise requests.HTTPError("413 Payload Too Large", response=r)
+
+    monkeypatch.setattr(c, "_request", too_large)
+    monkeypatch.setattr(c, "_backoff", lambda *a: pytest.fail("should not back off"))
+    with pytest.raises(requests.HTTPError):
+        c.embed(["a very long text"], retries=3)
+    assert calls == [1]
+    # 4xx 不算服务故障
+    assert c.breaker.state == "closed"
+
+def test_adaptive_batch_stays_below_failing_size():
+    ctl = AdaptiveBatch(16, regrow_s=3600)
+    limit, failures = 20, []
+    for i in range(200):
+        n = ctl.size
+        if n > limit:
+            failures.append(i)
+            ctl.shrink(n)
+        else:
+            ctl.ok(n, 0.01)
+    # 每次失败都把上限压低，很快收敛，之后不再失败
+    assert len(failures) <= limit and max(failures) < 50
+    assert ctl.size <= limit
+
+def test_adaptive_batch_regrows_after_success_at_failed_size():
+    ctl = AdaptiveBatch(32, regrow_s=3600)
+    ctl.shrink(32)
+    assert (ctl.size, ctl.failed_at) == (16, 32)
+    for _ in range(10):
+        ctl.ok(ctl.size, 0.01)
+    assert ctl.size == 31
+    ctl.ok(32, 0.01)
+    assert ctl.failed_at is None
+
+def test_breaker_opens_after_consecutive_connection_errors():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()   # 端口关着：连接被拒
+    c = EmbedClient(base=f"http://127.0.0.1:{port}/v1", dim=DIM)
+    c.breaker = CircuitBreaker(failures=2, cooldown_s=60)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            c.embed(["x"], retries=0)
+    assert c.breaker.state == "open"
+    with pytest.raises(EmbedUnavailable):
+        c.embed(["x"], retries=0)
+    assert c.stats["rejected"] == 1 and c.breaker.opened == 1
+
+def test_breaker_half_open_probe_closes_on_success(server):
+    url, _ = server
+    c = _client(url)
+    c.breaker = CircuitBreaker(failures=1, cooldown_s=0)
+    c.breaker.failure()
+    assert c.breaker.state == "half_open"
+    assert len(c.embed(["probe"], retries=0)) == 1
+    assert c.breaker.state == "closed"
+
+@pytest.fixture(scope="module")
+def slow_server():
+    srv, url, stats = fakes.start_embeddings(dim=DIM, latency_ms=1000, per_item_ms=0)
+    yield url, stats
+    srv.shutdown()
+
+def test_live_timeout_gives_up_at_one_deadline(slow_server, monkeypatch):
+    url, _ = slow_server
+    monkeypatch.setattr(embed_client, "EMBED_TIMEOUT_S", 0.3)
+    c = _client(url)
+    t0 = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        c.embed([f"t{i}" for i in range(8)], retries=3)
+    # 在线请求：超时不拆分，重试也受同一个 deadline 限制
+    assert time.monotonic() - t0 < 1.0
+    assert c.stats["splits"] == 0 and c.stats["errors"] == 1
+
+def test_batch_timeout_still_splits(slow_server, monkeypatch):
+    url, _ = slow_server
+    monkeypatch.setattr(embed_client, "EMBED_BATCH_TIMEOUT_S", 0.2)
+    monkeypatch.setattr(embed_client, "EMBED_BACKOFF_S", 0.01)
+    c = _client(url)
+    ctl = AdaptiveBatch(4)
+    with pytest.raises(requests.Timeout):
+        c.embed([f"t{i}" for i in range(4)], priority=BATCH, retries=1, ctl=ctl)
+    assert c.stats["splits"] > 0 and ctl.failed_at is not None
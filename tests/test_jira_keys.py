@@ -0,0 +1,49 @@
+from jira_keys import KeyCache, find_keys
+
+class FakePool:
+    """只实现 KeyCache 用到的两条查询。"""
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.lookups = []
+
+    def connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None, prepare=False):
+        if params is None:
+            return [(k,) for k in self.keys]
+        self.lookups.append(set(params[0]))
+        return [(k,) for k in params[0] if k in self.keys]
+
+def test_find_keys_returns_every_candidate_in_order():
+    assert find_keys("fix utf-8 sha-256 iso-8859 for SCRUM-12, see scrum-12 and OPS-7") == \
+        ["UTF-8", "SHA-256", "ISO-8859", "SCRUM-12", "OPS-7"]
+
+def test_find_keys_skips_version_like_fragments():
+    assert find_keys("bump v1-2-3 and v1-2.3, closes SCRUM-4.") == ["SCRUM-4"]
+    assert find_keys("SCRUM-0 SCRUM-2a 1SCRUM-3 _SCRUM-4") == []
+    assert find_keys(None) == []
+
+def test_resolve_limits_after_validation():
+    cache = KeyCache(FakePool({"SCRUM-12", "SCRUM-13", "SCRUM-14", "SCRUM-15"}), max_keys=3)
+    text = "fix utf-8 sha-256 iso-8859 for SCRUM-12 SCRUM-13 SCRUM-14 SCRUM-15"
+    assert cache.resolve([find_keys(text), [], ["SCRUM-99"]]) == [["SCRUM-12", "SCRUM-13", "SCRUM-14"], [], []]
+    assert cache.stats["rejected"] == 4
+
+def test_resolve_looks_up_new_issue_once():
+    pool = FakePool({"SCRUM-1"})
+    cache = KeyCache(pool)
+    assert cache.resolve([["SCRUM-1"]]) == [["SCRUM-1"]]
+    pool.keys.add("SCRUM-2")
+    assert cache.resolve([["SCRUM-2", "SCRUM-3", "UTF-8"]]) == [["SCRUM-2"]]
+    # 未知项目前缀不查库；查不到的 key 在负缓存期内不再查
+    assert pool.lookups == [{"SCRUM-2", "SCRUM-3"}]
+    assert cache.resolve([["SCRUM-3"]]) == [[]]
+    assert len(pool.lookups) == 1
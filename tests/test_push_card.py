@@ -0,0 +1,150 @@
+import urllib.parse
+
+import pytest
+
+from dingtalk import PUSH_CARD_MAX_URL, render_push_card
+
+GROUPS = [
+    ("SCRUM-1", 0.91, [("aaa1", "fix login"), ("aaa2", "login test")]),
+    ("SCRUM-2", 0.80, [("bbb1", "export csv")]),
+    ("OPS-3", 0.70, [("ccc1", "deploy script")]),
+    ("OPS-4", 0.65, [("ddd1", "alert rule")]),
+]
+
+def _query(btn):
+    return dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(btn["actionURL"]).query))
+
+def test_group_buttons_carry_their_own_top1():
+    btns = render_push_card("head1", "head1", "org/repo", GROUPS[:3])["actionCard"]["btns"]
+    assert len(btns) == 4
+    for (key, _, commits), btn in zip(GROUPS[:3], btns):
+        q = _query(btn)
+        assert q["top1"] == q["selected"] == q["jira"] == key
+        assert q["feedback"] == "true"
+        assert q["commits"] == ",".join(h for h, _ in commits)
+        assert "groups" not in q
+
+def test_groups_beyond_two_share_one_confirm_button():
+    btns = render_push_card("head1", "head1", "org/repo", GROUPS)["actionCard"]["btns"]
+    assert len(btns) == 4
+    assert [_query(b)["commits"] for b in btns[:2]] == ["aaa1,aaa2", "bbb1"]
+    q = _query(btns[2])
+    assert q["feedback"] == "true" and "commits" not in q
+    assert q["groups"] == "OPS-3:ccc1;OPS-4:ddd1"
+
+def test_not_sure_keeps_each_commit_with_its_group():
+    q = _query(render_push_card("head1", "head1", "org/repo", GROUPS)["actionCard"]["btns"][-1])
+    assert q["feedback"] == "false"
+    assert "commits" not in q
+    assert q["groups"] == "SCRUM-1:aaa1,aaa2;SCRUM-2:bbb1;OPS-3:ccc1;OPS-4:ddd1"
+
+class _Cur:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params, prepare=False):
+        if "push_card_commits" in sql:
+            self.pool.lookups.append(params)
+            return
+        self.pool.params = params
+
+    def fetchall(self):
+        return list(self.pool.stored)
+
+    def fetchone(self):
+        return 1, len(self.pool.params["commits"]) if self.pool.params["feedback"] else 0
+
+class FakePool:
+    params = None
+
+    def __init__(self, stored=()):
+        self.stored, self.lookups = stored, []
+
+    def connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return _Cur(self)
+
+@pytest.fixture
+def pool(callback, monkeypatch):
+    p = FakePool()
+    monkeypatch.setattr(callback, "PG_POOL", p)
+    monkeypatch.setattr(callback, "LOG_WRITER", None)
+    return p
+
+def test_callback_group_confirm_is_not_a_correction(callback, pool):
+    q = _query(render_push_card("head1", "head1", "org/repo", GROUPS)["actionCard"]["btns"][1])
+    out = callback.cb(q["trace_id"], q["commit"], q["jira"], True, q["top1"], q["selected"], q["commits"])
+    assert out["corrected"] is None and out["linked"] == "SCRUM-2"
+    assert pool.params["commits"] == ["bbb1"]
+    assert pool.params["recommended"] == ["SCRUM-2"] and pool.params["corrected"] == [None]
+
+def test_callback_not_sure_logs_each_commit_against_its_top1(callback, pool):
+    q = _query(render_push_card("head1", "head1", "org/repo", GROUPS)["actionCard"]["btns"][-1])
+    out = callback.cb(q["trace_id"], q["commit"], q["jira"], False, q["top1"], q["selected"], groups=q["groups"])
+    assert out["commits"] == ["aaa1", "aaa2", "bbb1", "ccc1", "ddd1"]
+    assert pool.params["recommended"] == ["SCRUM-1", "SCRUM-1", "SCRUM-2", "OPS-3", "OPS-4"]
+    assert pool.params["corrected"] == [None] * 5
+    assert pool.params["feedback"] is False
+
+def test_callback_single_commit_correction(callback, pool):
+    out = callback.cb("t1", "abc", "SCRUM-1", True, top1="SCRUM-1", selected="SCRUM-9")
+    assert out["corrected"] == "SCRUM-9"
+    assert pool.params["commits"] == ["abc"]
+    assert pool.params["recommended"] == ["SCRUM-1"] and pool.params["corrected"] == ["SCRUM-9"]
+
+def test_callback_confirm_rest_links_each_commit_to_its_own_top1(callback, pool):
+    q = _query(render_push_card("head1", "head1", "org/repo", GROUPS)["actionCard"]["btns"][2])
+    out = callback.cb(q["trace_id"], q["commit"], q["jira"], True, q["top1"], q["selected"], groups=q["groups"])
+    assert out["commits"] == ["ccc1", "ddd1"] and out["linked"] == "OPS-3,OPS-4"
+    assert pool.params["finals"] == ["OPS-3", "OPS-4"] and pool.params["projects"] == ["OPS", "OPS"]
+    assert pool.params["corrected"] == [None, None]
+
+def _big_push():
+    # 约 200 个 commit：一个 150 个 commit 的大组 + 10 个小组
+    sha = lambda i: f"{i:040x}"
+    groups = [("SCRUM-1", 0.9, [(sha(i), f"change {i}") for i in range(150)])]
+    groups += [(f"OPS-{g}", 0.8 - g / 100, [(sha(1000 + g * 10 + j), "fix") for j in range(5)]) for g in range(10)]
+    return groups
+
+def test_big_push_urls_stay_short_and_fall_back_to_lookup():
+    groups = _big_push()
+    card = render_push_card("t-big", groups[0][2][0][0], "org/repo", groups)["actionCard"]
+    btns = card["btns"]
+    assert len(btns) == 4 and all(len(b["actionURL"]) <= PUSH_CARD_MAX_URL for b in btns)
+    assert _query(btns[0])["commits"] == "*"
+    assert _query(btns[1])["commits"] == ",".join(h for h, _ in groups[1][2])
+    q = _query(btns[2])
+    assert q["groups"] == "*" and q["skip"] == "SCRUM-1,OPS-0" and q["feedback"] == "true"
+    assert _query(btns[3])["groups"] == "*"
+    assert "200 个 commit" in card["title"]
+
+def test_callback_big_push_looks_up_commits_by_trace_id(callback, monkeypatch):
+    groups = _big_push()
+    stored = [(h, key) for key, _, commits in groups for h, _ in commits]
+    btns = render_push_card("t-big", groups[0][2][0][0], "org/repo", groups)["actionCard"]["btns"]
+    cases = [(btns[0], 150, {"SCRUM-1"}), (btns[2], 45, {f"OPS-{g}" for g in range(1, 10)}), (btns[3], 200, None)]
+    for btn, n, keys in cases:
+        p = FakePool(stored)
+        monkeypatch.setattr(callback, "PG_POOL", p)
+        monkeypatch.setattr(callback, "LOG_WRITER", None)
+        q = _query(btn)
+        out = callback.cb(q["trace_id"], q["commit"], q["jira"], q["feedback"] == "true", q["top1"], q["selected"],
+                          q.get("commits"), q.get("groups"), q.get("skip"))
+        assert p.lookups == [("t-big",)] and len(out["commits"]) == n
+        if keys is not None:
+            assert set(p.params["finals"]) == keys
+        assert p.params["recommended"] == [dict((h, k) for h, k in stored)[c] for c in out["commits"]]
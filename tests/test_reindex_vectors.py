@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import load
+
+F32_HNSW = ("idx_jira_issues_embedding_hnsw", "hnsw",
+            "CREATE INDEX idx_jira_issues_embedding_hnsw ON public.jira_issues USING hnsw (embedding vector_cosine_ops)")
+HALF_HNSW = ("idx_jira_issues_embedding_hnsw_halfvec", "hnsw",
+             "CREATE INDEX idx_jira_issues_embedding_hnsw_halfvec ON public.jira_issues "
+             "USING hnsw (((embedding)::halfvec(1024)) halfvec_cosine_ops)")
+BIN_IVF = ("idx_jira_issues_embedding_cosine_binary", "ivfflat",
+           "CREATE INDEX idx_jira_issues_embedding_cosine_binary ON public.jira_issues "
+           "USING ivfflat (((binary_quantize(embedding))::bit(1024)) bit_hamming_ops)")
+BIN_LEFTOVER = ("idx_jira_issues_embedding_hnsw_binary", "hnsw",
+                "CREATE INDEX idx_jira_issues_embedding_hnsw_binary ON public.jira_issues "
+                "USING hnsw (((binary_quantize(embedding))::bit(1024)) bit_hamming_ops)")
+
+class _Cur:
+    def __init__(self, indexes):
+        self.indexes, self.sql = indexes, ""
+    def __enter__(self):
+        return self
+    def __exit__(self, *a):
+        pass
+    def execute(self, q, params=None):
+        self.sql = q
+    def fetchone(self):
+        return (5000,)
+    def fetchall(self):
+        return list(self.indexes) if "pg_index" in self.sql else []
+
+class _Conn:
+    def __init__(self, indexes):
+        self.indexes = indexes
+    def __enter__(self):
+        return self
+    def __exit__(self, *a):
+        pass
+    def cursor(self):
+        return _Cur(self.indexes)
+
+@pytest.fixture(scope="module")
+def job():
+    return load("reindex_vectors", "services/core/jobs/reindex_vectors.py")
+
+def _dropped(job, monkeypatch, capsys, indexes, **kw):
+    monkeypatch.setattr(job, "pg_conn", lambda: _Conn(indexes))
+    job.run(dry_run=True, **kw)
+    steps = [s.strip() for s in capsys.readouterr().out.splitlines()]
+    return {s.rsplit(" ", 1)[1].rstrip(";") for s in steps if s.startswith("DROP INDEX")}
+
+def test_quant_build_keeps_float32_index(job, monkeypatch, capsys):
+    dropped = _dropped(job, monkeypatch, capsys, [F32_HNSW, HALF_HNSW, BIN_LEFTOVER], quant="binary")
+    assert dropped == {"idx_jira_issues_embedding_hnsw_binary_new", "idx_jira_issues_embedding_hnsw_binary"}
+
+def test_float32_build_keeps_quant_and_other_method(job, monkeypatch, capsys):
+    dropped = _dropped(job, monkeypatch, capsys, [F32_HNSW, HALF_HNSW, BIN_IVF], method="hnsw")
+    assert dropped == {"idx_jira_issues_embedding_hnsw_new", "idx_jira_issues_embedding_hnsw"}
+
+def test_replace_all_drops_every_table_wide_index(job, monkeypatch, capsys):
+    dropped = _dropped(job, monkeypatch, capsys, [F32_HNSW, HALF_HNSW, BIN_IVF], quant="binary", replace_all=True)
+    assert dropped == {"idx_jira_issues_embedding_hnsw_binary_new", "idx_jira_issues_embedding_hnsw",
+                       "idx_jira_issues_embedding_hnsw_halfvec", "idx_jira_issues_embedding_cosine_binary"}
@@ -0,0 +1,74 @@
+import datetime as dt, json, threading
+
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex
+
+T0 = dt.datetime(2025, 1, 1, tzinfo=dt.timezone.utc)
+
+def _vec(i, dim=8):
+    v = np.zeros(dim, dtype=np.float32)
+    v[i] = 1.0
+    return v
+
+def _index(dtype="float32"):
+    vi = VectorIndex("SCRUM", dsn="", model="m", dtype=dtype, snapshot_dir="")
+    vi.ready = True
+    return vi
+
+def _top1(vi, q):
+    return vi.search_batch([q], k=1)[0][0]
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_update_overwrites_row_in_place(dtype):
+    vi = _index(dtype)
+    vi._apply([(f"SCRUM-{i}", _vec(i), T0) for i in range(4)])
+    assert vi._n == 4 and _top1(vi, _vec(2))[0] == "SCRUM-2"
+    # SCRUM-2 重新 embedding：原地覆盖，不新增行
+    vi._apply([("SCRUM-2", _vec(5), T0 + dt.timedelta(seconds=1))])
+    assert vi._n == 4 and vi._keys.count("SCRUM-2") == 1
+    key, score = _top1(vi, _vec(5))
+    assert key == "SCRUM-2" and score == pytest.approx(1.0, abs=1e-3)
+    assert vi._watermark == T0 + dt.timedelta(seconds=1)
+
+def test_remove_moves_last_row_into_gap():
+    vi = _index()
+    vi._apply([(f"SCRUM-{i}", _vec(i), T0) for i in range(4)])
+    assert vi.remove("SCRUM-1") and not vi.remove("SCRUM-1")
+    assert vi._n == 3 and sorted(vi._keys) == ["SCRUM-0", "SCRUM-2", "SCRUM-3"]
+    assert all(vi._keys[i] == k for k, i in vi._row.items())
+    assert _top1(vi, _vec(3))[0] == "SCRUM-3"
+    assert "SCRUM-1" not in {k for k, _ in vi.search_batch([_vec(1)], k=3)[0]}
+    # 删除后再追加、再覆盖，行号仍然一致
+    vi._apply([("SCRUM-9", _vec(6), T0), ("SCRUM-3", _vec(7), T0)])
+    assert vi._n == 4 and _top1(vi, _vec(6))[0] == "SCRUM-9" and _top1(vi, _vec(7))[0] == "SCRUM-3"
+    assert all(vi._keys[i] == k for k, i in vi._row.items())
+
+def test_remove_last_row_and_search_empty():
+    vi = _index()
+    vi._apply([("SCRUM-1", _vec(1), T0)])
+    assert vi.remove("SCRUM-1")
+    assert vi._n == 0 and vi.search_batch([_vec(1)]) == [[]]
+    assert vi.stats["removed"] == 1
+
+def test_moved_removes_only_from_old_project():
+    vi = _index()
+    vi._apply([(f"SCRUM-{i}", _vec(i), T0) for i in range(3)])
+    assert not vi._moved(json.dumps({"key": "SCRUM-1", "from": "OPS"}))
+    assert not vi._moved("not json")
+    assert vi._moved(json.dumps({"key": "SCRUM-1", "from": "SCRUM"}))
+    assert vi._n == 2 and "SCRUM-1" not in vi._row
+
+def test_search_waits_for_writer():
+    vi = _index()
+    vi._apply([(f"SCRUM-{i}", _vec(i), T0) for i in range(4)])
+    out = []
+    with vi._write:
+        t = threading.Thread(target=lambda: out.append(_top1(vi, _vec(3))))
+        t.start()
+        t.join(0.2)
+        # 写入（remove 挪行）持锁期间检索不读矩阵
+        assert t.is_alive() and not out
+    t.join(5)
+    assert out and out[0][0] == "SCRUM-3"
@@ -0,0 +1,85 @@
+import os, json, asyncio, hashlib, hmac
+
+import pytest
+from fastapi.testclient import TestClient
+
+JIRA_EVENT = {"webhookEvent": "jira:issue_updated", "timestamp": 1700000000000,
+              "issue": {"key": "SCRUM-1", "fields": {"summary": "Login fails"}}}
+
+@pytest.fixture
+def client(webhook):
+    # 不进 lifespan：不连 broker
+    return TestClient(webhook.app)
+
+@pytest.mark.parametrize("body", [b"", b"{not json", b"\xff\xfe", b"[1, 2]"])
+def test_ingest_jira_rejects_malformed_body(client, body):
+    r = client.post("/ingest/jira?token=test-secret", content=body)
+    assert r.status_code == 400
+
+@pytest.mark.parametrize("inline", [True, False])
+@pytest.mark.parametrize("body", [b"", b"{not json", b"\xff\xfe", b"[1, 2]", b'{"repository": []}', b'{"commits": ["x"]}'])
+def test_ingest_git_rejects_malformed_body(client, webhook, monkeypatch, body, inline):
+    # 大 payload 在线程池里解析，两条路径都要回 400
+    monkeypatch.setattr(webhook, "INLINE_PARSE_BYTES", 1 << 20 if inline else 0)
+    sig = "sha256=" + hmac.new(webhook.GIT_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    r = client.post("/ingest/git", content=body, headers={"X-Hub-Signature-256": sig})
+    assert r.status_code == 400
+
+def test_ingest_jira_ignores_other_events(client):
+    r = client.post("/ingest/jira?token=test-secret", content=json.dumps({"webhookEvent": "comment_created"}))
+    assert r.status_code == 200 and r.json()["accepted"] is False
+
+def test_ingest_jira_broker_down_is_503(client, webhook):
+    assert webhook.outbound is None
+    r = client.post("/ingest/jira?token=test-secret", content=json.dumps(JIRA_EVENT))
+    assert r.status_code == 503
+    assert client.get("/health").json()["broker"]["connected"] is False
+
+class Recorder:
+    def __init__(self, fail_after=None):
+        self.sent = []
+        self.calls = 0
+        self.fail_after = fail_after
+
+    async def __call__(self, bodies, queue):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise ConnectionError("broker down")
+        self.sent.extend(bodies)
+
+async def _spill_then_replay(webhook, spill_dir, n, publish):
+    # max_buffer=0：每条都直接落盘
+    buf = webhook.OutboundBuffer(publish, spill_dir=str(spill_dir), max_buffer=0, batch=4, retry_s=0)
+    for i in range(n):
+        assert await buf.put("q", [f"m{i}".encode()]) == "spilled"
+    await buf.flush()
+    return buf
+
+@pytest.mark.parametrize("n", [3, 4, 7, 8, 9])
+def test_replay_removes_spill_at_batch_boundary(webhook, tmp_path, n):
+    rec = Recorder()
+    buf = asyncio.run(_spill_then_replay(webhook, tmp_path, n, rec))
+    assert rec.sent == [f"m{i}".encode() for i in range(n)]
+    assert buf.spill_msgs == 0 and buf.stats["replayed"] == n
+    assert not os.path.exists(buf.replay_path) and not os.path.exists(buf.spill_path)
+
+    # 重启：没有残留的 spill，不会重发
+    again = Recorder()
+    buf2 = webhook.OutboundBuffer(again, spill_dir=str(tmp_path), batch=4, retry_s=0)
+    assert buf2._scan() == (0, 0)
+    asyncio.run(buf2.flush())
+    assert again.sent == []
+
+def test_replay_cut_short_resumes_from_start_after_restart(webhook, tmp_path):
+    rec = Recorder(fail_after=1)
+    buf = asyncio.run(_spill_then_replay(webhook, tmp_path, 8, rec))
+    assert rec.sent == [f"m{i}".encode() for i in range(4)]
+    assert os.path.exists(buf.replay_path)
+
+    again = Recorder()
+    buf2 = webhook.OutboundBuffer(again, spill_dir=str(tmp_path), batch=4, retry_s=0)
+    buf2.spill_msgs, buf2.spill_bytes = buf2._scan()
+    assert buf2.spill_msgs == 8
+    asyncio.run(buf2.flush())
+    assert again.sent == [f"m{i}".encode() for i in range(8)]
+    assert not os.path.exists(buf2.replay_path)